@@ -13,21 +13,29 @@
 #   <matrix type> is the matrix type, i.e., dense or sparse
 #   <sample dimension> is the dimensino of each sample for the input
 #
+# The binary format stores exactly one sample per sequence for dense inputs.
+# Inputs with sequences of several samples therefore have to be declared as
+# sparse. Their samples can nevertheless be given as dense values in the
+# input file, e.g. "|x 0 1.5 0", they are converted to sparse samples.
+#
+# Chunks are parsed with NumPy and converted in parallel by a pool of worker
+# processes (see --numWorkers). The chunks are written in input order, so the
+# output does not depend on the number of workers.
 
 import sys
 import argparse
+import io
+import os
 import re
 import struct
-import tempfile
-import shutil
-import os
+import multiprocessing
+import numpy as np
 
 # This will convert data in the ctf format into binary format
 class Converter(object):
     def __init__(self, name, sampleDim):
         self.name = name
         self.sampleDim = sampleDim
-        self.vals = list()
 
     def getName(self):
         return self.name
@@ -35,57 +43,32 @@ class Converter(object):
     def getSampleDim(self):
         return self.sampleDim
 
-    def clear(self):
-        self.vals = list()
-
-    def addSequence(self):
-        self.vals.append(list())
-
-    def appendSample(self, sample):
-        if( len(sample) != self.sampleDim ):
-            print( "Invalid sample dimension for input {0}" ).format( self.name )
-            sys.exit()
-        if( len(self.vals) == 0 ):
-            self.vals.append( list() )
-
-        self.vals[-1].append( sample )
-
-    def toString(self):
-        output = ""
-        for seq in self.vals:
-            for samp in seq:
-                output += "\t" + " ".join(samp )
-            output += "\n"
-        return output
-
 
 # Specilization for dense inputs
 class DenseConverter(Converter):
     def __init__(self, name, sampleDim):
         Converter.__init__(self, name, sampleDim)
-    
+
     def headerBytes(self):
-        output = ""
         # First is the matrix type. Dense is type 0
-        output += struct.pack( "i", 0 )
         # Next is the elem type, currently float only
-        output += struct.pack( "i", 0 )
-        # Finally is whether or not this is a sequence
-        output += struct.pack( "i", self.sampleDim )
-
-        return output
+        # Finally is the sample dimension
+        return struct.pack( "iii", 0, 0, self.sampleDim )
 
-    
-    def toBytes(self):
-        output = ""
-        for sequence in self.vals:
+    # samples is a list per sequence of the value strings of each sample
+    def toBytes(self, samples):
+        tokens = []
+        for sequence in samples:
             if( len(sequence) != 1 ):
-                print( "Converter does not support dense sequences." )
-                sys.exit()
-            for sample in sequence[0]:
-                output += struct.pack( "f", float(sample) )
+                raise ValueError( "Converter does not support dense sequences "
+                    "for input {0}, declare it as sparse in the header instead.".format( self.name ) )
+            tokens.extend( sequence[0] )
 
-        return output
+        values = ParseValues( b" ".join( tokens ), len( tokens ), self.name )
+        if( len(values) != len(samples) * self.sampleDim ):
+            raise ValueError( "Invalid sample dimension for input {0}".format( self.name ) )
+
+        return values.astype( np.float32 ).tobytes()
 
 
 # Specialization for sparse inputs
@@ -93,78 +76,132 @@ class SparseConverter(Converter):
     def __init__(self, name, sampleDim):
         Converter.__init__(self, name, sampleDim)
 
-    def appendSample(self, sample):
-        for samp in sample:
-            if( int(samp.split(":")[0]) >= self.sampleDim ):
-                print( "Invalid sample dimension for input {0}. Max {1}, given {2}" ).format( self.name, self.sampleDim, sample.split( ":" )[0] )
-                sys.exit()
-        if( len(self.vals) == 0 ):
-            self.vals.append( list() )
-
-        self.vals[-1].append( sample )
-
     def headerBytes(self):
-        output = ""
         # First is the matrix type. Sparse is type 1
-        output += struct.pack( "i", 1 )
         # Next is the storage type, currently sparse csc only
-        output += struct.pack( "i", 0 )
         # Next is the elem type, currently float only
-        output += struct.pack( "i", 0 )
         # Next is whether or not this is a sequence
         # Note this is currently ignored
-        output += struct.pack( "i", 1 )
         # Finally is the sample dimension
-        output += struct.pack( "i", self.sampleDim )
-
-        return output
-
-    def toBytes(self):
-        output = ""
-        values = list()
-        rowInd = list()
-        colInd = [0]
-        nnz = 0
-        for sequence in self.vals:
-            i = 0
-            for sample in sequence:
-                # sort the indices least to greatest
-                sample.sort(key=lambda x: int(x.split(":")[0]))
-                for ele in sample:
-                    nnz += 1
-                    ind, val = ele.split(":")
-                    rowInd.append( int(ind) + i * self.sampleDim )
-                    values.append( val ) 
-                i += 1
-            colInd.append( nnz )
-
-        output += struct.pack( "i", nnz )
-        output += "".join( [ struct.pack( "f", float(val) ) for val in values ] )
-        output += "".join( [ struct.pack( "i", int(ind) ) for ind in rowInd ] )
-        output += "".join( [ struct.pack( "i", int(ind) ) for ind in colInd ] )
-
-        return output
-
-
-# Parse an entire sequence given an aliasToId map, and the converters
-def ParseSequence( aliasToId, curSequence, converters ):
-    for des in converters:
-        des.addSequence()
+        return struct.pack( "iiiii", 1, 0, 0, 1, self.sampleDim )
+
+    # samples is a list per sequence of the value strings of each sample
+    def toBytes(self, samples):
+        # index:value tokens of all samples are parsed at once, samples given
+        # as dense values are parsed separately
+        tokens = []
+        tokenCounts = []
+        tokenSamples = []
+        dense = []
+        for seqIndex, sequence in enumerate( samples ):
+            for sampleIndex, sample in enumerate( sequence ):
+                if( len(sample) > 0 and b":" not in sample[0] ):
+                    values = ParseValues( b" ".join( sample ), len( sample ), self.name )
+                    if( len(values) != self.sampleDim ):
+                        raise ValueError( "Invalid sample dimension for input {0}".format( self.name ) )
+                    nonZero = np.flatnonzero( values )
+                    dense.append( ( nonZero, values[ nonZero ],
+                        np.full( len(nonZero), seqIndex ), np.full( len(nonZero), sampleIndex * self.sampleDim ) ) )
+                else:
+                    tokens.extend( sample )
+                    tokenCounts.append( len(sample) )
+                    tokenSamples.append( ( seqIndex, sampleIndex * self.sampleDim ) )
+
+        pairs = ParseValues( b" ".join( tokens ).replace( b":", b" " ), 2 * len( tokens ), self.name )
+        tokenSamples = np.asarray( tokenSamples, dtype=np.int64 ).reshape( -1, 2 )
+        parts = [ ( pairs[0::2], pairs[1::2],
+            np.repeat( tokenSamples[:, 0], tokenCounts ), np.repeat( tokenSamples[:, 1], tokenCounts ) ) ] + dense
+        indices, values, sequenceIds, sampleOffsets = [ np.concatenate( p ) for p in zip( *parts ) ]
+        indices = indices.astype( np.int64 )
+
+        if( np.any( indices >= self.sampleDim ) or np.any( indices < 0 ) ):
+            raise ValueError( "Invalid sample dimension for input {0}. Max {1}, given {2}".format(
+                self.name, self.sampleDim, indices.max() ) )
+
+        # sort by sequence, sample and index (least to greatest)
+        order = np.lexsort( ( indices, sampleOffsets, sequenceIds ) )
+        rowInd = indices[ order ] + sampleOffsets[ order ]
+        colInd = np.concatenate( ( [0], np.cumsum( np.bincount( sequenceIds, minlength=len(samples) ) ) ) )
+
+        return b"".join( [
+            struct.pack( "i", len(rowInd) ),
+            values[ order ].astype( np.float32 ).tobytes(),
+            rowInd.astype( np.int32 ).tobytes(),
+            colInd.astype( np.int32 ).tobytes() ] )
+
+
+# Parse whitespace separated numbers, the values are parsed as double like
+# Python's float() does and only then rounded to the element type.
+def ParseValues( text, count, name ):
+    values = np.fromstring( text, dtype=np.float64, sep=" " ) if count > 0 else np.zeros( 0 )
+    if( len(values) != count ):
+        raise ValueError( "Invalid value in input {0}".format( name ) )
+    return values
+
+# Parse an entire sequence given an aliasToId map. Returns for every converter
+# the list of samples (each a list of value strings) and the number of samples
+# of the sequence.
+def ParseSequence( aliasToId, curSequence, numConverters ):
+    samples = [ list() for _ in range(numConverters) ]
     for line in curSequence:
-        for input in line.split( "|" )[1:]:
+        for input in line.split( b"|" )[1:]:
             vals = input.split()
             # We need to ignore comments
-            if( vals[0] != "#" ):
-                converters[aliasToId[vals[0]]].appendSample( vals[1:] )
-    return max( [ len(des.vals[ -1 ]) for des in converters ] )
-
-# Output a binary chunk
-def OutputChunk( binfile, converters ):
-    startPos = binfile.tell()
-    for des in converters:
-        binfile.write( des.toBytes() )
-        des.clear()
-    return startPos
+            if( len(vals) > 0 and vals[0] != b"#" ):
+                samples[ aliasToId[ vals[0] ] ].append( vals[1:] )
+    return samples, max( [ len(s) for s in samples ] )
+
+# Initializes a worker process of the conversion pool
+def InitWorker( aliasToId, converters ):
+    global workerAliasToId, workerConverters
+    workerAliasToId = aliasToId
+    workerConverters = converters
+
+# Convert the sequences of one chunk into the binary chunk data. Returns the
+# data, the number of sequences and the number of samples in the chunk.
+def ConvertChunk( sequences ):
+    chunkSamples = [ list() for _ in workerConverters ]
+    numSamples = 0
+    for sequence in sequences:
+        samples, count = ParseSequence( workerAliasToId, sequence, len(workerConverters) )
+        numSamples += count
+        for perChunk, perSequence in zip( chunkSamples, samples ):
+            perChunk.append( perSequence )
+
+    data = b"".join( [ conv.toBytes( samples ) for conv, samples in zip( workerConverters, chunkSamples ) ] )
+    return data, len(sequences), numSamples
+
+# Iterate over the sequences of a CNTK text format file. A sequence is a list
+# of lines, a new sequence starts if the sequence id is empty or differs from
+# the id in the line before. Empty lines are skipped.
+def ReadSequences( inputFile ):
+    curSequence = list()
+    prevId = None
+    for line in inputFile:
+        line = line.rstrip()
+        if( not line ):
+            continue
+        id = line.split( b"|", 1 )[0]
+        if( not id or prevId != id ):
+            if( len(curSequence) > 0 ):
+                yield curSequence
+                curSequence = list()
+            prevId = id
+        curSequence.append( line )
+
+    if( len(curSequence) > 0 ):
+        yield curSequence
+
+# Group sequences into chunks of seqsPerChunk sequences
+def ReadChunks( inputFile, seqsPerChunk ):
+    chunk = list()
+    for sequence in ReadSequences( inputFile ):
+        chunk.append( sequence )
+        if( len(chunk) == seqsPerChunk ):
+            yield chunk
+            chunk = list()
+    if( len(chunk) > 0 ):
+        yield chunk
 
 # Get a converter from a type
 def GetConverter( inputtype, name, sampleDim ):
@@ -174,42 +211,81 @@ def GetConverter( inputtype, name, sampleDim ):
     elif( inputtype.lower() == 'sparse' ):
         converter = SparseConverter( name, sampleDim )
     else:
-        print( 'Invalid input format {0}' ).format( inputtype )
-        sys.exit()
+        raise ValueError( 'Invalid input format {0}'.format( inputtype ) )
 
-    return converter 
+    return converter
+
+# Parse the header to get the converters for this file
+# <name>    <alias>  <input format>  <sample size>
+def ReadHeader( headerfile ):
+    converters = []
+    aliasToId = dict()
+    for line in headerfile:
+        if( not line.strip() ):
+            continue
+        split = re.split(r'\t+', line.strip())
+        aliasToId[ split[ 1 ].encode('ascii') ] = len(converters)
+        converters.append( GetConverter( split[ 2 ], split[ 0 ], int(split[3]) ) )
+    return converters, aliasToId
 
 # Output the binary format header.
-def OutputHeader( headerFile, converters ):
+def OutputHeader( binfile, converters, numChunks ):
     # First the version number
-    headerFile.write( struct.pack( "q", 1 ) )
-    # Next is the number of chunks, but we don't know what this is, so write a
-    # placeholder
-    headerFile.write( struct.pack( "q", 0 ) )
+    binfile.write( struct.pack( "q", 1 ) )
+    # Next is the number of chunks
+    binfile.write( struct.pack( "q", numChunks ) )
     # Finally the number of inputs
-    headerFile.write( struct.pack( "i", len(converters) ) )
+    binfile.write( struct.pack( "i", len(converters) ) )
     for conv in converters:
         # first comes the name. This is common so write it first
-        headerFile.write( struct.pack( "i", len( conv.getName() ) ) )
-        headerFile.write( conv.getName().encode('ascii') )
-        headerFile.write( conv.headerBytes() )
-        
-        
-# At the end we know how many chunks there are. Update the header as needed.
-def UpdateHeader( headerFile, numChunks ):
-    # seek after the first Int64
-    headerFile.seek( 8 )
-    # Write the number of chunks
-    headerFile.write( struct.pack( "q", numChunks ) )
-
-# Output a single row of the offsets table
-def OutputOffset( headerFile, numBytes, numSeqs, numSamples ):
+        binfile.write( struct.pack( "i", len( conv.getName() ) ) )
+        binfile.write( conv.getName().encode('ascii') )
+        binfile.write( conv.headerBytes() )
+
+# A single row of the offsets table
+def OffsetBytes( numBytes, numSeqs, numSamples ):
     # Int64 start offset for chunk
-    headerFile.write( struct.pack( "q", numBytes ) )
     # Int32 Num sequences in the chunk
-    headerFile.write( struct.pack( "i", numSeqs ) )
     # Int32 Num samples in the chunk
-    headerFile.write( struct.pack( "i", numSamples ) )
+    return struct.pack( "qii", numBytes, numSeqs, numSamples )
+
+def convert( inputPath, converters, aliasToId, seqsPerChunk, binfile, numWorkers=None ):
+    # The number of chunks determines the size of the offsets table in front
+    # of the data, so count the sequences first.
+    with open( inputPath, "rb" ) as inputFile:
+        numSeqs = sum( 1 for _ in ReadSequences( inputFile ) )
+    numChunks = (numSeqs + seqsPerChunk - 1) // seqsPerChunk
+
+    OutputHeader( binfile, converters, numChunks )
+    offsetsPos = binfile.tell()
+    binfile.write( b"\0" * (numChunks * len( OffsetBytes( 0, 0, 0 ) )) )
+
+    if( numWorkers == 1 ):
+        pool = None
+        InitWorker( aliasToId, converters )
+        convertedChunks = map
+    else:
+        pool = multiprocessing.Pool( numWorkers, InitWorker, ( aliasToId, converters ) )
+        convertedChunks = pool.imap
+
+    offsets = []
+    numBytes = 0
+    try:
+        with open( inputPath, "rb" ) as inputFile:
+            # imap returns the chunks in input order
+            for data, chunkSeqs, chunkSamples in convertedChunks( ConvertChunk, ReadChunks( inputFile, seqsPerChunk ) ):
+                offsets.append( OffsetBytes( numBytes, chunkSeqs, chunkSamples ) )
+                binfile.write( data )
+                numBytes += len( data )
+    finally:
+        if( pool is not None ):
+            pool.close()
+            pool.join()
+
+    assert len(offsets) == numChunks
+    binfile.seek( offsetsPos )
+    binfile.write( b"".join( offsets ) )
+    binfile.seek( 0, 2 )
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Transforms a CNTK Text Format file into CNTK binary format given a header.")
@@ -217,73 +293,62 @@ if __name__ == '__main__':
     parser.add_argument('--header',  help="Header file describing each stream in the input.", default="", required=True)
     parser.add_argument('--seqsPerChunk', type=int, help='Number of sequences in each chunk.', default="", required=True)
     parser.add_argument('--output', help='Name of the output file, stdout if not given', default="", required=True)
+    parser.add_argument('--numWorkers', type=int, help='Number of worker processes that convert chunks, all cores if not given.', default=None, required=False)
     args = parser.parse_args()
 
-    # Since we don't know how many chunks we're going to write until we're done,
-    # grow the header/offsets table and the data portion separately. then at the
-    # end concatenate the data portion onto the end of the header/offsets
-    # portion.
-    binaryHeaderFile = open( args.output, "wb+" )
-    binaryDataFile = tempfile.NamedTemporaryFile(mode="rb+", delete=False)
-    dataPath = binaryDataFile.name
-
-    # parse the header to get the converters for this file
-    # <name>    <alias>  <input format>  <sample size>
-    converters = []
-    aliasToId = dict()
     with open( args.header, "r" ) as headerfile:
-        id = 0
-        for line in headerfile:
-            split = re.split(r'\t+', line.strip())
-            converters.append( GetConverter( split[ 2 ], split[ 0 ], int(split[3]) ) )
-            aliasToId[ split[ 1 ] ] = id
-            id += 1
-
-    OutputHeader( binaryHeaderFile, converters )
-
-    numChunks = 0
-    with open( args.input, "r" ) as inputFile:
-        curSequence = list()
-        numSeqs = 0
-        numSamps = 0
-        prevId = None
-        for line in inputFile:
-            split = line.rstrip().split('|')
-            # if the sequence id is empty or not equal to the previous sequence id,
-            # we are at a new sequence.
-            if( not split[0] or prevId != split[ 0 ] ):
-                if(len(curSequence) > 0):
-                    numSamps += ParseSequence( aliasToId, curSequence, converters )
-                    curSequence = list()
-                    numSeqs += 1
-                    if( numSeqs % int( args.seqsPerChunk ) == 0 ):
-                        numBytes = OutputChunk( binaryDataFile, converters )
-                        numChunks += 1
-                        OutputOffset( binaryHeaderFile, numBytes, numSeqs, numSamps )
-                        numSeqs = 0
-                        numSamps = 0
-                prevId = split[ 0 ]
-
-            curSequence.append( line )
-        # we must parse the last line
-        if( len(curSequence) > 0 ):
-            numSamps += ParseSequence( aliasToId, curSequence, converters )
-            numSeqs += 1
-            numChunks += 1
-
-        numBytes = OutputChunk( binaryDataFile, converters )
-        OutputOffset( binaryHeaderFile, numBytes, numSeqs, numSamps )
-
-        UpdateHeader( binaryHeaderFile, numChunks )
-        binaryHeaderFile.flush()
-        binaryDataFile.flush()
-        binaryHeaderFile.close()
-        binaryDataFile.close()
-
-        destination = open( args.output, 'awb+' )
-        shutil.copyfileobj( open( dataPath, "rb" ), destination )
-        
-        destination.flush()
-        destination.close()
-        os.unlink(dataPath)
-        assert not os.path.exists(dataPath)
+        converters, aliasToId = ReadHeader( headerfile )
+
+    with open( args.output, "wb" ) as binfile:
+        convert( args.input, converters, aliasToId, args.seqsPerChunk, binfile, args.numWorkers )
+
+#
+# Testing
+#
+
+try:
+    import pytest
+except ImportError:
+    pass
+
+def writeAndConvert( tmpdir, text, header, seqsPerChunk, numWorkers=1 ):
+    inputPath = os.path.join( str(tmpdir), "input.ctf" )
+    with open( inputPath, "w" ) as f:
+        f.write( text )
+    converters, aliasToId = ReadHeader( io.StringIO( header ) )
+    output = io.BytesIO()
+    convert( inputPath, converters, aliasToId, seqsPerChunk, output, numWorkers )
+    return output.getvalue()
+
+def test_denseAndSparse( tmpdir ):
+    text = ("0\t|a 1 2 |b 3:1.5 1:2\n"
+            "0\t|b 0:1 |# a comment\n"
+            "1\t|a 3 4\n"
+            "2\t|a 5 6 |b 2:-1\n")
+    header = "A\ta\tdense\t2\nB\tb\tsparse\t4\n"
+    output = writeAndConvert( tmpdir, text, header, 2 )
+
+    headerBytes = struct.pack( "qqi", 1, 2, 2 ) + \
+        struct.pack( "i", 1 ) + b"A" + struct.pack( "iii", 0, 0, 2 ) + \
+        struct.pack( "i", 1 ) + b"B" + struct.pack( "iiiii", 1, 0, 0, 1, 4 )
+    chunk0 = struct.pack( "4f", 1, 2, 3, 4 ) + \
+        struct.pack( "i3f3i3i", 3, 2, 1.5, 1, 1, 3, 4, 0, 3, 3 )
+    chunk1 = struct.pack( "2f", 5, 6 ) + \
+        struct.pack( "i1f1i2i", 1, -1, 2, 0, 1 )
+    offsets = struct.pack( "qii", 0, 2, 3 ) + struct.pack( "qii", len(chunk0), 1, 1 )
+
+    assert output == headerBytes + offsets + chunk0 + chunk1
+
+def test_denseSequencesAsSparse( tmpdir ):
+    header = "X\tx\tsparse\t3\n"
+    dense = writeAndConvert( tmpdir, "0 |x 0 2 0\n0 |x 1 0 3\n1 |x 0 0 0\n", header, 5 )
+    sparse = writeAndConvert( tmpdir, "0 |x 1:2\n0 |x 0:1 2:3\n1 |x\n", header, 5 )
+    assert dense == sparse
+
+    with pytest.raises( ValueError ):
+        writeAndConvert( tmpdir, "0 |x 1 2\n0 |x 3 4\n", "X\tx\tdense\t2\n", 5 )
+
+def test_parallelConversionIsIdentical( tmpdir ):
+    text = "".join( "{0}\t|a {1} {2} |b {3}:1\n".format( i // 2, i, -i, i % 5 ) for i in range(100) )
+    header = "A\ta\tsparse\t2\nB\tb\tsparse\t5\n"
+    assert writeAndConvert( tmpdir, text, header, 7, 1 ) == writeAndConvert( tmpdir, text, header, 7, 2 )
@@ -28,33 +28,42 @@
 import sys
 import argparse
 import re
+import os
+import multiprocessing
+
+def _createDictionaries(dictionaryStreams):
+    return [{ line.rstrip('\r\n').strip():index for index, line in enumerate(dic) } for dic in dictionaryStreams]
 
 def convert(dictionaryStreams, inputs, output, unk, annotated):
     # create in memory dictionaries
-    dictionaries = [{ line.rstrip('\r\n').strip():index for index, line in enumerate(dic) } for dic in dictionaryStreams]
+    dictionaries = _createDictionaries(dictionaryStreams)
 
     # convert inputs
     for input in inputs:
         sequenceId = 0
         for index, line in enumerate(input):
-            line = line.rstrip('\r\n')
-            columns = line.split("\t")
-            if len(columns) != len(dictionaries):
-                raise Exception("Number of dictionaries {0} does not correspond to the number of streams in line {1}:'{2}'"
-                    .format(len(dictionaries), index, line))
-            _convertSequence(dictionaries, columns, sequenceId, output, unk, annotated)
+            output.write(_convertLine(dictionaries, line, index, sequenceId, unk, annotated))
             sequenceId += 1
 
-def _convertSequence(dictionaries, streams, sequenceId, output, unk, annotated):
+def _convertLine(dictionaries, line, index, sequenceId, unk, annotated):
+    line = line.rstrip('\r\n')
+    columns = line.split("\t")
+    if len(columns) != len(dictionaries):
+        raise Exception("Number of dictionaries {0} does not correspond to the number of streams in line {1}:'{2}'"
+            .format(len(dictionaries), index, line))
+    return _convertSequence(dictionaries, columns, sequenceId, unk, annotated)
+
+def _convertSequence(dictionaries, streams, sequenceId, unk, annotated):
     tokensPerStream = [[t for t in s.strip(' ').split(' ') if t != ""] for s in streams]
     maxLen = max(len(tokens) for tokens in tokensPerStream)
 
-    # writing to the output file
+    # collect the output of the sequence, it is written at once
+    output = []
     for sampleIndex in range(maxLen):
-        output.write(str(sequenceId))
+        output.append(str(sequenceId))
         for streamIndex in range(len(tokensPerStream)):
             if len(tokensPerStream[streamIndex]) <= sampleIndex:
-                output.write("\t")
+                output.append("\t")
                 continue
             token = tokensPerStream[streamIndex][sampleIndex]
             if unk is not None and token not in dictionaries[streamIndex]: # try unk symbol if specified
@@ -62,10 +71,79 @@ def _convertSequence(dictionaries, streams, sequenceId, output, unk, annotated):
             if token not in dictionaries[streamIndex]:
                 raise Exception("Token '{0}' cannot be found in the dictionary for stream {1}".format(token, streamIndex))
             value = dictionaries[streamIndex][token]
-            output.write("\t|S" + str(streamIndex) + " "+ str(value) + ":1")
+            output.append("\t|S" + str(streamIndex) + " "+ str(value) + ":1")
             if annotated:
-                output.write(" |# " + re.sub(r'(\|(?!#))|(\|$)', r'|#', token))
-        output.write("\n")
+                output.append(" |# " + re.sub(r'(\|(?!#))|(\|$)', r'|#', token))
+        output.append("\n")
+    return "".join(output)
+
+# Parallel conversion
+#
+# Every input file is split into shards of about shardSize bytes that begin
+# at the start of a line. The shards are converted by a pool of processes,
+# each of which gets the dictionaries once when it is started (with the fork
+# start method they are shared with the parent process, not copied). The line
+# numbers of the shards are counted in a first pass, so that every shard knows
+# the sequence id of its first line and the output is identical to the one of
+# convert(). The converted shards are written in input order.
+#
+# Note that lines are separated by '\n' in this mode, a '\r' only ends a line
+# when it is followed by '\n'.
+
+_workerState = None
+
+def _initWorker(dictionaries, unk, annotated):
+    global _workerState
+    _workerState = (dictionaries, unk, annotated)
+
+def _findShards(path, shardSize):
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, "rb") as f:
+        while boundaries[-1] < size:
+            f.seek(boundaries[-1] + shardSize)
+            if f.tell() >= size:
+                boundaries.append(size)
+            else:
+                f.readline()
+                boundaries.append(min(f.tell(), size))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _readShard(path, begin, end):
+    with open(path, "rb") as f:
+        f.seek(begin)
+        return f.read(end - begin)
+
+def _countLines(shard):
+    path, begin, end = shard
+    data = _readShard(path, begin, end)
+    return data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+
+def _convertShard(shard):
+    path, begin, end, firstLine = shard
+    dictionaries, unk, annotated = _workerState
+    lines = _readShard(path, begin, end).decode("utf-8").split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return "".join([_convertLine(dictionaries, line, firstLine + index, firstLine + index, unk, annotated)
+        for index, line in enumerate(lines)])
+
+def convertParallel(dictionaryStreams, inputPaths, output, unk, annotated, workers=None, shardSize=1<<24):
+    dictionaries = _createDictionaries(dictionaryStreams)
+
+    pool = multiprocessing.Pool(workers, _initWorker, (dictionaries, unk, annotated))
+    try:
+        for path in inputPaths:
+            shards = [(path, begin, end) for begin, end in _findShards(path, shardSize)]
+            firstLines = [0]
+            for count in pool.map(_countLines, shards):
+                firstLines.append(firstLines[-1] + count)
+
+            for text in pool.imap(_convertShard, [shard + (firstLine,) for shard, firstLine in zip(shards, firstLines)]):
+                output.write(text)
+    finally:
+        pool.close()
+        pool.join()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Transforms text file given dictionaries into CNTK text format.")
@@ -76,19 +154,25 @@ if __name__ == "__main__":
     parser.add_argument('--output', help='Name of the output file, stdout if not given', default="", required=False)
     parser.add_argument('--input', help='Name of the inputs files, stdin if not given', default="", nargs="*", required=False)
     parser.add_argument('--unk', help='Name fallback symbol for tokens not in dictionary (same for all columns)', default=None, required=False)
+    parser.add_argument('--workers', help='Number of processes converting the input files in parallel, 0 for all cores. Default is 1, stdin is always converted serially',
+        type=int, default=1, required=False)
     args = parser.parse_args()
 
-    # creating inputs
-    inputs = [sys.stdin]
-    if len(args.input) != 0:
-        inputs = [open(i, encoding="utf-8") for i in args.input]
-
     # creating output
     output = sys.stdout
     if args.output != "":
         output = open(args.output, "w")
 
-    convert([open(d, encoding="utf-8") for d in args.map], inputs, output, args.unk, args.annotated == "True")
+    dictionaries = [open(d, encoding="utf-8") for d in args.map]
+    if args.workers != 1 and len(args.input) != 0:
+        convertParallel(dictionaries, args.input, output, args.unk, args.annotated == "True", args.workers or None)
+    else:
+        # creating inputs
+        inputs = [sys.stdin]
+        if len(args.input) != 0:
+            inputs = [open(i, encoding="utf-8") for i in args.input]
+
+        convert(dictionaries, inputs, output, args.unk, args.annotated == "True")
 
 
 #####################################################################################################
@@ -147,3 +231,22 @@ def test_nonExistingWord():
     with pytest.raises(Exception) as info:
         convert([dictionary1], [input], output, None, False)
     assert str(info.value) == "Token 'nonexistent' cannot be found in the dictionary for stream 0"
+
+def test_parallelConversionIsIdentical(tmpdir):
+    dictionary = "hello\nmy\nworld\nof\nnothing\n"
+    words = dictionary.split()
+    lines = [" ".join(words[(i + j) % len(words)] for j in range(i % 4 + 1)) + "\t" + words[i % len(words)] for i in range(200)]
+    lines[5] = "\t"
+    text = "\n".join(lines) + "\r\n"
+    path = str(tmpdir.join("input.txt"))
+    with open(path, "w", newline="") as f:
+        f.write(text)
+
+    expectedOutput = stringio()
+    convert([stringio(dictionary), stringio(dictionary)], [stringio(text)], expectedOutput, None, True)
+
+    output = stringio()
+    # small shards, so that lines are distributed across several of them
+    convertParallel([stringio(dictionary), stringio(dictionary)], [path, path], output, None, True, 2, 100)
+
+    assert output.getvalue() == expectedOutput.getvalue() * 2
@@ -1,7 +1,66 @@
 import argparse
-
-def convert(file_in, file_out, features_start, features_dim, 
-  labels_start, labels_dim, num_labels, label_type='Category', mapping_file=None):
+import gzip
+import itertools
+import numpy as np
+
+def _open(path, mode):
+  # .gz files are compressed and decompressed transparently
+  if path.endswith(".gz"):
+    return gzip.open(path, mode + "t")
+  return open(path, mode)
+
+def _convert_block(lines, features_start, features_dim, labels_start,
+  labels_dim, num_labels, label_type, label_map):
+  rows = [line.split() for line in lines]
+  lengths = np.fromiter((len(r) for r in rows), dtype=int, count=len(rows))
+
+  if label_type != 'None':
+      max_length = max(labels_start + labels_dim, features_start + features_dim)
+      if lengths.min() < (labels_dim + features_dim):
+          raise RuntimeError(("Too few input columns ({} out of expected {}) ")
+              .format(lengths.min(), (labels_dim + features_dim)))
+      elif lengths.min() < max_length:
+          raise RuntimeError(
+              ("Too few input columns ({} out of expected {}) ")
+              .format(lengths.min(), max_length))
+  else:
+      max_length = features_start + features_dim
+      if lengths.min() < max_length:
+          raise RuntimeError(
+              ("Too few input columns ({} out of expected {}) ")
+              .format(lengths.min(), max_length))
+
+  if lengths.max() > max_length:
+      rows = [r[:max_length] for r in rows]
+
+  # the values are kept as they are written in the input
+  table = np.array(rows, dtype=str).reshape(len(rows), max_length)
+  columns = [table[:, features_start:features_start+features_dim]]
+  template = "|features " + " ".join(["%s"] * features_dim) + "\n"
+
+  if label_type != 'None':
+      labels = table[:, labels_start:labels_start+labels_dim]
+
+      if label_type == 'Category':
+          # there's only one label
+          values, inverse = np.unique(labels[:, 0], return_inverse=True)
+          ids = np.array([label_map.get(v, -1) for v in values], dtype=int)
+          illegal = ids[inverse.ravel()] < 0
+          if illegal.any():
+              raise RuntimeError(("Illegal label value: '{}'")
+                  .format(labels[np.argmax(illegal), 0]))
+          labels = np.full((len(rows), num_labels), "0")
+          labels[np.arange(len(rows)), ids[inverse.ravel()]] = "1"
+
+      columns.insert(0, labels)
+      template = "|labels " + " ".join(["%s"] * labels.shape[1]) + "\t" + template
+
+  values = np.concatenate(columns, axis=1)
+  return "".join([template] * len(rows)) % tuple(values.ravel().tolist())
+
+def convert(file_in, file_out, features_start, features_dim,
+  labels_start, labels_dim, num_labels, label_type='Category', mapping_file=None,
+  block_size=10000):
   label_map = {}
   if label_type == "Category":
       if mapping_file is not None:
@@ -13,47 +72,16 @@ def convert(file_in, file_out, features_start, features_dim,
       else:
           label_map = {str(x) : x for x in range(num_labels)}
 
-  input_file = open(file_in, 'r')
-  output_file = open(file_out, 'w')
-
-  for line in input_file.readlines():
-      values = line.split()
-
-      if label_type != 'None':
-          max_length = max(labels_start + labels_dim, features_start + features_dim)
-          if len(values) < (labels_dim + features_dim):
-              raise RuntimeError(("Too few input columns ({} out of expected {}) ")
-                  .format(len(values), (labels_dim + features_dim)))
-          elif len(values) < max_length:
-              raise RuntimeError(
-                  ("Too few input columns ({} out of expected {}) ")
-                  .format(len(values), max_length))
-
-          labels = values[labels_start:labels_start+labels_dim]
-
-          if label_type == 'Category':
-              one_hot = ['0'] * num_labels
-              # there's only one label
-              label = labels[0]
-              if label not in label_map:
-                  raise RuntimeError(("Illegal label value: '{}'").format(label))
-              one_hot[label_map[label]] = '1'
-              labels = one_hot
-
-          output_file.write("|labels " + " ".join(labels))
-          output_file.write("\t")
-
-      elif len(values) < features_start+features_dim:
-          raise RuntimeError(
-              ("Too few input columns ({} out of expected {}) ")
-              .format(len(values), features_start+features_dim))
+  # the input is converted in blocks of block_size rows, each of them is
+  # written at once
+  with _open(file_in, 'r') as input_file, _open(file_out, 'w') as output_file:
+      while True:
+          lines = list(itertools.islice(input_file, block_size))
+          if not lines:
+              break
 
-      output_file.write(
-          "|features " + " ".join(values[features_start:features_start+features_dim]))
-      output_file.write("\n")
-
-  input_file.close()
-  output_file.close()
+          output_file.write(_convert_block(lines, features_start, features_dim,
+              labels_start, labels_dim, num_labels, label_type, label_map))
 
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(
@@ -68,6 +96,8 @@ if __name__ == "__main__":
               "--num_labels 10 "
               "--output_file Examples/Image/MNIST/Data/Train-28x28_cntk_text.txt"
               "\n\n"
+              "Files ending with .gz are decompressed/compressed on the fly."
+              "\n\n"
               "For more information please visit "
               "https://github.com/Microsoft/CNTK/wiki/CNTKTextFormat-Reader"),
       formatter_class=argparse.RawTextHelpFormatter)
@@ -134,7 +164,8 @@ if __name__ == "__main__":
   file_out = args.output_file
 
   if not file_out:
-      dot = file_in.rfind(".")
+      # keep the extension, including a compression suffix
+      dot = file_in.rfind(".", 0, len(file_in) - 3 if file_in.endswith(".gz") else len(file_in))
       if dot == -1:
           dot = len(file_in)
       file_out = file_in[:dot] + "_cntk_text" + file_in[dot:]
@@ -143,4 +174,43 @@ if __name__ == "__main__":
          " to CNTK text format\n\t '{}'".format(file_in, file_out))
 
   convert(file_in, file_out, args.features_start, args.features_dim, 
-    args.labels_start, args.labels_dim, args.num_labels, args.label_type, args.mapping_file)
\ No newline at end of file
+    args.labels_start, args.labels_dim, args.num_labels, args.label_type, args.mapping_file)
+
+#
+# Testing
+#
+
+def test_convertCategoryLabels(tmpdir):
+  input_path = str(tmpdir.join("input.txt"))
+  with open(input_path, "w") as f:
+      f.write("1 0.5 0.25 x\n0 1.0 2e-3\n2 -1 0\n")
+  output_path = str(tmpdir.join("output.txt"))
+
+  convert(input_path, output_path, 1, 2, 0, 1, 3, block_size=2)
+
+  with open(output_path) as f:
+      assert f.read() == ("|labels 0 1 0\t|features 0.5 0.25\n"
+                          "|labels 1 0 0\t|features 1.0 2e-3\n"
+                          "|labels 0 0 1\t|features -1 0\n")
+
+def test_convertGzipRegression(tmpdir):
+  input_path = str(tmpdir.join("input.txt.gz"))
+  with gzip.open(input_path, "wt") as f:
+      f.write("1 2 3 4\n5 6 7 8\n")
+  output_path = str(tmpdir.join("output.txt.gz"))
+
+  convert(input_path, output_path, 0, 2, 2, 2, None, label_type="Regression")
+
+  with gzip.open(output_path, "rt") as f:
+      assert f.read() == ("|labels 3 4\t|features 1 2\n"
+                          "|labels 7 8\t|features 5 6\n")
+
+def test_illegalLabel(tmpdir):
+  import pytest
+  input_path = str(tmpdir.join("input.txt"))
+  with open(input_path, "w") as f:
+      f.write("1 0.5\n7 1.0\n")
+
+  with pytest.raises(RuntimeError) as info:
+      convert(input_path, str(tmpdir.join("output.txt")), 1, 1, 0, 1, 3)
+  assert str(info.value) == "Illegal label value: '7'"
@@ -406,6 +406,7 @@ namespace CNTK
         friend class MPICommunicatorImpl;
         friend class BlockMomentumDistributedLearner;
         friend class Internal::VariableResolver;
+        friend class Trainer;
 
         template <typename T, typename ...CtorArgTypes>
         friend inline std::shared_ptr<T> MakeSharedObject(CtorArgTypes&& ...ctorArgs);
@@ -3495,6 +3496,23 @@ namespace CNTK
         ///
         CNTK_API bool TrainMinibatch(const std::unordered_map<Variable, ValuePtr>& arguments, std::unordered_map<Variable, ValuePtr>& outputsToFetch, const DeviceDescriptor& computeDevice = DeviceDescriptor::UseDefaultDevice());
 
+        ///
+        /// Computes the gradients of the model parameters for the specified 'arguments' minibatch and adds them to the gradients
+        /// accumulated since the last parameter update, without updating the parameters. The sums are kept in device memory,
+        /// dense also for sparse gradients.
+        /// The next TrainMinibatch call updates the parameters once with the sum of its own and the accumulated gradients and with
+        /// the total number of samples, as if all these minibatches had been one. After that call, PreviousMinibatchLossAverage,
+        /// PreviousMinibatchEvaluationAverage and PreviousMinibatchSampleCount describe all these minibatches together.
+        /// Not supported with distributed learners.
+        ///
+        CNTK_API void AccumulateMinibatch(const std::unordered_map<Variable, ValuePtr>& arguments, const DeviceDescriptor& computeDevice = DeviceDescriptor::UseDefaultDevice());
+
+        ///
+        /// Accumulates the gradients for the specified 'arguments' minibatch like the above, and fetches the values of the
+        /// variables in 'outputsToFetch' like TrainMinibatch.
+        ///
+        CNTK_API void AccumulateMinibatch(const std::unordered_map<Variable, ValuePtr>& arguments, std::unordered_map<Variable, ValuePtr>& outputsToFetch, const DeviceDescriptor& computeDevice = DeviceDescriptor::UseDefaultDevice());
+
         ///
         /// Test the model on the specified batch of samples using the evaluation Function specified during construction of the Trainer
         /// Returns the average evaluation criterion value per sample for the tested minibatch of samples
@@ -3541,6 +3559,33 @@ namespace CNTK
         ///
         size_t PreviousMinibatchSampleCount() const { return m_prevMinibatchNumSamples; }
 
+        ///
+        /// Returns the training loss and evaluation criterion summed up over all minibatches trained since the last call
+        /// (keys "loss" and "evaluation"), and the number of samples and minibatches (keys "samples" and "minibatches"),
+        /// and resets the sums. The sums are kept in device memory, so that only this call copies from the device.
+        ///
+        CNTK_API Dictionary SummarizeTrainingProgress();
+
+        ///
+        /// Sets the factor by which the training loss is scaled for computing the gradients (1 by default), which keeps small
+        /// gradients from underflowing. The gradients are divided by the scale before the parameters are updated. Once a loss
+        /// scale has been set, even a scale of 1, the parameters are not updated if any of the gradients is not finite, see
+        /// PreviousMinibatchUpdateSkipped. Sparse gradients are then copied into dense ones for the check.
+        /// Not supported with distributed learners, and cannot be changed while gradients are accumulated (see AccumulateMinibatch).
+        ///
+        CNTK_API void SetLossScale(double lossScale);
+
+        ///
+        /// Returns the factor by which the training loss is scaled for computing the gradients.
+        ///
+        double LossScale() const { return m_lossScale; }
+
+        ///
+        /// Returns true if the parameters were not updated for the last minibatch trained because a gradient of the scaled loss
+        /// was not finite.
+        ///
+        bool PreviousMinibatchUpdateSkipped() const { return m_prevMinibatchUpdateSkipped; }
+
         ///
         /// Learners associated with this Trainer for updating the model's parameters using computed gradients.
         ///
@@ -3563,6 +3608,19 @@ namespace CNTK
 
         void Save(const std::wstring& modelFilePath, const std::vector<DictionaryValue>& learnerState, const Dictionary& externalState);
 
+        void AccumulateTrainingProgress();
+        void AccumulateUpdateProgress();
+        void AccumulateGradients(const std::unordered_map<Parameter, NDArrayViewPtr>& gradients, size_t numSamples);
+        NDArrayViewPtr DensifyGradient(const Parameter& parameter, const NDArrayViewPtr& gradient);
+
+        template <typename ElementType>
+        static void AddToAccumulator(NDArrayViewPtr& accumulator, const NDArrayViewPtr& data);
+
+        bool UnscaleGradients(const std::unordered_map<Parameter, NDArrayViewPtr>& gradients) const;
+
+        template <typename ElementType>
+        static bool UnscaleGradients(const std::unordered_map<Parameter, NDArrayViewPtr>& gradients, double lossScale);
+
         FunctionPtr m_combinedTrainingFunction;
         FunctionPtr m_model;
         FunctionPtr m_lossFunction;
@@ -3574,10 +3632,26 @@ namespace CNTK
         LearnersPtr m_parameterLearners;
         bool        m_distributed;
         ValuePtr    m_rootGradientValue;
+        double      m_lossScale;
+        bool        m_checkGradientOverflow;
+        bool        m_prevMinibatchUpdateSkipped;
 
         size_t   m_prevMinibatchNumSamples;
         ValuePtr m_prevMinibatchAggregateTrainingLossValue;
         ValuePtr m_prevMinibatchAggregateEvalCriterionValue;
+
+        // Sums since the last SummarizeTrainingProgress call, on the device of the training
+        NDArrayViewPtr m_accumulatedTrainingLoss;
+        NDArrayViewPtr m_accumulatedEvalCriterion;
+        size_t m_accumulatedNumSamples;
+        size_t m_accumulatedNumMinibatches;
+
+        // Gradients accumulated by AccumulateMinibatch since the last parameter update, on the device of the training
+        std::unordered_map<Parameter, NDArrayViewPtr> m_accumulatedGradients;
+        size_t m_accumulatedGradientsNumSamples;
+        // Loss and evaluation criterion summed up over the minibatches of these gradients
+        NDArrayViewPtr m_updateTrainingLoss;
+        NDArrayViewPtr m_updateEvalCriterion;
     };
 
     ///
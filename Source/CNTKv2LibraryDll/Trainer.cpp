@@ -7,6 +7,7 @@
 #include "CNTKLibrary.h"
 #include "Utils.h"
 #include "Learner.h"
+#include "Matrix.h"
 namespace
 {
     const std::wstring learnersPropertyName = L"Learners";
@@ -25,7 +26,13 @@ namespace CNTK
           m_evaluationFunction(evaluationFunction),
           m_parameterLearners(std::make_shared<Learners>(parameterLearners)),
           m_prevMinibatchNumSamples(1),
-          m_distributed(false)
+          m_distributed(false),
+          m_lossScale(1.0),
+          m_checkGradientOverflow(false),
+          m_prevMinibatchUpdateSkipped(false),
+          m_accumulatedNumSamples(0),
+          m_accumulatedNumMinibatches(0),
+          m_accumulatedGradientsNumSamples(0)
     {
         // By default we set the number of threads to hardware concurrency.
         if (!Internal::MaxNumCPUThreadsSet())
@@ -142,11 +149,20 @@ namespace CNTK
         return TrainDistributedMinibatch(arguments, outputsToFetch, computeDevice);
     }
 
-    bool Trainer::TrainLocalMinibatch(const std::unordered_map<Variable, ValuePtr>& arguments, std::unordered_map<Variable, ValuePtr>& outputsToFetch, const DeviceDescriptor& computeDevice /*= DeviceDescriptor::UseDefaultDevice()*/)
+    void Trainer::AccumulateMinibatch(const std::unordered_map<Variable, ValuePtr>& arguments, const DeviceDescriptor& computeDevice /*= DeviceDescriptor::UseDefaultDevice()*/)
     {
+        std::unordered_map<Variable, ValuePtr> outputsToFetch = {};
+        AccumulateMinibatch(arguments, outputsToFetch, computeDevice);
+    }
+
+    void Trainer::AccumulateMinibatch(const std::unordered_map<Variable, ValuePtr>& arguments, std::unordered_map<Variable, ValuePtr>& outputsToFetch, const DeviceDescriptor& computeDevice /*= DeviceDescriptor::UseDefaultDevice()*/)
+    {
+        if (m_distributed)
+            InvalidArgument("Trainer::AccumulateMinibatch: gradient accumulation is not supported with distributed learners");
+
         bool emptyMinibatch = arguments.empty() || (arguments.begin()->second == nullptr);
-        if (emptyMinibatch) // Nothing to train with.
-            return false;
+        if (emptyMinibatch) // Nothing to accumulate.
+            return;
 
         std::unordered_map<Variable, ValuePtr> parameterGradients;
         ExecuteForwardBackward(arguments, outputsToFetch, computeDevice, parameterGradients);
@@ -154,7 +170,64 @@ namespace CNTK
         std::unordered_map<Parameter, NDArrayViewPtr> gradients;
         for (const auto& parameter : m_combinedTrainingFunction->Parameters())
             gradients[parameter] = parameterGradients[parameter]->Data();
-        return m_parameterLearners->Update(gradients, m_prevMinibatchNumSamples);
+        AccumulateTrainingProgress();
+        AccumulateUpdateProgress();
+        AccumulateGradients(gradients, m_prevMinibatchNumSamples);
+    }
+
+    bool Trainer::TrainLocalMinibatch(const std::unordered_map<Variable, ValuePtr>& arguments, std::unordered_map<Variable, ValuePtr>& outputsToFetch, const DeviceDescriptor& computeDevice /*= DeviceDescriptor::UseDefaultDevice()*/)
+    {
+        bool emptyMinibatch = arguments.empty() || (arguments.begin()->second == nullptr);
+        if (emptyMinibatch && m_accumulatedGradientsNumSamples == 0) // Nothing to train with.
+            return false;
+
+        std::unordered_map<Parameter, NDArrayViewPtr> gradients;
+        size_t numSamples = 0;
+        if (!emptyMinibatch)
+        {
+            std::unordered_map<Variable, ValuePtr> parameterGradients;
+            ExecuteForwardBackward(arguments, outputsToFetch, computeDevice, parameterGradients);
+
+            for (const auto& parameter : m_combinedTrainingFunction->Parameters())
+                gradients[parameter] = parameterGradients[parameter]->Data();
+            AccumulateTrainingProgress();
+            numSamples = m_prevMinibatchNumSamples;
+        }
+
+        if (m_accumulatedGradientsNumSamples > 0)
+        {
+            // Update once with the gradients accumulated by AccumulateMinibatch and the ones of this minibatch.
+            if (!emptyMinibatch)
+                AccumulateUpdateProgress();
+            AccumulateGradients(gradients, numSamples);
+            gradients = m_accumulatedGradients;
+            numSamples = m_accumulatedGradientsNumSamples;
+            m_accumulatedGradientsNumSamples = 0;
+
+            // The previous minibatch is the one of the whole update.
+            m_prevMinibatchAggregateTrainingLossValue = MakeSharedObject<Value>(m_updateTrainingLoss);
+            if (m_updateEvalCriterion)
+                m_prevMinibatchAggregateEvalCriterionValue = MakeSharedObject<Value>(m_updateEvalCriterion);
+            m_prevMinibatchNumSamples = numSamples;
+        }
+
+        m_prevMinibatchUpdateSkipped = false;
+        if (m_checkGradientOverflow)
+        {
+            // The overflow check and the unscaling are not implemented for sparse matrices. Sparse gradients are copied
+            // into the dense gradient accumulators, which are not in use until the next AccumulateMinibatch call.
+            for (auto& gradient : gradients)
+            {
+                if (gradient.second->IsSparse())
+                    gradient.second = DensifyGradient(gradient.first, gradient.second);
+            }
+
+            m_prevMinibatchUpdateSkipped = !UnscaleGradients(gradients);
+            if (m_prevMinibatchUpdateSkipped)
+                return true;
+        }
+
+        return m_parameterLearners->Update(gradients, numSamples);
     }
 
     bool Trainer::TrainDistributedMinibatch(const std::unordered_map<Variable, ValuePtr>& arguments, std::unordered_map<Variable, ValuePtr>& outputsToFetch, const DeviceDescriptor& computeDevice /*= DeviceDescriptor::UseDefaultDevice()*/)
@@ -195,9 +268,189 @@ namespace CNTK
             m_prevMinibatchAggregateEvalCriterionValue = std::make_shared<Value>(info.evalCriterionValue);
             m_prevMinibatchAggregateTrainingLossValue = std::make_shared<Value>(info.trainingLossValue);
         }
+
+        if (m_prevMinibatchNumSamples > 0)
+            AccumulateTrainingProgress();
         return updated;
     }
 
+    template <typename ElementType>
+    /*static*/ void Trainer::AddToAccumulator(NDArrayViewPtr& accumulator, const NDArrayViewPtr& data)
+    {
+        if (!accumulator)
+        {
+            accumulator = MakeSharedObject<NDArrayView>(data->GetDataType(), data->Shape(), data->Device());
+            accumulator->SetValue((ElementType)0);
+        }
+
+        // The accumulators are dense, += is not implemented for sparse data, e.g. the gradients of parameters multiplied
+        // with sparse inputs.
+        auto accumulatorMatrix = accumulator->GetWritableMatrix<ElementType>();
+        if (data->IsSparse())
+            Microsoft::MSR::CNTK::Matrix<ElementType>::ScaleAndAdd((ElementType)1, *data->GetMatrix<ElementType>(), *accumulatorMatrix);
+        else
+            *accumulatorMatrix += *data->GetMatrix<ElementType>();
+    }
+
+    static void ResetAccumulator(const NDArrayViewPtr& accumulator)
+    {
+        if (!accumulator)
+            return;
+
+        // SetValue has to be called with the element type of the accumulator
+        if (accumulator->GetDataType() == DataType::Float)
+            accumulator->SetValue(0.0f);
+        else
+            accumulator->SetValue(0.0);
+    }
+
+    // Adds the loss and evaluation criterion of the previous minibatch to the running sums. The additions
+    // are queued on the device and do not wait for the computation of the minibatch to finish.
+    void Trainer::AccumulateTrainingProgress()
+    {
+        if (m_prevMinibatchAggregateTrainingLossValue->GetDataType() == DataType::Float)
+        {
+            AddToAccumulator<float>(m_accumulatedTrainingLoss, m_prevMinibatchAggregateTrainingLossValue->Data());
+            if (m_prevMinibatchAggregateEvalCriterionValue)
+                AddToAccumulator<float>(m_accumulatedEvalCriterion, m_prevMinibatchAggregateEvalCriterionValue->Data());
+        }
+        else
+        {
+            AddToAccumulator<double>(m_accumulatedTrainingLoss, m_prevMinibatchAggregateTrainingLossValue->Data());
+            if (m_prevMinibatchAggregateEvalCriterionValue)
+                AddToAccumulator<double>(m_accumulatedEvalCriterion, m_prevMinibatchAggregateEvalCriterionValue->Data());
+        }
+
+        m_accumulatedNumSamples += m_prevMinibatchNumSamples;
+        m_accumulatedNumMinibatches++;
+    }
+
+    // Adds the loss and evaluation criterion of the previous minibatch to the sums over the minibatches of the next parameter
+    // update, on the device. Has to be called before AccumulateGradients, which starts a new update after the last one.
+    void Trainer::AccumulateUpdateProgress()
+    {
+        if (m_accumulatedGradientsNumSamples == 0)
+        {
+            m_updateTrainingLoss = m_prevMinibatchAggregateTrainingLossValue->Data()->DeepClone(/*readOnly =*/ false);
+            m_updateEvalCriterion = m_prevMinibatchAggregateEvalCriterionValue ? m_prevMinibatchAggregateEvalCriterionValue->Data()->DeepClone(/*readOnly =*/ false) : nullptr;
+        }
+        else if (m_prevMinibatchAggregateTrainingLossValue->GetDataType() == DataType::Float)
+        {
+            AddToAccumulator<float>(m_updateTrainingLoss, m_prevMinibatchAggregateTrainingLossValue->Data());
+            if (m_updateEvalCriterion)
+                AddToAccumulator<float>(m_updateEvalCriterion, m_prevMinibatchAggregateEvalCriterionValue->Data());
+        }
+        else
+        {
+            AddToAccumulator<double>(m_updateTrainingLoss, m_prevMinibatchAggregateTrainingLossValue->Data());
+            if (m_updateEvalCriterion)
+                AddToAccumulator<double>(m_updateEvalCriterion, m_prevMinibatchAggregateEvalCriterionValue->Data());
+        }
+    }
+
+    // Adds the gradients to the ones accumulated since the last parameter update, on the device. The first gradients
+    // after an update are copied into the accumulators. The accumulators are dense, also for sparse gradients.
+    void Trainer::AccumulateGradients(const std::unordered_map<Parameter, NDArrayViewPtr>& gradients, size_t numSamples)
+    {
+        for (const auto& gradient : gradients)
+        {
+            auto& accumulated = m_accumulatedGradients[gradient.first];
+            if (accumulated && m_accumulatedGradientsNumSamples == 0 && !gradient.second->IsSparse())
+            {
+                accumulated->CopyFrom(*gradient.second);
+                continue;
+            }
+
+            if (m_accumulatedGradientsNumSamples == 0)
+                ResetAccumulator(accumulated);
+            if (gradient.second->GetDataType() == DataType::Float)
+                AddToAccumulator<float>(accumulated, gradient.second);
+            else
+                AddToAccumulator<double>(accumulated, gradient.second);
+        }
+
+        m_accumulatedGradientsNumSamples += numSamples;
+    }
+
+    NDArrayViewPtr Trainer::DensifyGradient(const Parameter& parameter, const NDArrayViewPtr& gradient)
+    {
+        auto& dense = m_accumulatedGradients[parameter];
+        ResetAccumulator(dense);
+        if (gradient->GetDataType() == DataType::Float)
+            AddToAccumulator<float>(dense, gradient);
+        else
+            AddToAccumulator<double>(dense, gradient);
+        return dense;
+    }
+
+    void Trainer::SetLossScale(double lossScale)
+    {
+        if (!(lossScale > 0) || std::isinf(lossScale))
+            InvalidArgument("Trainer::SetLossScale: the loss scale must be positive and finite, but is %f", lossScale);
+        if (m_distributed && lossScale != 1.0)
+            InvalidArgument("Trainer::SetLossScale: loss scaling is not supported with distributed learners");
+        if (m_accumulatedGradientsNumSamples > 0 && lossScale != m_lossScale)
+            InvalidArgument("Trainer::SetLossScale: the loss scale cannot be changed while gradients are accumulated");
+
+        m_lossScale = lossScale;
+        m_checkGradientOverflow = true;
+    }
+
+    bool Trainer::UnscaleGradients(const std::unordered_map<Parameter, NDArrayViewPtr>& gradients) const
+    {
+        if (gradients.empty())
+            return true;
+
+        if (gradients.begin()->second->GetDataType() == DataType::Float)
+            return UnscaleGradients<float>(gradients, m_lossScale);
+        else
+            return UnscaleGradients<double>(gradients, m_lossScale);
+    }
+
+    // Divides the gradients by the loss scale (unless it is 1), unless one of them is not finite, in which case false is returned. A gradient
+    // that is not finite makes the sum of its elements infinite or NaN; these sums are added up on the device, so that only
+    // the total is copied from the device.
+    template <typename ElementType>
+    /*static*/ bool Trainer::UnscaleGradients(const std::unordered_map<Parameter, NDArrayViewPtr>& gradients, double lossScale)
+    {
+        auto device = gradients.begin()->second->Device();
+        auto total = MakeSharedObject<NDArrayView>(AsDataType<ElementType>(), NDShape({ 1 }), device);
+        auto sum = MakeSharedObject<NDArrayView>(AsDataType<ElementType>(), NDShape({ 1 }), device);
+        total->SetValue((ElementType)0);
+        for (const auto& gradient : gradients)
+        {
+            sum->GetWritableMatrix<ElementType>()->AssignSumOfElements(*gradient.second->GetMatrix<ElementType>());
+            *total->GetWritableMatrix<ElementType>() += *sum->GetMatrix<ElementType>();
+        }
+
+        if (!std::isfinite(GetScalarValue(MakeSharedObject<Value>(total))))
+            return false;
+
+        if (lossScale != 1.0)
+        {
+            for (const auto& gradient : gradients)
+                *gradient.second->GetWritableMatrix<ElementType>() *= (ElementType)(1.0 / lossScale);
+        }
+
+        return true;
+    }
+
+    Dictionary Trainer::SummarizeTrainingProgress()
+    {
+        Dictionary summary;
+        summary[L"loss"] = m_accumulatedTrainingLoss ? GetScalarValue(MakeSharedObject<Value>(m_accumulatedTrainingLoss)) : 0.0;
+        summary[L"evaluation"] = m_accumulatedEvalCriterion ? GetScalarValue(MakeSharedObject<Value>(m_accumulatedEvalCriterion)) : 0.0;
+        summary[L"samples"] = m_accumulatedNumSamples;
+        summary[L"minibatches"] = m_accumulatedNumMinibatches;
+
+        ResetAccumulator(m_accumulatedTrainingLoss);
+        ResetAccumulator(m_accumulatedEvalCriterion);
+        m_accumulatedNumSamples = 0;
+        m_accumulatedNumMinibatches = 0;
+
+        return summary;
+    }
+
     void Trainer::ExecuteForwardBackward(const std::unordered_map<Variable, ValuePtr>& arguments, std::unordered_map<Variable, ValuePtr>& outputsToFetch, const DeviceDescriptor& computeDevice, std::unordered_map<Variable, ValuePtr>& parameterGradients)
     {
         std::unordered_map<Variable, ValuePtr> outputs = { { m_aggregatedLossFunction, nullptr }, { m_trainingSampleCountVar, nullptr } };
@@ -227,9 +480,9 @@ namespace CNTK
         }
 
         if (m_aggregatedLossFunction->Output().GetDataType() == DataType::Float)
-            m_rootGradientValue->Data()->SetValue(1.0f);
+            m_rootGradientValue->Data()->SetValue((float)m_lossScale);
         else
-            m_rootGradientValue->Data()->SetValue(1.0);
+            m_rootGradientValue->Data()->SetValue(m_lossScale);
 
         auto modelParameters = m_combinedTrainingFunction->Parameters();
         for (const auto& parameter : modelParameters)
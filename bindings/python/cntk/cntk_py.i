@@ -376,6 +376,12 @@ public:
     }
 }
 
+%typemap(out, fragment="DictionaryValueToPy") CNTK::DictionaryValue get_value {
+    $result = DictionaryValueToPy($1);
+    if ($result == NULL)
+        SWIG_fail;
+}
+
 %extend CNTK::Dictionary {
     CNTK::DictionaryValue __getitem__(const wchar_t* key) {
         return (*($self))[key];
@@ -384,6 +390,17 @@ public:
     void __setitem__(const wchar_t* key, CNTK::DictionaryValue value) {
         (*($self))[key] = value;
     }
+
+    // the nested dictionary under key, e.g. a checkpoint state that was
+    // passed as external state to Trainer::SaveCheckpoint
+    CNTK::Dictionary get_dictionary(const wchar_t* key) {
+        return (*($self))[key].Value<CNTK::Dictionary>();
+    }
+
+    // the value under key converted to a Python object
+    CNTK::DictionaryValue get_value(const wchar_t* key) {
+        return (*($self))[key];
+    }
 }
 
 %extend CNTK::Axis {
@@ -1126,6 +1143,45 @@ public:
         PyObject *NDArrayViewToNumPy(const CNTK::NDArrayView*);
         return NDArrayViewToNumPy(self);
     }
+
+    // Copies the data of a C-contiguous NumPy array of the same size and
+    // type into this (dense) view, reusing its memory.
+    void copy_from_ndarray(PyObject* pyobj)
+    {
+        if (!PyArray_Check((PyArrayObject*)pyobj))
+        {
+            throw std::logic_error("NumPy array expected");
+        }
+
+        PyArrayObject* array = (PyArrayObject*)pyobj;
+
+        if (!PyArray_IS_C_CONTIGUOUS(array))
+        {
+            throw std::logic_error("NumPy array must be C contiguous");
+        }
+
+        size_t num_elements = self->Shape().TotalSize();
+        if ((size_t)PyArray_SIZE(array) != num_elements)
+        {
+            throw std::logic_error("NumPy array size does not match the size of the NDArrayView");
+        }
+
+        int typecode = PyArray_TYPE(array);
+        if (typecode == NPY_FLOAT && self->GetDataType() == DataType::Float)
+        {
+            NDArrayView tmp(self->Shape(), (float*)PyArray_DATA(array), num_elements, DeviceDescriptor::CPUDevice(), true);
+            self->CopyFrom(tmp);
+        }
+        else if (typecode == NPY_DOUBLE && self->GetDataType() == DataType::Double)
+        {
+            NDArrayView tmp(self->Shape(), (double*)PyArray_DATA(array), num_elements, DeviceDescriptor::CPUDevice(), true);
+            self->CopyFrom(tmp);
+        }
+        else
+        {
+            throw std::logic_error("NumPy array type does not match the data type of the NDArrayView");
+        }
+    }
 }
 
 %template(NDArrayViewFloat) CNTK::NDArrayView::NDArrayView<float>;
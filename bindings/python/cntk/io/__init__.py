@@ -6,10 +6,20 @@
 
 from .. import cntk_py
 from ..tensor import ArrayMixin
-from ..utils import typemap, value_to_seq
+from ..utils import typemap, value_to_seq, value_to_padded_array
 from cntk.device import use_default_device
 
+import collections
+import itertools
+import mmap
+import os
 import numpy as np
+import threading
+from scipy import sparse
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 INFINITELY_REPEAT = cntk_py.MinibatchSource.infinitely_repeat
 FULL_DATA_SWEEP = cntk_py.MinibatchSource.full_data_sweep
@@ -43,6 +53,30 @@ class MinibatchData(cntk_py.MinibatchData, ArrayMixin):
         '''
         return value_to_seq(self.m_data)
 
+    def as_numpy(self, copy=False):
+        '''
+        The data of the minibatch as one padded NumPy array together with its
+        mask and sequence lengths. The data is transferred to the CPU only on
+        the first call; unless ``copy`` is True, later calls return the same
+        read-only arrays, so that e.g. logging and metric code can share them.
+
+        Args:
+            copy (bool, default False): whether to return copies, which the
+             caller may modify
+
+        Returns:
+            :class:`~cntk.utils.PaddedArray`
+        '''
+        padded = self.__dict__.get('_padded_array')
+        if padded is None:
+            padded = value_to_padded_array(self.m_data)
+            for array in padded:
+                if array is not None:
+                    array.flags.writeable = False
+            self.__dict__['_padded_array'] = padded
+
+        return padded.copy() if copy else padded
+
     @property
     def shape(self):
         '''
@@ -96,6 +130,9 @@ class MinibatchSource(cntk_py.MinibatchSource):
             epoch_size=epoch_size,
             distributed_after=distributed_after,
             multithreaded_deserializer=multithreaded_deserializer)
+        self._init_from_config(reader_config)
+
+    def _init_from_config(self, reader_config):
         source = minibatch_source(reader_config)
         # transplant into this class instance
         self.__dict__ = source.__dict__
@@ -106,6 +143,49 @@ class MinibatchSource(cntk_py.MinibatchSource):
         from ..utils import Record
         self.streams = Record(**streams)
 
+    def clone(self, epoch_size=None, randomize=None, randomization_window=None,
+            distributed_after=None):
+        '''
+        Creates a new minibatch source with the same deserializers as this
+        one. The deserializer configuration is not converted again, which
+        makes creating many similar sources, e.g. for hyper-parameter
+        sweeps, cheaper. The new source starts at the beginning of the data.
+
+        Args:
+            epoch_size (int, default None): epoch size, or None to keep the
+             one of this source
+            randomize (bool, default None): whether to randomize, or None to
+             keep the setting of this source
+            randomization_window (int, default None): size of the
+             randomization window, or None to keep the one of this source
+            distributed_after (int, default None): sample count after which
+             the source becomes distributed, or None to keep the one of this
+             source
+
+        Returns:
+            :class:`MinibatchSource`
+        '''
+        reader_config = self.__dict__.get('_reader_config')
+        if reader_config is None:
+            raise ValueError('the configuration of this minibatch source is '
+                    'not known, it cannot be cloned')
+
+        reader_config = reader_config.copy()
+        if epoch_size is not None:
+            reader_config['epochSize'] = cntk_py.SizeTWrapper(epoch_size)
+        if randomize is not None:
+            reader_config['randomize'] = randomize
+        if randomization_window is not None:
+            reader_config['randomizationWindow'] = \
+                    cntk_py.SizeTWrapper(randomization_window)
+        if distributed_after is not None:
+            reader_config['distributedAfterSampleCount'] = \
+                    cntk_py.SizeTWrapper(distributed_after)
+
+        clone = type(self).__new__(type(self))
+        MinibatchSource._init_from_config(clone, reader_config)
+        return clone
+
     def stream_infos(self):
         '''
         Describes the stream that this source produces.
@@ -195,9 +275,506 @@ class MinibatchSource(cntk_py.MinibatchSource):
         '''
         return super(MinibatchSource, self).is_distributed()
 
+def _copy_minibatch_data(mb_data):
+    '''
+    Creates a :class:`MinibatchData` that owns a deep copy of the data in
+    ``mb_data``. The built-in sources reuse their buffers for the next
+    minibatch, so data that is held on to beyond the next read has to be
+    copied.
+    '''
+    copy = MinibatchData()
+    copy.m_num_sequences = mb_data.m_num_sequences
+    copy.m_num_samples = mb_data.m_num_samples
+    if mb_data.m_data is not None:
+        copy.m_data = mb_data.m_data.deep_clone()
+    return copy
+
+class PrefetchingMinibatchSource(object):
+    '''
+    Wraps a :class:`MinibatchSource` and reads its minibatches on a background
+    thread, so that reading and deserializing the next minibatches overlaps
+    with the computation on the current one. At most ``prefetch`` minibatches
+    are read ahead.
+
+    The read-ahead is transparent: :meth:`get_checkpoint_state` returns the
+    state of the wrapped source right after the last minibatch that was
+    returned by :meth:`next_minibatch`, and restoring from it continues with
+    the minibatch that would have been returned next. Changing the minibatch
+    size or the device discards the minibatches that have been read ahead.
+
+    Example:
+        >>> source = MinibatchSource(CTFDeserializer(path, streams)) # doctest: +SKIP
+        >>> reader = PrefetchingMinibatchSource(source, prefetch=4) # doctest: +SKIP
+        >>> mb = reader.next_minibatch(64, input_map={x: reader.streams.features}) # doctest: +SKIP
+
+    Args:
+        source (:class:`MinibatchSource`): the minibatch source to read from.
+         It must not be used directly while it is wrapped.
+        prefetch (int, default 2): maximum number of minibatches that are read
+         ahead
+    '''
+    def __init__(self, source, prefetch=2):
+        if prefetch < 1:
+            raise ValueError('prefetch must be at least 1, got %s' % prefetch)
+
+        self._source = source
+        self._prefetch = prefetch
+        self._thread = None
+        self._queue = None
+        self._stop = None
+        self._request = None
+        self._checkpoint = None
+        if hasattr(source, 'streams'):
+            self.streams = source.streams
+
+    def stream_infos(self):
+        '''
+        Describes the stream that the wrapped source produces.
+        '''
+        return self._source.stream_infos()
+
+    def stream_info(self, name):
+        '''
+        Gets the description of the stream with given name.
+        '''
+        return self._source.stream_info(name)
+
+    def __getitem__(self, name):
+        '''
+        Return the :class:`StreamInfo` for the given stream name
+
+        Args:
+            name (str): stream name to fetch :class:`StreamInfo` for
+        '''
+        return self.stream_info(name)
+
+    def _start_reading(self, minibatch_size_in_samples, device):
+        if self._checkpoint is None:
+            self._checkpoint = self._source.get_checkpoint_state()
+
+        self._request = (minibatch_size_in_samples, device.type(), device.id())
+        self._queue = queue.Queue(self._prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_ahead,
+                args=(self._queue, self._stop, minibatch_size_in_samples, device))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read_ahead(self, mb_queue, stop, minibatch_size_in_samples, device):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    mb_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            while not stop.is_set():
+                mb = self._source.next_minibatch(minibatch_size_in_samples,
+                        device=device)
+                mb = { si : _copy_minibatch_data(data) for si, data in mb.items() }
+                state = self._source.get_checkpoint_state()
+                if not put((mb, state, None)) or not mb:
+                    break
+        except Exception as e:
+            put((None, None, e))
+
+    def _stop_reading(self):
+        '''
+        Stops the background thread and discards the minibatches that have
+        been read ahead. Afterwards, the wrapped source has to be rewound to
+        ``self._checkpoint`` before it is read again.
+        '''
+        if self._thread is None:
+            return False
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = self._queue = self._stop = self._request = None
+        return True
+
+    def next_minibatch(self, minibatch_size_in_samples,
+            input_map=None, device=None):
+        '''
+        Returns the next minibatch of the wrapped source. See
+        :meth:`MinibatchSource.next_minibatch` for details.
+
+        Args:
+            minibatch_size_in_samples (int): number of samples to retrieve for
+             the next minibatch. Must be > 0.
+            input_map (dict): mapping of :class:`~cntk.ops.variabls.Variable`
+             to :class:`StreamInformation` which will be used to convert the
+             returned data.
+            device (`DeviceDescriptor`, defaults to `None`): CNTK DeviceDescriptor
+
+        Returns:
+            A mapping of :class:`StramInformation` to :class:`MinibatchData` if
+            ``input_map`` was not specified. Otherwise, the returned value will
+            be a mapping of :class:`~cntk.ops.variabls.Variable` to class:`MinibatchData`.
+        '''
+        if device is None:
+            device = use_default_device()
+
+        if self._request is not None and self._request != \
+                (minibatch_size_in_samples, device.type(), device.id()):
+            # the read-ahead was done for a different request
+            self._stop_reading()
+            self._source.restore_from_checkpoint(self._checkpoint)
+
+        if self._thread is None:
+            self._start_reading(minibatch_size_in_samples, device)
+
+        mb, state, error = self._queue.get()
+        if error is not None or not mb:
+            # the background thread has terminated
+            self._stop_reading()
+            if error is not None:
+                self._source.restore_from_checkpoint(self._checkpoint)
+                raise error
+
+        self._checkpoint = state
+
+        if input_map:
+            if not mb:
+                return {}
+            else:
+                return { key : mb[value] for (key, value) in input_map.items() }
+        else:
+            return mb
+
+    def get_checkpoint_state(self):
+        '''
+        Gets the checkpoint state of the wrapped source as of the last
+        minibatch that was returned by :meth:`next_minibatch`.
+
+        Returns:
+            :class:`~cntk_py.Dictionary`
+        '''
+        if self._checkpoint is None:
+            return self._source.get_checkpoint_state()
+        return self._checkpoint
+
+    def restore_from_checkpoint(self, checkpoint):
+        '''
+        Discards the minibatches that have been read ahead and restores the
+        wrapped source from the specified checkpoint.
+
+        Args:
+            checkpoint (:class:`~cntk_py.Dictionary`): checkpoint to restore from
+        '''
+        self._stop_reading()
+        self._source.restore_from_checkpoint(checkpoint)
+        self._checkpoint = checkpoint
+
+    @property
+    def is_distributed(self):
+        '''
+        Whether the wrapped minibatch source is running distributed
+        '''
+        return self._source.is_distributed
+
+    def close(self):
+        '''
+        Stops reading ahead. The wrapped source is rewound to the state after
+        the last minibatch that was returned, so that it can be used directly
+        again.
+        '''
+        if self._stop_reading():
+            self._source.restore_from_checkpoint(self._checkpoint)
+
+class NumpyStreamInformation(object):
+    '''
+    Describes a stream of a :class:`NumpyMinibatchSource`. Like
+    :class:`StreamInformation` it is used as key in the mappings returned by
+    :meth:`NumpyMinibatchSource.next_minibatch` and as value in its
+    ``input_map``.
+    '''
+    def __init__(self, name, shape, dtype):
+        self.m_name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def __repr__(self):
+        return 'NumpyStreamInformation(%r, shape=%s, dtype=%s)' % \
+                (self.m_name, self.shape, np.dtype(self.dtype).name)
+
+class NumpyMinibatchSource(object):
+    '''
+    A minibatch source that serves data from NumPy arrays. It provides the
+    same interface as :class:`MinibatchSource` (``streams``,
+    :meth:`next_minibatch` with ``input_map``, checkpointing), so that data
+    that is already in memory or stored as ``.npy`` files can be used in the
+    same training loops.
+
+    Every row of an array is one sample that forms its own sequence. All
+    arrays need to have the same number of rows. Instead of an array, the
+    name of an ``.npy`` file can be given, which is then opened as
+    memory-mapped array, so that only the rows of the current minibatch are
+    read from disk.
+
+    Randomization shuffles indices, never the data itself. The rows are split
+    into windows of ``randomization_window`` samples; in every sweep the
+    order of the windows and the order of the samples inside every window are
+    permuted. Smaller windows thus keep the accesses to memory-mapped files
+    local.
+
+    Example:
+        >>> features = np.arange(12, dtype=np.float32).reshape(6, 2)
+        >>> labels = np.eye(3, dtype=np.float32)[[0, 1, 2, 0, 1, 2]]
+        >>> source = NumpyMinibatchSource(dict(features=features, labels=labels),
+        ...                               randomize=False) # doctest: +SKIP
+        >>> mb = source.next_minibatch(4) # doctest: +SKIP
+        >>> mb[source.streams.features].value.shape # doctest: +SKIP
+        (4, 1, 2)
+
+    Args:
+        arrays (dict): mapping of stream names to NumPy arrays (including
+         ``np.memmap`` instances) or to names of ``.npy`` files. Integer data
+         is converted to ``np.float32``.
+        randomize (bool, default True): randomize before every sweep
+        randomization_window (int): size of the window in samples that is
+         shuffled, ignored if `randomize` is False
+        epoch_size (int): number of samples after which the source returns
+         empty minibatches. :const:`FULL_DATA_SWEEP` is one pass over the data,
+         :const:`INFINITELY_REPEAT` never ends.
+        seed (int, default 0): seed for the randomization. Sweep `i` uses
+         `seed + i`, so that the permutations are reproducible.
+    '''
+    def __init__(self, arrays, randomize=True,
+            randomization_window=DEFAULT_RANDOMIZATION_WINDOW,
+            epoch_size=INFINITELY_REPEAT, seed=0):
+        if not arrays:
+            raise ValueError('at least one array has to be given')
+
+        self._arrays = {}
+        streams = {}
+        num_samples = None
+        for name, data in arrays.items():
+            if isinstance(data, str):
+                data = np.load(data, mmap_mode='r')
+            elif not isinstance(data, np.ndarray):
+                raise ValueError('stream "%s" has to be a NumPy array or the '
+                        'name of an .npy file, got %s' % (name, type(data).__name__))
+
+            if data.ndim == 0:
+                raise ValueError('stream "%s" must have at least one axis' % name)
+
+            if num_samples is None:
+                num_samples = data.shape[0]
+            elif data.shape[0] != num_samples:
+                raise ValueError('all arrays must have the same number of rows, '
+                        'but stream "%s" has %i instead of %i' %
+                        (name, data.shape[0], num_samples))
+
+            dtype = data.dtype if data.dtype in (np.float32, np.float64) \
+                    else np.float32
+            stream = NumpyStreamInformation(name, data.shape[1:] or (1,), dtype)
+            self._arrays[stream] = data
+            streams[name] = stream
+
+        if num_samples == 0:
+            raise ValueError('the arrays do not contain any samples')
+
+        from ..utils import Record
+        self.streams = Record(**streams)
+
+        self._num_samples = num_samples
+        self._randomize = randomize
+        self._randomization_window = max(1, min(randomization_window, num_samples))
+        if epoch_size == FULL_DATA_SWEEP:
+            epoch_size = num_samples
+        self._epoch_size = epoch_size
+        self._seed = seed
+        self._position = 0
+        self._permutation_sweep = None
+        self._permutation = None
+
+    def stream_infos(self):
+        '''
+        Describes the streams that this source produces.
+
+        Returns:
+            list of :class:`NumpyStreamInformation`
+        '''
+        return list(self._arrays.keys())
+
+    def stream_info(self, name):
+        '''
+        Gets the description of the stream with given name.
+        '''
+        if name not in self.streams:
+            raise ValueError('no stream with the name "%s". Available: %s' %
+                    (name, ', '.join(sorted(self.streams))))
+        return self.streams[name]
+
+    def __getitem__(self, name):
+        '''
+        Return the :class:`NumpyStreamInformation` for the given stream name
+
+        Args:
+            name (str): stream name to fetch the stream information for
+        '''
+        return self.stream_info(name)
+
+    def _sweep_indices(self, sweep, start, stop):
+        '''
+        Returns the indices of the samples at positions `start` to `stop` in
+        the given sweep, either as slice or as index array.
+        '''
+        if not self._randomize:
+            return slice(start, stop)
+
+        if self._permutation_sweep != sweep:
+            n = self._num_samples
+            window = self._randomization_window
+            rng = np.random.RandomState((self._seed + sweep) % 2**32)
+            window_starts = np.arange(0, n, window)
+            rng.shuffle(window_starts)
+            self._permutation = np.concatenate([s + rng.permutation(min(window, n - s))
+                for s in window_starts])
+            self._permutation_sweep = sweep
+
+        return self._permutation[start:stop]
+
+    def next_minibatch(self, minibatch_size_in_samples,
+            input_map=None, device=None):
+        '''
+        Reads a minibatch that contains data for all input streams. An empty
+        map is returned when the source has reached ``epoch_size``.
+
+        Args:
+            minibatch_size_in_samples (int): number of samples to retrieve for
+             the next minibatch. Must be > 0.
+            input_map (dict): mapping of :class:`~cntk.ops.variabls.Variable`
+             to :class:`NumpyStreamInformation` which will be used to convert
+             the returned data.
+            device (`DeviceDescriptor`, defaults to `None`): CNTK DeviceDescriptor
+
+        Returns:
+            A mapping of :class:`NumpyStreamInformation` to
+            :class:`MinibatchData` if ``input_map`` was not specified.
+            Otherwise, the returned value will be a mapping of
+            :class:`~cntk.ops.variabls.Variable` to class:`MinibatchData`.
+        '''
+        if minibatch_size_in_samples <= 0:
+            raise ValueError('minibatch size must be > 0')
+
+        if device is None:
+            device = use_default_device()
+
+        start = self._position
+        stop = min(start + minibatch_size_in_samples, self._epoch_size)
+        if start >= stop:
+            return {}
+
+        indices = []
+        pos = start
+        while pos < stop:
+            sweep, offset = divmod(pos, self._num_samples)
+            count = min(stop - pos, self._num_samples - offset)
+            indices.append(self._sweep_indices(sweep, offset, offset + count))
+            pos += count
+
+        self._position = stop
+
+        from ..utils import Value, _create_NDArrayView_from_NumPy
+        mb = {}
+        for stream, data in self._arrays.items():
+            rows = np.concatenate([data[idx] for idx in indices]) \
+                    if len(indices) > 1 else data[indices[0]]
+            rows = np.ascontiguousarray(rows, dtype=stream.dtype)
+            rows = rows.reshape((len(rows), 1) + stream.shape)
+
+            mb_data = MinibatchData()
+            mb_data.m_num_sequences = mb_data.m_num_samples = len(rows)
+            mb_data.m_data = Value(
+                    batch=_create_NDArrayView_from_NumPy(rows, device),
+                    device=device)
+            mb[stream] = mb_data
+
+        if input_map:
+            return { key : mb[value] for (key, value) in input_map.items() }
+        else:
+            return mb
+
+    def get_checkpoint_state(self):
+        '''
+        Gets the checkpoint state of the source.
+
+        Returns:
+            `dict` that can be passed to :meth:`restore_from_checkpoint` or
+            as ``external_state`` to
+            :meth:`~cntk.trainer.Trainer.save_checkpoint`
+        '''
+        return { 'position' : self._position }
+
+    def restore_from_checkpoint(self, checkpoint):
+        '''
+        Restores the source state from the specified checkpoint.
+
+        Args:
+            checkpoint (`dict`): checkpoint to restore from
+        '''
+        self._position = int(checkpoint['position'])
+
+    @property
+    def is_distributed(self):
+        '''
+        Whether the minibatch source is running distributed. Always `False`.
+        '''
+        return False
+
+def _freeze(value):
+    '''
+    Returns a hashable representation of the content of a configuration
+    value, in which dicts, lists and the types of scalars are distinguished.
+    Raises a `TypeError` if the value contains something unhashable.
+    '''
+    if isinstance(value, dict):
+        return (dict, tuple(sorted((k, _freeze(v)) for k, v in value.items())))
+    elif isinstance(value, (list, tuple)):
+        return (list, tuple(_freeze(e) for e in value))
+    elif isinstance(value, cntk_py.SizeTWrapper):
+        return (cntk_py.SizeTWrapper, value.value)
+    hash(value)
+    return (type(value), value)
+
+_CNTK_DICT_CACHE_SIZE = 128
+_cntk_dict_cache = collections.OrderedDict()
+_cntk_dict_cache_lock = threading.Lock()
+
+def _cached_cntk_dict(py_dict):
+    '''
+    Like :func:`_py_dict_to_cntk_dict`, but returns the same
+    :class:`~cntk_py.Dictionary` for dictionaries with equal content. The
+    result must not be modified.
+    '''
+    try:
+        key = _freeze(py_dict)
+    except TypeError:
+        return _py_dict_to_cntk_dict(py_dict)
+
+    with _cntk_dict_cache_lock:
+        cntk_dict = _cntk_dict_cache.pop(key, None)
+        if cntk_dict is not None:
+            # mark as most recently used
+            _cntk_dict_cache[key] = cntk_dict
+            return cntk_dict
+
+    cntk_dict = _py_dict_to_cntk_dict(py_dict)
+    with _cntk_dict_cache_lock:
+        _cntk_dict_cache[key] = cntk_dict
+        while len(_cntk_dict_cache) > _CNTK_DICT_CACHE_SIZE:
+            _cntk_dict_cache.popitem(last=False)
+    return cntk_dict
+
 def _py_dict_to_cntk_dict(py_dict):
     '''
     Converts a Python dictionary into a CNTK Dictionary whose values are CNTK DictionaryValue instances.
+    Dictionaries in lists, such as the deserializers of a
+    :class:`ReaderConfig`, are converted only once for equal content.
     Args:
         py_dict (dict): a dictionary to be converted.
     Returns:
@@ -207,13 +784,16 @@ def _py_dict_to_cntk_dict(py_dict):
     for k, v in py_dict.items():
         if isinstance(v, dict):
             res[k] = cntk_py.DictionaryValueFromDict(_py_dict_to_cntk_dict(v))
+        elif isinstance(v, cntk_py.Dictionary):
+            # e.g. the checkpoint state of a minibatch source
+            res[k] = cntk_py.DictionaryValueFromDict(v)
         # TODO: add support to list of lists ?
         elif isinstance(v, list):
             l = []
             for e in v:
                 if isinstance(e, dict):
                     l.append(cntk_py.DictionaryValueFromDict(
-                        _py_dict_to_cntk_dict(e)))
+                        _cached_cntk_dict(e)))
                 else:
                     l.append(cntk_py.DictionaryValue(e))
             res[k] = cntk_py.DictionaryValue(l)
@@ -232,8 +812,11 @@ def minibatch_source(config):
     Returns:
         :class:`MinibatchSource`
     '''
-    cntk_dict = _py_dict_to_cntk_dict(config)
-    return cntk_py.create_composite_minibatch_source(cntk_dict)
+    cntk_dict = _cached_cntk_dict(config)
+    source = cntk_py.create_composite_minibatch_source(cntk_dict)
+    # keep the configuration for MinibatchSource.clone()
+    source._reader_config = dict(config)
+    return source
 
 # TODO: This should be a private class.
 class ReaderConfig(dict):
@@ -553,7 +1136,7 @@ def StreamDef(field, shape=None, is_sparse=False, transforms=None):
 StreamDefs = Record
 
 def _dense_to_str(data):
-    return ' '.join(data.ravel(order='C').astype(np.str))
+    return ' '.join(data.ravel(order='C').astype(str))
 
 
 def _sparse_to_str(data):
@@ -604,6 +1187,8 @@ def sequence_to_cntk_text_format(seq_idx, alias_tensor_map):
     '''
     Converts a list of NumPy arrays representing tensors of inputs into a
     format that is readable by :class:`~cntk.io.CTFDeserializer`.
+    To convert many sequences, use :class:`CTFWriter`, which formats whole
+    batches of sequences at once.
 
     Args:
         seq_idx (int): number of current sequence
@@ -645,3 +1230,500 @@ def sequence_to_cntk_text_format(seq_idx, alias_tensor_map):
     return '\n'.join(lines)
 
 
+
+
+def _ctf_values(data, fmt):
+    '''
+    Returns the values of ``data`` as flat list and the format to apply to
+    them. Without an explicit format the values are converted to strings by
+    NumPy, which yields the shortest representation that reads back exactly.
+    '''
+    if fmt is not None:
+        return data.ravel().tolist(), fmt
+    if data.dtype == np.bool_:
+        data = data.astype(np.int8)
+    return data.ravel().astype(str).tolist(), '%s'
+
+
+def _dense_rows_to_ctf(alias, data, fmt):
+    '''
+    Formats every row of the 2D array ``data`` as CTF field ``alias`` with a
+    single formatting operation over the whole block.
+    '''
+    num_rows, dim = data.shape
+    if num_rows == 0:
+        return []
+
+    values, fmt = _ctf_values(data, fmt)
+    row = alias.replace('%', '%%') + ' ' + ' '.join([fmt] * dim)
+    return ('\n'.join([row] * num_rows) % tuple(values)).split('\n')
+
+
+def _csr_rows_to_ctf(alias, data, fmt):
+    '''
+    Formats every row of the CSR matrix ``data`` as sparse CTF field
+    ``alias`` (``index:value`` pairs).
+    '''
+    num_rows = data.shape[0]
+    if num_rows == 0:
+        return []
+
+    if not data.has_sorted_indices:
+        data = data.sorted_indices()
+
+    nnz = data.indptr[-1]
+    pairs = [None] * (2 * nnz)
+    pairs[::2] = data.indices[:nnz].tolist()
+    pairs[1::2], fmt = _ctf_values(data.data[:nnz], fmt)
+    tokens = ('\n'.join(['%d:' + fmt] * nnz) % tuple(pairs)).split('\n') \
+            if nnz else []
+
+    prefix = alias + ' '
+    indptr = data.indptr.tolist()
+    return [prefix + ' '.join(tokens[start:end])
+            for start, end in zip(indptr[:-1], indptr[1:])]
+
+
+class CTFWriter(object):
+    '''
+    Writes data in the `CNTKTextReader format
+    <https://github.com/microsoft/cntk/wiki/CNTKTextFormat-Reader>`_ that is
+    read by :class:`~cntk.io.CTFDeserializer`.
+
+    Data is passed in batches of sequences to :meth:`write`. Every batch is
+    formatted with a few vectorized operations instead of formatting every
+    value separately, and the output is collected in a buffer that is
+    written to the file whenever it exceeds ``buffer_size`` characters.
+
+    Example:
+        >>> import io
+        >>> out = io.StringIO()
+        >>> with CTFWriter(out) as writer:
+        ...     num_sequences = writer.write(
+        ...         {'x': np.asarray([[1, 2], [3, 4], [5, 6]]),
+        ...          'y': np.asarray([[0], [1], [1]])},
+        ...         sequence_lengths=[2, 1])
+        >>> out.getvalue().splitlines()
+        ['0\\t|x 1 2 |y 0', '0\\t|x 3 4 |y 1', '1\\t|x 5 6 |y 1']
+
+    Args:
+        f (str or file): name of the file to create or a file object opened
+         for writing text. A file that is opened by the writer is closed in
+         :meth:`close`.
+        first_sequence_id (int, default 0): id of the first written sequence.
+         Subsequent sequences are numbered consecutively.
+        fmt (str or dict, default None): printf-style format for the values,
+         or a mapping from alias to format. By default, values are written in
+         the shortest form that reads back without loss, as
+         :func:`sequence_to_cntk_text_format` does.
+        buffer_size (int, default 1048576): number of characters that are
+         collected before they are written to the file
+    '''
+    def __init__(self, f, first_sequence_id=0, fmt=None, buffer_size=1<<20):
+        if isinstance(f, str):
+            self._file = open(f, 'w')
+            self._owns_file = True
+        else:
+            self._file = f
+            self._owns_file = False
+
+        self._next_sequence_id = first_sequence_id
+        self._fmt = fmt
+        self._buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+
+    @property
+    def next_sequence_id(self):
+        '''
+        The id that the next written sequence will get.
+        '''
+        return self._next_sequence_id
+
+    def _format_rows(self, alias, data):
+        fmt = self._fmt
+        if isinstance(fmt, dict):
+            fmt = fmt.get(alias)
+
+        if sparse.issparse(data):
+            data = data.tocsr()
+            return _csr_rows_to_ctf(alias, data, fmt)
+
+        if not isinstance(data, np.ndarray):
+            data = np.asarray(data)
+        if data.dtype == object:
+            raise ValueError('data for alias "%s" is not numeric' % alias)
+        data = data.reshape(len(data), -1)
+
+        return _dense_rows_to_ctf(alias, data, fmt)
+
+    def write(self, alias_data_map, sequence_lengths=None):
+        '''
+        Writes a batch of sequences.
+
+        Args:
+            alias_data_map (dict): maps every alias (str) to the samples of
+             all sequences of the batch concatenated along the first axis,
+             either as NumPy array (dense input) or as SciPy sparse matrix
+             (sparse input, converted to CSR)
+            sequence_lengths (list, NumPy array or dict, default None): the
+             number of samples per sequence. If it is a `dict`, it maps every
+             alias to its own sequence lengths. If it is `None`, every sample
+             is a sequence of its own.
+
+        Returns:
+            the number of written sequences
+        '''
+        if not alias_data_map:
+            return 0
+
+        aliases = sorted(alias_data_map)
+        rows = [self._format_rows(alias, alias_data_map[alias])
+                for alias in aliases]
+
+        if isinstance(sequence_lengths, dict):
+            lengths = [np.asarray(sequence_lengths[alias], dtype=int)
+                       for alias in aliases]
+        elif sequence_lengths is None:
+            lengths = [np.ones(len(r), dtype=int) for r in rows]
+        else:
+            lengths = [np.asarray(sequence_lengths, dtype=int)] * len(aliases)
+
+        num_sequences = len(lengths[0])
+        for alias, r, l in zip(aliases, rows, lengths):
+            if len(l) != num_sequences:
+                raise ValueError('alias "%s" has %i sequences, but %i were '
+                        'expected' % (alias, len(l), num_sequences))
+            if l.sum() != len(r):
+                raise ValueError('alias "%s" has %i samples, but the sequence '
+                        'lengths add up to %i' % (alias, len(r), l.sum()))
+
+        seq_ids = np.arange(self._next_sequence_id,
+                self._next_sequence_id + num_sequences)
+
+        if all(np.array_equal(lengths[0], l) for l in lengths[1:]):
+            # every line contains all aliases: one formatting operation
+            num_lines = int(lengths[0].sum())
+            line = '%d\t|' + ' |'.join(['%s'] * len(aliases))
+            line_ids = np.repeat(seq_ids, lengths[0]).tolist()
+            values = tuple(itertools.chain.from_iterable(zip(line_ids, *rows)))
+            text = '\n'.join([line] * num_lines) % values if num_lines else ''
+        else:
+            # line k of a sequence holds the k-th sample of every alias that
+            # has at least k+1 samples in this sequence
+            max_lengths = np.max(lengths, axis=0)
+            line_starts = np.cumsum(max_lengths) - max_lengths
+            lines = [[] for _ in range(int(max_lengths.sum()))]
+            for r, l in zip(rows, lengths):
+                row_starts = np.cumsum(l) - l
+                line_idx = np.arange(len(r)) - np.repeat(row_starts - line_starts, l)
+                for i, row in zip(line_idx.tolist(), r):
+                    lines[i].append(row)
+            line_ids = np.repeat(seq_ids, max_lengths).tolist()
+            text = '\n'.join('%d\t|' % seq_id + ' |'.join(parts)
+                             for seq_id, parts in zip(line_ids, lines))
+
+        if text:
+            self._buffer.append(text + '\n')
+            self._buffered += len(text) + 1
+            if self._buffered >= self._buffer_size:
+                self.flush()
+
+        self._next_sequence_id += num_sequences
+        return num_sequences
+
+    def flush(self):
+        '''
+        Writes the buffered data to the file.
+        '''
+        if self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self._file.flush()
+
+    def close(self):
+        '''
+        Writes the buffered data and closes the file if it was opened by the
+        writer.
+        '''
+        if self._file is None:
+            return
+        self.flush()
+        if self._owns_file:
+            self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CTFIndex(object):
+    '''
+    Index of the sequences in a file in the `CNTKTextReader format
+    <https://github.com/microsoft/cntk/wiki/CNTKTextFormat-Reader>`_ that
+    allows reading any sequence without scanning the file.
+
+    The file is scanned once in blocks with vectorized NumPy operations. For
+    every sequence the index stores its id, its byte offset, its length in
+    bytes and its number of samples (lines). Consecutive lines with the same
+    sequence id form one sequence; lines without a sequence id are sequences
+    of their own and get the id one larger than the id of the sequence
+    before. Sequences are read through a memory map of the file.
+
+    The index can be cached in a sidecar file next to the data (``.idx``
+    appended to the file name), which is reused as long as size and
+    modification time of the data file match.
+
+    Example:
+        >>> index = CTFIndex('train.ctf') # doctest: +SKIP
+        >>> print(index.read(42)) # doctest: +SKIP
+        42 |features 0 1 0 |labels 1
+
+    Args:
+        filename (str): name of the CTF file
+        cache (bool or str, default True): whether to load and store the
+         index from/in the sidecar file. A string is taken as the name of
+         the cache file.
+        block_size (int, default 64 MB): number of bytes that are scanned at
+         once when the index is built
+    '''
+
+    _VERSION = 1
+
+    def __init__(self, filename, cache=True, block_size=1<<26):
+        self._filename = filename
+        self._mmap = None
+        self._file = None
+        self._sorted_order = None
+        self._sorted_ids = None
+
+        if cache is True:
+            cache = filename + '.idx'
+
+        stat = os.stat(filename)
+        self._stamp = np.asarray([self._VERSION, stat.st_size,
+            int(stat.st_mtime * 1e6)], dtype=np.int64)
+
+        if not (cache and self._load(cache)):
+            self._build(stat.st_size, block_size)
+            if cache:
+                self._save(cache)
+
+    @property
+    def filename(self):
+        '''
+        The name of the indexed file.
+        '''
+        return self._filename
+
+    @property
+    def sequence_ids(self):
+        '''
+        The sequence ids in the order of the file as NumPy array.
+        '''
+        return self._ids
+
+    @property
+    def offsets(self):
+        '''
+        The byte offsets of the sequences as NumPy array.
+        '''
+        return self._offsets
+
+    @property
+    def lengths(self):
+        '''
+        The lengths of the sequences in bytes as NumPy array.
+        '''
+        return self._lengths
+
+    @property
+    def sample_counts(self):
+        '''
+        The number of samples (lines) of the sequences as NumPy array.
+        '''
+        return self._sample_counts
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, sequence_id):
+        return self._position(sequence_id) is not None
+
+    def _load(self, cache):
+        try:
+            with open(cache, 'rb') as f:
+                data = np.load(f)
+                if not np.array_equal(data['stamp'], self._stamp):
+                    return False
+                self._ids = data['ids']
+                self._offsets = data['offsets']
+                self._lengths = data['lengths']
+                self._sample_counts = data['sample_counts']
+            return True
+        except (IOError, OSError, KeyError, ValueError):
+            return False
+
+    def _save(self, cache):
+        try:
+            with open(cache, 'wb') as f:
+                np.savez(f, stamp=self._stamp, ids=self._ids,
+                        offsets=self._offsets, lengths=self._lengths,
+                        sample_counts=self._sample_counts)
+        except (IOError, OSError):
+            # the index is still usable, only not cached
+            pass
+
+    @staticmethod
+    def _scan_block(block, base):
+        '''
+        Returns start, end, id and whether the id is explicit for every
+        non-empty line in ``block`` that starts at file offset ``base``.
+        '''
+        newlines = np.flatnonzero(block == ord('\n'))
+        starts = np.concatenate(([0], newlines + 1))
+        ends = np.concatenate((newlines + 1, [len(block)]))
+        # the end of the content, i.e. without line break
+        content_ends = np.concatenate((newlines, [len(block)]))
+        has_cr = content_ends > starts
+        has_cr[has_cr] = block[content_ends[has_cr] - 1] == ord('\r')
+        content_ends -= has_cr
+
+        non_empty = content_ends > starts
+        starts, ends, content_ends = starts[non_empty], ends[non_empty], content_ends[non_empty]
+
+        ids = np.zeros(len(starts), dtype=np.int64)
+        digits = np.zeros(len(starts), dtype=np.int64)
+        active = np.ones(len(starts), dtype=bool)
+        # at most 19 decimal digits fit into int64
+        for k in range(19):
+            pos = starts + k
+            active &= pos < content_ends
+            if not active.any():
+                break
+            chars = block[np.minimum(pos, len(block) - 1)].astype(np.int64)
+            active &= (chars >= ord('0')) & (chars <= ord('9'))
+            ids[active] = ids[active] * 10 + chars[active] - ord('0')
+            digits += active
+
+        return starts + base, ends + base, ids, digits > 0
+
+    def _build(self, file_size, block_size):
+        line_starts, line_ends, line_ids, explicit = [], [], [], []
+        if file_size > 0:
+            with open(self._filename, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    buf = np.frombuffer(data, dtype=np.uint8)
+                    begin = 0
+                    while begin < file_size:
+                        end = min(begin + block_size, file_size)
+                        if end < file_size:
+                            # only scan complete lines
+                            last_newline = np.flatnonzero(buf[begin:end] == ord('\n'))
+                            if len(last_newline):
+                                end = begin + last_newline[-1] + 1
+                            else:
+                                nl = data.find(b'\n', end)
+                                end = file_size if nl < 0 else nl + 1
+                        result = CTFIndex._scan_block(buf[begin:end], begin)
+                        for l, r in zip((line_starts, line_ends, line_ids, explicit), result):
+                            l.append(r)
+                        begin = end
+                    del buf
+                finally:
+                    data.close()
+
+        if line_starts:
+            starts = np.concatenate(line_starts)
+            ends = np.concatenate(line_ends)
+            ids = np.concatenate(line_ids)
+            explicit = np.concatenate(explicit)
+        else:
+            starts = ends = ids = np.zeros(0, dtype=np.int64)
+            explicit = np.zeros(0, dtype=bool)
+
+        # a line continues the sequence of the line before if both carry the
+        # same explicit id
+        new_sequence = np.ones(len(starts), dtype=bool)
+        new_sequence[1:] = ~(explicit[1:] & explicit[:-1] & (ids[1:] == ids[:-1]))
+        first_lines = np.flatnonzero(new_sequence)
+        last_lines = np.append(first_lines[1:], len(starts))[:len(first_lines)] - 1
+
+        # sequences without id continue the numbering of the last explicit id
+        seq_ids = ids[first_lines]
+        seq_explicit = explicit[first_lines]
+        positions = np.arange(len(first_lines))
+        last_explicit = np.maximum.accumulate(np.where(seq_explicit, positions, -1)) \
+                if len(first_lines) else positions
+        base = np.where(last_explicit >= 0, seq_ids[np.maximum(last_explicit, 0)], -1)
+        seq_ids = np.where(seq_explicit, seq_ids, base + positions - last_explicit)
+
+        self._ids = seq_ids
+        self._offsets = starts[first_lines]
+        self._lengths = ends[last_lines] - self._offsets
+        self._sample_counts = (last_lines - first_lines + 1).astype(np.int32)
+
+    def _position(self, sequence_id):
+        if self._sorted_order is None:
+            # sorted once, every lookup is a binary search
+            self._sorted_order = np.argsort(self._ids, kind='mergesort')
+            self._sorted_ids = self._ids[self._sorted_order]
+        sorted_ids = self._sorted_ids
+        i = np.searchsorted(sorted_ids, sequence_id)
+        if i < len(sorted_ids) and sorted_ids[i] == sequence_id:
+            return self._sorted_order[i]
+        return None
+
+    def read_at(self, position):
+        '''
+        Reads the sequence at the given position in the file.
+
+        Args:
+            position (int): index of the sequence in the file, i.e. 0 is the
+             first sequence, 1 the second, and so on
+
+        Returns:
+            `str` with the lines of the sequence
+        '''
+        if self._mmap is None:
+            self._file = open(self._filename, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        offset = self._offsets[position]
+        return self._mmap[offset:offset + self._lengths[position]].decode('utf-8')
+
+    def read(self, sequence_id):
+        '''
+        Reads the sequence with the given id. If the id occurs more than
+        once in the file, the first sequence with this id is returned.
+
+        Args:
+            sequence_id (int): id of the sequence
+
+        Returns:
+            `str` with the lines of the sequence
+        '''
+        position = self._position(sequence_id)
+        if position is None:
+            raise KeyError('sequence %s is not in %s' % (sequence_id, self._filename))
+        return self.read_at(position)
+
+    def close(self):
+        '''
+        Closes the memory map of the file.
+        '''
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,334 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Reading files in the CNTK binary format (CBF) that is read by the
+``CNTKBinaryReader`` and written by ``Scripts/ctf2bin.py``.
+
+A CBF file consists of
+
+ * a header: the format version (int64), the number of chunks (int64), the
+   number of streams (int32) and a description of every stream,
+ * the offsets table: for every chunk its offset relative to the start of the
+   data (int64), its number of sequences (int32) and its number of samples
+   (int32),
+ * the chunks: for every stream in header order either the dense values of
+   all sequences (one sample per sequence), or the sparse values in CSC
+   layout where every column is a sequence and the row index of a value is
+   ``sample index * dimension + index``.
+
+The file is memory-mapped, and the chunks are returned as NumPy arrays and
+SciPy sparse matrices that share the memory of the mapping.
+'''
+
+import mmap
+import struct
+import numpy as np
+from scipy import sparse
+
+from ..utils import Record
+
+_DENSE = 0
+_SPARSE = 1
+_ELEMENT_TYPES = { 0 : np.float32, 1 : np.float64 }
+_OFFSETS_TABLE_DTYPE = np.dtype([('offset', '<i8'), ('num_sequences', '<i4'),
+    ('num_samples', '<i4')])
+
+
+def _csc_view(data, indices, indptr, shape):
+    # the constructor of csc_matrix may copy the index arrays, so the
+    # arrays are assigned directly
+    matrix = sparse.csc_matrix(shape, dtype=data.dtype)
+    matrix.data = data
+    matrix.indices = indices
+    matrix.indptr = indptr
+    return matrix
+
+
+class BinaryFormatReader(object):
+    '''
+    Memory-maps a file in the CNTK binary format and gives access to its
+    chunks.
+
+    Example:
+        >>> with BinaryFormatReader('train.bin') as reader: # doctest: +SKIP
+        ...     for chunk in reader.chunks():
+        ...         features = chunk['features'] # (num_sequences, dim) array
+        ...         labels = chunk['labels'] # scipy.sparse.csc_matrix
+
+    Args:
+        filename (str): name of the CBF file
+    '''
+    def __init__(self, filename):
+        self._filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError('%s is empty' % filename)
+        self._read_header()
+
+    def _unpack(self, fmt, pos):
+        size = struct.calcsize(fmt)
+        if pos + size > len(self._mmap):
+            raise ValueError('%s is truncated: expected %i bytes at offset %i' %
+                    (self._filename, size, pos))
+        return struct.unpack_from(fmt, self._mmap, pos), pos + size
+
+    def _read_header(self):
+        (self.version, num_chunks, num_streams), pos = self._unpack('<qqi', 0)
+        if self.version != 1:
+            raise ValueError('unsupported CBF version %i' % self.version)
+
+        streams = []
+        for _ in range(num_streams):
+            (name_length,), pos = self._unpack('<i', pos)
+            name = self._mmap[pos:pos + name_length].decode('utf-8')
+            pos += name_length
+
+            (matrix_type,), pos = self._unpack('<i', pos)
+            if matrix_type == _DENSE:
+                (element_type, dim), pos = self._unpack('<ii', pos)
+                is_sequence = False
+            elif matrix_type == _SPARSE:
+                (storage_type, element_type, is_sequence, dim), pos = \
+                        self._unpack('<iiii', pos)
+                if storage_type != 0:
+                    raise ValueError('stream "%s" has unsupported storage type %i'
+                            % (name, storage_type))
+                is_sequence = bool(is_sequence)
+            else:
+                raise ValueError('stream "%s" has unknown matrix type %i' %
+                        (name, matrix_type))
+
+            if element_type not in _ELEMENT_TYPES:
+                raise ValueError('stream "%s" has unknown element type %i' %
+                        (name, element_type))
+
+            streams.append(Record(name=name, is_sparse=matrix_type == _SPARSE,
+                dtype=_ELEMENT_TYPES[element_type], dim=dim,
+                is_sequence=is_sequence))
+
+        self.streams = streams
+
+        offsets_size = num_chunks * _OFFSETS_TABLE_DTYPE.itemsize
+        if pos + offsets_size > len(self._mmap):
+            raise ValueError('%s is truncated: the offsets table of %i chunks '
+                    'does not fit' % (self._filename, num_chunks))
+        self.offsets_table = np.frombuffer(self._mmap, _OFFSETS_TABLE_DTYPE,
+                num_chunks, pos)
+        self._data_start = pos + offsets_size
+
+    @property
+    def filename(self):
+        '''
+        The name of the file.
+        '''
+        return self._filename
+
+    @property
+    def num_chunks(self):
+        '''
+        The number of chunks in the file.
+        '''
+        return len(self.offsets_table)
+
+    @property
+    def num_sequences(self):
+        '''
+        The number of sequences in the file according to the offsets table.
+        '''
+        return int(self.offsets_table['num_sequences'].sum())
+
+    @property
+    def num_samples(self):
+        '''
+        The number of samples in the file according to the offsets table.
+        '''
+        return int(self.offsets_table['num_samples'].sum())
+
+    def _chunk_range(self, index):
+        begin = self._data_start + int(self.offsets_table['offset'][index])
+        if index + 1 < self.num_chunks:
+            end = self._data_start + int(self.offsets_table['offset'][index + 1])
+        else:
+            end = len(self._mmap)
+        return begin, end
+
+    def _array(self, dtype, count, pos, end):
+        size = np.dtype(dtype).itemsize * count
+        if count < 0 or pos + size > end:
+            raise ValueError('chunk data exceeds the chunk at offset %i' % pos)
+        return np.frombuffer(self._mmap, dtype, count, pos), pos + size
+
+    def _parse_chunk(self, index):
+        if not 0 <= index < self.num_chunks:
+            raise IndexError('chunk index %i out of range (%i chunks)' %
+                    (index, self.num_chunks))
+
+        pos, end = self._chunk_range(index)
+        num_sequences = int(self.offsets_table['num_sequences'][index])
+
+        chunk = {}
+        for stream in self.streams:
+            if stream.is_sparse:
+                (nnz,), pos = self._unpack('<i', pos)
+                values, pos = self._array(stream.dtype, nnz, pos, end)
+                row_indices, pos = self._array('<i4', nnz, pos, end)
+                col_indices, pos = self._array('<i4', num_sequences + 1, pos, end)
+                chunk[stream.name] = (values, row_indices, col_indices)
+            else:
+                values, pos = self._array(stream.dtype,
+                        num_sequences * stream.dim, pos, end)
+                chunk[stream.name] = values.reshape(num_sequences, stream.dim)
+
+        return chunk, end - pos
+
+    def chunk(self, index):
+        '''
+        Returns the data of a chunk without copying it.
+
+        Args:
+            index (int): index of the chunk
+
+        Returns:
+            `dict` mapping the stream names to the data of the chunk. Dense
+            streams are read-only arrays of shape (number of sequences,
+            dimension). Sparse streams are ``scipy.sparse.csc_matrix``
+            instances with one column per sequence, in which sample `i` of a
+            sequence occupies the rows ``i * dimension`` to
+            ``(i + 1) * dimension - 1``.
+        '''
+        chunk, _ = self._parse_chunk(index)
+        num_sequences = int(self.offsets_table['num_sequences'][index])
+        for stream in self.streams:
+            if stream.is_sparse:
+                values, row_indices, col_indices = chunk[stream.name]
+                max_row = int(row_indices.max()) + 1 if len(row_indices) else 0
+                num_rows = -(-max_row // stream.dim) * stream.dim
+                chunk[stream.name] = _csc_view(values, row_indices,
+                        col_indices, (num_rows, num_sequences))
+        return chunk
+
+    def chunks(self):
+        '''
+        Iterates over the chunks of the file, see :meth:`chunk`.
+        '''
+        for index in range(self.num_chunks):
+            yield self.chunk(index)
+
+    def validate(self):
+        '''
+        Checks the file for consistency without converting any data:
+
+         * every chunk has to lie inside the file and consume exactly the
+           bytes up to the next chunk,
+         * the sparse column offsets have to be non-decreasing and end at the
+           number of values, the row indices have to be non-negative,
+         * the number of samples of every chunk in the offsets table has to
+           match the data: every sequence has as many samples as its longest
+           stream (dense streams have one sample per sequence, sparse streams
+           as many as the highest row index implies). Samples without any
+           values at the end of sparse sequences are not visible in the
+           data, so the table may have more samples, but never less.
+
+        Returns:
+            `list` of `str` describing the problems found; empty if the file
+            is valid
+        '''
+        problems = []
+        offsets = self.offsets_table['offset']
+        if np.any(np.diff(offsets) < 0) or (len(offsets) and offsets[0] != 0):
+            problems.append('the chunk offsets are not increasing from 0')
+            return problems
+
+        if len(offsets) and self._data_start + int(offsets[-1]) > len(self._mmap):
+            problems.append('the last chunk starts beyond the end of the file')
+            return problems
+
+        for index in range(self.num_chunks):
+            try:
+                chunk, remaining = self._parse_chunk(index)
+            except ValueError as e:
+                problems.append('chunk %i: %s' % (index, e))
+                continue
+
+            if remaining != 0:
+                problems.append('chunk %i: %i bytes are not used by any stream'
+                        % (index, remaining))
+
+            num_sequences = int(self.offsets_table['num_sequences'][index])
+            samples = np.zeros(num_sequences, dtype=np.int64)
+            for stream in self.streams:
+                if not stream.is_sparse:
+                    np.maximum(samples, 1, out=samples)
+                    continue
+
+                values, row_indices, col_indices = chunk[stream.name]
+                if col_indices[0] != 0 or col_indices[-1] != len(values) or \
+                        np.any(np.diff(col_indices) < 0):
+                    problems.append('chunk %i: stream "%s" has invalid column '
+                            'offsets' % (index, stream.name))
+                    continue
+                if np.any(row_indices < 0):
+                    problems.append('chunk %i: stream "%s" has negative row '
+                            'indices' % (index, stream.name))
+                    continue
+
+                # the highest sample index per sequence
+                nnz_per_sequence = np.diff(col_indices)
+                non_empty = nnz_per_sequence > 0
+                last_sample = np.zeros(num_sequences, dtype=np.int64)
+                if non_empty.any():
+                    last_sample[non_empty] = np.maximum.reduceat(
+                            row_indices // stream.dim,
+                            col_indices[:-1][non_empty]) + 1
+                np.maximum(samples, last_sample, out=samples)
+
+            expected = int(self.offsets_table['num_samples'][index])
+            if samples.sum() > expected:
+                problems.append('chunk %i: the data has %i samples, but the '
+                        'offsets table %i' % (index, samples.sum(), expected))
+
+        return problems
+
+    def close(self):
+        '''
+        Closes the file. Arrays returned by :meth:`chunk` must not be used
+        afterwards.
+        '''
+        if self._mmap is not None:
+            self.offsets_table = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                # arrays still reference the mapping, it is released with them
+                pass
+            self._file.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def validate(filename):
+    '''
+    Checks a file in the CNTK binary format for consistency, see
+    :meth:`BinaryFormatReader.validate`.
+
+    Args:
+        filename (str): name of the CBF file
+
+    Returns:
+        `list` of `str` describing the problems found; empty if the file is
+        valid
+    '''
+    with BinaryFormatReader(filename) as reader:
+        return reader.validate()
@@ -0,0 +1,69 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+import struct
+import numpy as np
+
+from cntk.io.binary_format import BinaryFormatReader, validate
+
+def _write_cbf(filename, chunks_data, offsets):
+    header = struct.pack('<qqi', 1, len(offsets), 2) + \
+        struct.pack('<i', 1) + b'A' + struct.pack('<iii', 0, 0, 2) + \
+        struct.pack('<i', 1) + b'B' + struct.pack('<iiiii', 1, 0, 0, 1, 4)
+    table = b''.join(struct.pack('<qii', *o) for o in offsets)
+    with open(filename, 'wb') as f:
+        f.write(header + table + b''.join(chunks_data))
+
+# Two chunks of an input with a dense stream A (dim 2) and a sparse stream B
+# (dim 4), as written by ctf2bin.py for
+#   0 |a 1 2 |b 3:1.5 1:2
+#   0 |b 0:1
+#   1 |a 3 4
+#   2 |a 5 6 |b 2:-1
+CHUNK0 = struct.pack('<4f', 1, 2, 3, 4) + \
+    struct.pack('<i3f3i3i', 3, 2, 1.5, 1, 1, 3, 4, 0, 3, 3)
+CHUNK1 = struct.pack('<2f', 5, 6) + struct.pack('<i1f1i2i', 1, -1, 2, 0, 1)
+
+def test_binary_format_reader(tmpdir):
+    filename = str(tmpdir/'data.bin')
+    _write_cbf(filename, [CHUNK0, CHUNK1], [(0, 2, 3), (len(CHUNK0), 1, 1)])
+
+    with BinaryFormatReader(filename) as reader:
+        assert reader.num_chunks == 2
+        assert reader.num_sequences == 3
+        assert reader.num_samples == 4
+        assert [s.name for s in reader.streams] == ['A', 'B']
+        assert not reader.streams[0].is_sparse
+        assert reader.streams[1].is_sparse
+        assert reader.streams[1].dim == 4
+
+        chunk = reader.chunk(0)
+        assert chunk['A'].dtype == np.float32
+        assert np.allclose(chunk['A'], [[1, 2], [3, 4]])
+
+        b = chunk['B'].toarray()
+        assert b.shape == (8, 2)
+        assert np.allclose(b[:, 0], [0, 2, 0, 1.5, 1, 0, 0, 0])
+        assert np.allclose(b[:, 1], 0)
+
+        chunks = list(reader.chunks())
+        assert np.allclose(chunks[1]['A'], [[5, 6]])
+        assert np.allclose(chunks[1]['B'].toarray()[:, 0], [0, 0, -1, 0])
+
+        assert reader.validate() == []
+
+def test_binary_format_validate(tmpdir):
+    filename = str(tmpdir/'wrong_samples.bin')
+    _write_cbf(filename, [CHUNK0, CHUNK1], [(0, 2, 2), (len(CHUNK0), 1, 1)])
+    problems = validate(filename)
+    assert len(problems) == 1
+    assert problems[0].startswith('chunk 0')
+
+    filename = str(tmpdir/'truncated.bin')
+    _write_cbf(filename, [CHUNK0, CHUNK1[:-4]], [(0, 2, 3), (len(CHUNK0), 1, 1)])
+    problems = validate(filename)
+    assert len(problems) == 1
+    assert problems[0].startswith('chunk 1')
@@ -9,7 +9,7 @@ import os
 import numpy as np
 import pytest
 
-from cntk.io import _is_tensor, sequence_to_cntk_text_format
+from cntk.io import _is_tensor, sequence_to_cntk_text_format, CTFWriter
 
 abs_path = os.path.dirname(os.path.abspath(__file__))
 
@@ -145,6 +145,22 @@ def test_image():
     l = d['input'][label_name]
     assert l['labelDim'] == num_classes
     
+    # equal configurations are converted only once
+    from cntk.io import _cached_cntk_dict
+    same_rc = ReaderConfig(ImageDeserializer(map_file), randomize=True,
+            randomization_window=100, epoch_size=epoch_size)
+    same_rc['deserializers'][0].map_features(feature_name,
+            [ImageDeserializer.crop(crop_type='Random', ratio=0.8,
+                jitter_type='uniRatio'),
+             ImageDeserializer.scale(width=image_width, height=image_height,
+                 channels=num_channels, interpolations='linear'),
+             ImageDeserializer.mean(mean_file)])
+    same_rc['deserializers'][0].map_labels(label_name, num_classes)
+    assert _cached_cntk_dict(same_rc) is _cached_cntk_dict(rc)
+    assert _cached_cntk_dict(ReaderConfig(image, randomize=False,
+        randomization_window=100, epoch_size=epoch_size)) is not \
+                _cached_cntk_dict(rc)
+
     # TODO depends on ImageReader.dll
     ''' 
     mbs = rc.minibatch_source()
@@ -208,6 +224,134 @@ def test_minibatch(tmpdir):
             [[2, 1, 1],
              [2, 1, 0]])
 
+    padded = labels.as_numpy()
+    assert padded.data.shape == (2, 3, 1)
+    assert list(padded.lengths) == [3, 2]
+    assert labels.as_numpy() is padded
+    assert not padded.data.flags.writeable
+    for res, exp in zip(padded.sequences(), expected_labels):
+        assert np.allclose(res, exp)
+    assert labels.as_numpy(copy=True).data.flags.writeable
+
+def test_minibatch_source_clone(tmpdir):
+    mbdata = ''.join('%i\t|S0 %i\n' % (i, i) for i in range(10))
+
+    tmpfile = str(tmpdir/'mbclone.txt')
+    with open(tmpfile, 'w') as f:
+        f.write(mbdata)
+
+    from cntk.io import CTFDeserializer, MinibatchSource, StreamDef, StreamDefs
+    mb_source = MinibatchSource(CTFDeserializer(tmpfile, StreamDefs(
+        features = StreamDef(field='S0', shape=1))),
+        randomize=False, epoch_size=4)
+    mb = mb_source.next_minibatch(10)
+    assert mb[mb_source.streams.features].num_samples == 4
+
+    clone = mb_source.clone(epoch_size=10)
+    assert isinstance(clone, MinibatchSource)
+    mb = clone.next_minibatch(10)
+    features = mb[clone.streams.features]
+    assert features.num_samples == 10
+    assert np.allclose(features.value, np.arange(10).reshape(10, 1, 1))
+
+    randomized = clone.clone(randomize=True)
+    mb = randomized.next_minibatch(10)
+    assert mb[randomized.streams.features].num_samples == 10
+
+def test_prefetching_minibatch_source(tmpdir):
+    mbdata = ''.join('%i\t|S0 %i\n' % (i, i) for i in range(20))
+
+    tmpfile = str(tmpdir/'mbprefetch.txt')
+    with open(tmpfile, 'w') as f:
+        f.write(mbdata)
+
+    from cntk.io import CTFDeserializer, MinibatchSource, StreamDef, StreamDefs
+    from cntk.io import PrefetchingMinibatchSource
+    from cntk.ops import input_variable
+
+    def create_source():
+        return MinibatchSource(CTFDeserializer(tmpfile, StreamDefs(
+            features = StreamDef(field='S0', shape=1))),
+            randomize=False, epoch_size=20)
+
+    expected = []
+    mb_source = create_source()
+    while True:
+        mb = mb_source.next_minibatch(3)
+        if not mb:
+            break
+        expected.append(mb[mb_source.streams.features].value)
+
+    reader = PrefetchingMinibatchSource(create_source(), prefetch=2)
+    x = input_variable(1)
+    input_map = { x : reader.streams.features }
+
+    checkpoint = None
+    for i in range(4):
+        if i == 2:
+            checkpoint = reader.get_checkpoint_state()
+        mb = reader.next_minibatch(3, input_map=input_map)
+        assert np.allclose(mb[x].value, expected[i])
+
+    # continue with the third minibatch
+    reader.restore_from_checkpoint(checkpoint)
+    mb = reader.next_minibatch(3, input_map=input_map)
+    assert np.allclose(mb[x].value, expected[2])
+
+    # changing the minibatch size discards the data that was read ahead
+    mb = reader.next_minibatch(5, input_map=input_map)
+    assert np.allclose(mb[x].value, np.arange(9, 14).reshape(5, 1, 1))
+
+    mb = reader.next_minibatch(6, input_map=input_map)
+    assert np.allclose(mb[x].value, np.arange(14, 20).reshape(6, 1, 1))
+    assert reader.next_minibatch(6, input_map=input_map) == {}
+
+    reader.close()
+
+
+def test_numpy_minibatch_source(tmpdir):
+    from cntk.io import NumpyMinibatchSource, FULL_DATA_SWEEP
+    from cntk.ops import input_variable
+
+    features = np.arange(20, dtype=np.float32).reshape(10, 2)
+    labels = np.arange(10)
+    label_file = str(tmpdir/'labels.npy')
+    np.save(label_file, labels)
+
+    source = NumpyMinibatchSource(dict(features=features, labels=label_file),
+            randomization_window=4, epoch_size=FULL_DATA_SWEEP)
+    x = input_variable(2)
+    y = input_variable(1)
+    input_map = { x : source.streams.features, y : source.streams.labels }
+
+    mb = source.next_minibatch(4, input_map=input_map)
+    checkpoint = source.get_checkpoint_state()
+    first = mb[x].value
+    assert first.shape == (4, 1, 2)
+    assert mb[x].num_samples == mb[y].num_samples == 4
+    # features and labels are shuffled together
+    assert np.allclose(first[:, 0, 0] / 2, mb[y].value[:, 0, 0])
+
+    second = source.next_minibatch(4, input_map=input_map)[x].value
+    third = source.next_minibatch(4, input_map=input_map)[x].value
+    assert len(third) == 2
+    assert source.next_minibatch(4, input_map=input_map) == {}
+
+    # one sweep covers every sample exactly once
+    seen = np.concatenate([first, second, third])[:, 0, :]
+    assert np.allclose(sorted(seen[:, 0]), features[:, 0])
+
+    source.restore_from_checkpoint(checkpoint)
+    assert np.allclose(source.next_minibatch(4, input_map=input_map)[x].value, second)
+
+    unrandomized = NumpyMinibatchSource(dict(features=features), randomize=False)
+    mb = unrandomized.next_minibatch(12)
+    assert np.allclose(mb[unrandomized.streams.features].value[:, 0, :],
+            np.concatenate([features, features[:2]]))
+
+    with pytest.raises(ValueError):
+        NumpyMinibatchSource(dict(features=features, labels=labels[:5]))
+
 
 @pytest.mark.parametrize("idx, alias_tensor_map, expected", [
     (0, {'A': [object()]}, ValueError),
@@ -250,3 +394,74 @@ def test_sequence_conversion_dense(idx, alias_tensor_map, expected):
 ])
 def test_is_tensor(data, expected):
     assert _is_tensor(data) == expected
+
+
+def test_ctf_writer_matches_sequence_conversion(tmpdir):
+    sequences = [
+        { 'W': AA([[1, 0], [1, 0]]), 'L': AA([[2]]) },
+        { 'W': AA([[5, 6], [7, 8], [9, 10]]), 'L': AA([[3]]) },
+        { 'W': AA([[0.5, 0.25]], dtype=np.float32), 'L': AA([[4]]) },
+        ]
+    expected = '\n'.join(sequence_to_cntk_text_format(i, s)
+                         for i, s in enumerate(sequences)) + '\n'
+
+    tmpfile = str(tmpdir/'writer.txt')
+    with CTFWriter(tmpfile) as writer:
+        writer.write({ 'W': np.concatenate([s['W'] for s in sequences[:2]]),
+                       'L': np.concatenate([s['L'] for s in sequences[:2]]) },
+                     sequence_lengths={ 'W': [2, 3], 'L': [1, 1] })
+        assert writer.next_sequence_id == 2
+        writer.write(sequences[2], sequence_lengths=[1])
+
+    with open(tmpfile) as f:
+        assert f.read() == expected
+
+def test_ctf_writer_sparse():
+    import io
+    from scipy import sparse
+
+    data = sparse.csr_matrix(AA([[0, 1, 0, 3], [0, 0, 0, 0], [2, 0, 0, 0]],
+        dtype=np.float32))
+    labels = AA([[1], [0], [1]])
+
+    out = io.StringIO()
+    writer = CTFWriter(out, first_sequence_id=5)
+    assert writer.write({ 'x': data, 'y': labels }) == 3
+    writer.close()
+
+    assert out.getvalue() == \
+            '5\t|x 1:1.0 3:3.0 |y 1\n' \
+            '6\t|x  |y 0\n' \
+            '7\t|x 0:2.0 |y 1\n'
+
+    with pytest.raises(ValueError):
+        CTFWriter(io.StringIO()).write({ 'x': data }, sequence_lengths=[1, 1])
+
+def test_ctf_index(tmpdir):
+    from cntk.io import CTFIndex
+
+    mbdata = '0\t|x 1 2\n0\t|x 3 4\n5\t|x 5 6\n|x 7 8\n12\t|x 9 0\n12\t|x 1 1\n12\t|x 2 2\n'
+    tmpfile = str(tmpdir/'index.ctf')
+    with open(tmpfile, 'w') as f:
+        f.write(mbdata)
+
+    # small blocks to test sequences that span several blocks
+    index = CTFIndex(tmpfile, block_size=10)
+    assert os.path.exists(tmpfile + '.idx')
+    assert len(index) == 4
+    assert list(index.sequence_ids) == [0, 5, 6, 12]
+    assert list(index.sample_counts) == [2, 1, 1, 3]
+    assert index.lengths.sum() == len(mbdata)
+
+    assert index.read(0) == '0\t|x 1 2\n0\t|x 3 4\n'
+    assert index.read(6) == '|x 7 8\n'
+    assert index.read_at(3) == '12\t|x 9 0\n12\t|x 1 1\n12\t|x 2 2\n'
+    assert 5 in index
+    assert 1 not in index
+    with pytest.raises(KeyError):
+        index.read(1)
+    index.close()
+
+    with CTFIndex(tmpfile) as cached:
+        assert np.array_equal(cached.offsets, index.offsets)
+        assert cached.read(5) == '5\t|x 5 6\n'
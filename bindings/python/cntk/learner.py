@@ -602,3 +602,103 @@ def rmsprop(parameters, lr,
     return cntk_py.rmsprop_learner(parameters, lr, gamma, inc, dec, max, min,
             need_ave_multiplier, additional_options)
 
+
+class DynamicLossScaler(object):
+    '''
+    Dynamic loss scaling for a :class:`~cntk.trainer.Trainer`.
+
+    The trainer scales the loss by ``scale`` before the backward pass, and
+    divides the gradients by it on the device before the learners update
+    the parameters. If a gradient overflows (becomes infinite or NaN), the
+    update is skipped and the scale is reduced by ``backoff_factor``. After
+    ``growth_interval`` updates in a row without overflow, the scale is
+    increased by ``growth_factor``, so that it stays close to the largest
+    scale that does not overflow.
+
+    Loss scaling keeps small gradients from underflowing in reduced
+    precision. CNTK only computes in float32 and float64 so far, where
+    gradients rarely underflow: there is no float16 training mode yet that
+    the scaler could make use of. In float32, the scaler mainly guards
+    against overflowing gradients, by skipping the updates they would spoil,
+    at the cost of reading one value per minibatch from the device.
+
+    The state of the scaler is saved in the checkpoints of the trainer and
+    restored with them, see :meth:`~cntk.trainer.Trainer.save_checkpoint`.
+
+    Example:
+        >>> scaler = DynamicLossScaler(init_scale=2**15)
+        >>> trainer = Trainer(z, ce, errs, [sgd(z.parameters, lr)],
+        ...     loss_scaler=scaler) # doctest: +SKIP
+
+    Args:
+        init_scale (float, default 2**15): the initial scale
+        growth_factor (float, default 2): factor by which the scale grows
+         after ``growth_interval`` updates without overflow
+        backoff_factor (float, default 0.5): factor by which the scale is
+         reduced after an overflow
+        growth_interval (int, default 2000): number of updates without
+         overflow after which the scale grows
+        min_scale (float, default 1): the scale is not reduced below this
+         value
+    '''
+    def __init__(self, init_scale=2.**15, growth_factor=2., backoff_factor=.5,
+            growth_interval=2000, min_scale=1.):
+        if init_scale <= 0 or min_scale <= 0:
+            raise ValueError('the loss scale has to be positive')
+        if growth_factor < 1:
+            raise ValueError('growth_factor must not be less than 1')
+        if not 0 < backoff_factor < 1:
+            raise ValueError('backoff_factor has to be between 0 and 1')
+        if growth_interval < 1:
+            raise ValueError('growth_interval has to be positive')
+
+        self.scale = float(max(init_scale, min_scale))
+        self.growth_factor = growth_factor
+        self.backoff_factor = backoff_factor
+        self.growth_interval = growth_interval
+        self.min_scale = float(min_scale)
+        self.num_skipped_updates = 0
+        self._updates_without_overflow = 0
+
+    def update(self, finite):
+        '''
+        Adapts the scale after an update.
+
+        Args:
+            finite (bool): whether the gradients of the update were finite,
+             that is whether the update was performed
+
+        Returns:
+            `float`: the scale for the next update
+        '''
+        if finite:
+            self._updates_without_overflow += 1
+            if self._updates_without_overflow >= self.growth_interval:
+                self.scale *= self.growth_factor
+                self._updates_without_overflow = 0
+        else:
+            self.scale = max(self.scale * self.backoff_factor, self.min_scale)
+            self._updates_without_overflow = 0
+            self.num_skipped_updates += 1
+
+        return self.scale
+
+    def get_checkpoint_state(self):
+        '''
+        Returns the state of the scaler as a `dict`, which
+        :class:`~cntk.trainer.Trainer` saves in its checkpoints.
+        '''
+        return { 'scale' : self.scale,
+                'updates_without_overflow' : self._updates_without_overflow,
+                'num_skipped_updates' : self.num_skipped_updates }
+
+    def restore_from_checkpoint(self, state):
+        '''
+        Restores the state returned by :meth:`get_checkpoint_state`.
+
+        Args:
+            state (dict): the state of the scaler
+        '''
+        self.scale = float(state['scale'])
+        self._updates_without_overflow = int(state['updates_without_overflow'])
+        self.num_skipped_updates = int(state['num_skipped_updates'])
@@ -1,8 +1,13 @@
 from cntk import cntk_py
 from cntk.device import DeviceDescriptor
-from cntk.utils import typemap, sanitize_var_map, value_to_seq
+from cntk.utils import typemap, sanitize_var_map, value_to_seq, _clear_binding_plan
+from cntk.utils import _binding_plan
 from enum import Enum, unique
+import hashlib
+import os
+import tempfile
 import numpy as np
+from scipy import sparse
 
 
 @unique
@@ -204,8 +209,142 @@ class Function(cntk_py.Function):
         else:
             return list(output_map.values())[0]
 
+    def eval_batched(self, arguments, max_samples=1024, outputs=None,
+            device=None, input_map=None):
+        '''
+        Evaluates the node on data that may be too large to be evaluated at
+        once, in minibatches of at most ``max_samples`` samples.
+
+        If ``arguments`` is data, it is split along the batch axis, and the
+        results of the minibatches are written into arrays that are
+        allocated once for the whole data. If ``arguments`` is a minibatch
+        source, the minibatches are read from it and a generator is returned
+        that yields the results of every minibatch, so that arbitrarily many
+        samples can be scored with bounded memory.
+
+        Example:
+            >>> x = C.input_variable(2)
+            >>> f = C.plus(x, 1)
+            >>> result = f.eval_batched({x: np.zeros((10, 2), np.float32)},
+            ...                         max_samples=4)
+            >>> result.shape
+            (10, 1, 2)
+
+        Args:
+            arguments: the input data as described in :meth:`eval`, as NumPy
+             arrays, SciPy CSR matrices or lists of sequences, or a minibatch
+             source such as :class:`~cntk.io.MinibatchSource`
+            max_samples (int, default 1024): maximum number of samples per
+             minibatch. A sequence that is longer is evaluated on its own.
+            outputs (list, default None): outputs to compute, all outputs of
+             the function if None
+            device (:class:`~cntk.device.DeviceDescriptor`): the device
+             descriptor that contains the type and id of the device on which
+             the computation is to be performed.
+            input_map (dict, default None): if ``arguments`` is a minibatch
+             source, maps the arguments of this function to the stream
+             information of the source
+
+        Returns:
+            dict or NumPy array like :meth:`eval`: the results for all of
+            ``arguments``, or a generator of the results of every minibatch if
+            ``arguments`` is a minibatch source. Results of sequences of
+            different length are lists of NumPy arrays.
+        '''
+        if max_samples < 1:
+            raise ValueError('max_samples has to be positive')
+
+        if outputs is None:
+            outputs = self.outputs
+
+        if hasattr(arguments, 'next_minibatch'):
+            if not input_map:
+                raise ValueError('evaluating a minibatch source requires an '
+                        'input_map')
+            return self._eval_source(arguments, max_samples, outputs, device,
+                    input_map)
+
+        plan = _binding_plan(self)
+        if isinstance(arguments, tuple):
+            arguments, seq_starts = arguments
+        else:
+            seq_starts = None
+        if not isinstance(arguments, dict):
+            if len(plan) != 1:
+                raise ValueError('non-dict argument (%s) is not supported for '
+                        'nodes with more than one input' % type(arguments).__name__)
+            arguments = { plan.arguments[0] : arguments }
+
+        batches = {}
+        for var, batch in arguments.items():
+            if isinstance(var, str):
+                var = plan.resolve(var)
+            if isinstance(batch, tuple):
+                batch, var_seq_starts = batch
+            else:
+                var_seq_starts = seq_starts
+            if isinstance(batch, (cntk_py.Value, cntk_py.MinibatchData)):
+                raise ValueError('Value and MinibatchData objects cannot be '
+                        'split, pass the data instead')
+            batches[var] = (batch, var_seq_starts)
+
+        # the number of samples of every sequence, the maximum over all inputs
+        num_sequences = None
+        samples_per_sequence = None
+        for var, (batch, _) in batches.items():
+            counts = _samples_per_sequence(var, batch)
+            if num_sequences is None:
+                num_sequences = len(counts)
+                samples_per_sequence = counts
+            elif len(counts) != num_sequences:
+                raise ValueError('all inputs need to have the same number of '
+                        'sequences')
+            else:
+                samples_per_sequence = np.maximum(samples_per_sequence, counts)
+
+        results = dict((output, _BatchedResult(num_sequences))
+                for output in outputs)
+        ends = np.cumsum(samples_per_sequence)
+        start = 0
+        while start < num_sequences:
+            offset = ends[start - 1] if start > 0 else 0
+            end = max(start + 1, int(np.searchsorted(ends, offset + max_samples,
+                side='right')))
+            chunk = {}
+            for var, (batch, var_seq_starts) in batches.items():
+                if var_seq_starts is None:
+                    chunk[var] = batch[start:end]
+                else:
+                    chunk[var] = (batch[start:end], var_seq_starts[start:end])
+
+            _, output_map = self.forward(chunk, outputs, device=device)
+            for output, value in output_map.items():
+                results[output].add(value, start, end)
+            start = end
+
+        output_map = dict((output, result.value())
+                for output, result in results.items())
+        if len(output_map) > 1:
+            return output_map
+        else:
+            return list(output_map.values())[0]
+
+    def _eval_source(self, source, max_samples, outputs, device, input_map):
+        while True:
+            mb = source.next_minibatch(max_samples, input_map=input_map,
+                    device=device)
+            if not mb:
+                return
+
+            _, output_map = self.forward(mb, outputs, device=device)
+            if len(output_map) > 1:
+                yield output_map
+            else:
+                yield list(output_map.values())[0]
+
     @typemap
-    def forward(self, arguments, outputs, keep_for_backward=None, device=None):
+    def forward(self, arguments, outputs, keep_for_backward=None, device=None,
+            buffer_pool=None):
         '''
         Computes the values of speficied variables in ``outputs``, using values
         provided in ``arguments`` that correspond to each input `Variable` of
@@ -261,6 +400,9 @@ class Function(cntk_py.Function):
             device (:class:`~cntk.device.DeviceDescriptor`, default `None`): the device
              descriptor that contains the type and id of the device on which the
              computation is. If `None`, the default device is used.
+            buffer_pool (:class:`~cntk.utils.ValueBufferPool`, default `None`):
+             pool whose memory is reused for the input data. The returned
+             state is then only valid until the next call with the same pool.
 
         Returns:
              A tuple (BackpropState, map of outputs to NumPy arrays). The
@@ -269,8 +411,8 @@ class Function(cntk_py.Function):
         if device is None:
             device = DeviceDescriptor.use_default_device()
 
-        in_var_map = sanitize_var_map(self.arguments, arguments,
-                                      None, device)
+        in_var_map = sanitize_var_map(self, arguments,
+                                      None, device, buffer_pool)
         output_map = {v: None for v in outputs}
         keep_for_backward = set(keep_for_backward or {})
 
@@ -499,6 +641,8 @@ class Function(cntk_py.Function):
         Returns:
             :class:`Function`: itself
         '''
+        # the arguments of the graph may change
+        _clear_binding_plan(self)
         return super(Function, self).replace_placeholders(substitutions)
 
     @typemap
@@ -516,6 +660,8 @@ class Function(cntk_py.Function):
 
         :raises ExceptionType: when the function has multiple placeholders.
         '''
+        # the arguments of the graph may change
+        _clear_binding_plan(self)
         return super(Function, self).replace_placeholder(substitution)
 
     @typemap
@@ -607,20 +753,166 @@ class Function(cntk_py.Function):
         '''
         return super(Function, self).restore_model(filename)
 
+def _samples_per_sequence(var, batch):
+    '''
+    Returns the number of samples of every sequence in the batch passed for
+    ``var`` to :meth:`Function.eval_batched`.
+    '''
+    rank = len(var.shape)
+    if isinstance(batch, np.ndarray):
+        if batch.ndim > rank + 1:
+            # every row is a sequence of the same length
+            return np.full(batch.shape[0], batch.shape[1], dtype=np.int64)
+        return np.ones(batch.shape[0], dtype=np.int64)
+    elif sparse.issparse(batch):
+        # every row is a sequence of one sample
+        return np.ones(batch.shape[0], dtype=np.int64)
+    elif isinstance(batch, list):
+        return np.asarray([seq.shape[0] if sparse.issparse(seq) else
+            (np.shape(seq)[0] if np.ndim(seq) > rank else 1)
+            for seq in batch], dtype=np.int64)
+    else:
+        raise ValueError('data of type "%s" cannot be split into minibatches'
+                % type(batch).__name__)
+
+
+class _BatchedResult(object):
+    '''
+    Collects the results of the minibatches of :meth:`Function.eval_batched`.
+    While all minibatches have results of the same shape, they are written
+    into one preallocated array, otherwise into a list of sequences.
+    '''
+    def __init__(self, num_sequences):
+        self.num_sequences = num_sequences
+        self.array = None
+        self.sequences = None
+
+    def add(self, value, start, end):
+        if self.sequences is None and isinstance(value, np.ndarray):
+            if self.array is None:
+                self.array = np.empty((self.num_sequences,) + value.shape[1:],
+                        dtype=value.dtype)
+            if self.array.shape[1:] == value.shape[1:]:
+                self.array[start:end] = value
+                return
+
+        if self.sequences is None:
+            # switch to a list, keeping what has been computed so far
+            self.sequences = list(self.array[:start]) if self.array is not None else []
+            self.array = None
+        self.sequences.extend(value)
+
+    def value(self):
+        return self.array if self.sequences is None else self.sequences
+
+
 @typemap
-def load_model(filename, device=None):
+def load_model(filename, device=None, cache_dir=None):
     '''
     Load the model in ``filename``, that has been saved using
     `:func:save_model`.
 
+    Loading a model in the legacy format converts the whole network, which
+    can take much longer than loading it in the current format. With
+    ``cache_dir``, a legacy model is stored in the current format in that
+    directory, and later calls (also of other processes) load this copy
+    instead. Models in the current format are always loaded directly: the
+    cache only saves the conversion, loading the copy still infers the
+    shapes of the network and copies the parameters, so models in the
+    current format would not load any faster.
+
+    The copies are keyed by the SHA-256 hash of the content of
+    ``filename`` and by the CNTK version, so that changed model files and
+    CNTK upgrades create new copies. Every call with ``cache_dir`` thus
+    reads the model file once to hash it.
+
     Args:
         filename (str): filename to load the model from
         device (:class:`~cntk.DeviceDescriptor`, default is the default device):
          instance of DeviceDescriptor
+        cache_dir (str, default None): directory of the model cache. If
+         None, the environment variable ``CNTK_MODEL_CACHE_DIR`` is used; if
+         that is not set either, no cache is used.
 
     Returns:
         root node
     '''
     if not device:
         device = DeviceDescriptor.use_default_device()
-    return cntk_py.Function.load_model(filename, device)
+
+    if cache_dir is None:
+        cache_dir = os.environ.get('CNTK_MODEL_CACHE_DIR')
+    if not cache_dir or not _is_legacy_model(filename):
+        return cntk_py.Function.load_model(filename, device)
+
+    cache_file = _model_cache_file(filename, cache_dir)
+    if os.path.exists(cache_file):
+        try:
+            return cntk_py.Function.load_model(cache_file, device)
+        except Exception:
+            # a damaged copy is replaced below
+            pass
+
+    model = cntk_py.Function.load_model(filename, device)
+    _write_model_cache(model, cache_file)
+    return model
+
+# legacy models start with L"BCN", see CNTK::Internal::IsLegacyModel
+_LEGACY_MODEL_MARKER = b'B\x00C\x00N\x00\x00\x00'
+
+def _is_legacy_model(filename):
+    '''
+    Returns whether ``filename`` is a model in the legacy format. Files
+    that cannot be read are left to :func:`load_model` to report.
+    '''
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(_LEGACY_MODEL_MARKER)) == _LEGACY_MODEL_MARKER
+    except (IOError, OSError):
+        return False
+
+def _model_cache_file(filename, cache_dir):
+    '''
+    Returns the name of the copy of ``filename`` in the model cache, which
+    is derived from the SHA-256 hash of the content of the file and the
+    CNTK version.
+    '''
+    from cntk import __version__
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    digest.update(('\ncntk-%s' % __version__).encode('utf-8'))
+    return os.path.join(cache_dir, digest.hexdigest() + '.model')
+
+def _write_model_cache(model, cache_file):
+    '''
+    Saves ``model`` as ``cache_file``. The model is written to a temporary
+    file that is renamed afterwards, so that other processes never load an
+    incomplete copy. Failing to write the cache is not an error.
+    '''
+    cache_dir = os.path.dirname(cache_file)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, temp_file = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        os.close(fd)
+    except OSError:
+        return
+
+    try:
+        model.save_model(temp_file)
+        _replace_file(temp_file, cache_file)
+    except Exception:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def _replace_file(source, destination):
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        # Python 2 has no os.replace, rename fails on Windows if the
+        # destination exists
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
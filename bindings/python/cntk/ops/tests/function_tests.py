@@ -126,3 +126,43 @@ def test_getting_output_from_non_existent_node():
 
     with pytest.raises(ValueError):
         sum_output = times_node.forward({x: x0, y: y0}, sum_node.outputs)
+
+def test_eval_batched():
+    x = input_variable(shape=(2,))
+    y = input_variable(shape=(2,))
+    f = plus(x, y)
+
+    data_x = np.arange(20, dtype=np.float32).reshape(10, 1, 2)
+    data_y = np.ones((10, 1, 2), dtype=np.float32)
+    result = f.eval_batched({x: data_x, y: data_y}, max_samples=3)
+    assert isinstance(result, np.ndarray)
+    assert np.allclose(result, f.eval({x: data_x, y: data_y}))
+
+    with pytest.raises(ValueError):
+        f.eval_batched({x: data_x, y: data_y}, max_samples=0)
+
+    # sequences of different length are kept together in one minibatch
+    g = plus(x, 1)
+    sequences = [np.ones((length, 2), dtype=np.float32) * length
+            for length in [1, 4, 2, 3, 1]]
+    result = g.eval_batched({x: sequences}, max_samples=3)
+    assert len(result) == len(sequences)
+    for seq, res in zip(sequences, result):
+        assert np.allclose(res, seq + 1)
+
+def test_eval_batched_minibatch_source():
+    from ...io import NumpyMinibatchSource, FULL_DATA_SWEEP
+    x = input_variable(shape=(2,))
+    f = plus(x, 1)
+
+    features = np.arange(14, dtype=np.float32).reshape(7, 2)
+    source = NumpyMinibatchSource(dict(features=features), randomize=False,
+            epoch_size=FULL_DATA_SWEEP)
+    results = f.eval_batched(source, max_samples=3,
+            input_map={x: source.streams.features})
+    results = list(results)
+    assert [len(r) for r in results] == [3, 3, 1]
+    assert np.allclose(np.concatenate(results).reshape(7, 2), features + 1)
+
+    with pytest.raises(ValueError):
+        f.eval_batched(source)
@@ -0,0 +1,74 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Compares the time of :func:`~cntk.ops.functions.load_model` without the
+model cache, for the first load that fills the cache (cold) and for loads
+from the cache (warm). Without a model file, a network with about as many
+parameters as ResNet-50 (25 million) is created and saved in the legacy
+format. Run it with::
+
+    python -m cntk.ops.tests.load_model_benchmark [model file]
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import numpy as np
+
+def _resnet_sized_model(filename, num_layers=6, dim=2048):
+    from cntk.ops import input_variable, parameter, times, relu
+    from cntk.debug import save_as_legacy_model
+
+    x = input_variable(dim)
+    h = x
+    for _ in range(num_layers):
+        w = parameter(init=np.random.rand(dim, dim).astype(np.float32) * 1e-3)
+        h = relu(times(h, w))
+    save_as_legacy_model(h, filename)
+
+def benchmark_load_model(filename, repeat=3):
+    '''
+    Returns the seconds of a load without cache, of a cold load and of a
+    warm load of ``filename``, the minimum over ``repeat`` runs.
+    '''
+    from cntk.ops.functions import load_model
+
+    uncached = cold = warm = float('inf')
+    for _ in range(repeat):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            uncached = min(uncached, timeit.timeit(
+                lambda: load_model(filename, cache_dir=''), number=1))
+            cold = min(cold, timeit.timeit(
+                lambda: load_model(filename, cache_dir=cache_dir), number=1))
+            warm = min(warm, timeit.timeit(
+                lambda: load_model(filename, cache_dir=cache_dir), number=1))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    return uncached, cold, warm
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+        temp_dir = None
+    else:
+        temp_dir = tempfile.mkdtemp()
+        filename = os.path.join(temp_dir, 'model.legacy')
+        _resnet_sized_model(filename)
+
+    try:
+        uncached, cold, warm = benchmark_load_model(filename)
+        print('%-10s %10s' % ('load', 'time [s]'))
+        print('%-10s %10.3f' % ('uncached', uncached))
+        print('%-10s %10.3f' % ('cold', cold))
+        print('%-10s %10.3f' % ('warm', warm))
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,582 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Serving models in-process. A :class:`BatchingEvaluator` collects the
+requests of many threads or asyncio tasks and evaluates them together in
+one minibatch, so that a model that is called with one sample per request
+still runs with full minibatches. An :class:`EvaluatorPool` evaluates one
+model from many threads at the same time.
+'''
+
+import json
+import multiprocessing
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from .utils import Record, _binding_plan
+from .ops.functions import CloneMethod
+
+
+class _Request(object):
+    def __init__(self, arguments, num_sequences):
+        self.arguments = arguments
+        self.num_sequences = num_sequences
+        self.future = Future()
+        self.time = time.time()
+
+
+class BatchingEvaluator(object):
+    '''
+    Evaluates a model for requests of many threads or asyncio tasks in
+    shared minibatches.
+
+    Requests are queued. A background thread takes the oldest request and
+    adds further requests until the minibatch has ``max_batch_size``
+    sequences or the oldest request has waited ``max_latency`` seconds. It
+    then calls :meth:`~cntk.ops.functions.Function.forward` once for the
+    whole minibatch and hands every caller the rows of its request.
+
+    Example:
+        >>> model = C.load_model('model.dnn') # doctest: +SKIP
+        >>> with BatchingEvaluator(model, max_batch_size=64) as evaluator: # doctest: +SKIP
+        ...     result = evaluator.evaluate({'features': sample[np.newaxis]})
+
+    Args:
+        model (:class:`~cntk.ops.functions.Function`): the model to evaluate.
+         It must not be evaluated concurrently by other threads.
+        max_batch_size (int, default 32): maximum number of sequences per
+         minibatch. A request with more sequences is evaluated on its own.
+        max_latency (float, default 0.005): maximum time in seconds that a
+         request waits for other requests to join its minibatch
+        outputs (list, default None): outputs to compute, all outputs of the
+         model if None
+        device (:class:`~cntk.device.DeviceDescriptor`, default None): the
+         device to evaluate on, the default device if None
+    '''
+    def __init__(self, model, max_batch_size=32, max_latency=0.005,
+            outputs=None, device=None):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size has to be positive')
+        if max_latency < 0:
+            raise ValueError('max_latency must not be negative')
+
+        self._model = model
+        self._plan = _binding_plan(model)
+        self._outputs = list(outputs) if outputs is not None else model.outputs
+        self._max_batch_size = max_batch_size
+        self._max_latency = max_latency
+        self._device = device
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._num_requests = 0
+        self._num_batches = 0
+        self._num_sequences = 0
+        self._num_evaluated = 0
+        self._max_queue_depth = 0
+        self._wait_time = 0.0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def model(self):
+        '''
+        The model that is evaluated.
+        '''
+        return self._model
+
+    @property
+    def outputs(self):
+        '''
+        The outputs that are computed for every request.
+        '''
+        return self._outputs
+
+    def _sanitize_request(self, arguments):
+        if not isinstance(arguments, dict):
+            if len(self._plan) != 1:
+                raise ValueError('non-dict argument (%s) is not supported for '
+                        'models with more than one input' % type(arguments).__name__)
+            arguments = { self._plan.arguments[0] : arguments }
+
+        request = {}
+        num_sequences = None
+        for var, batch in arguments.items():
+            if isinstance(var, str):
+                var = self._plan.resolve(var)
+            if not isinstance(batch, (np.ndarray, list)):
+                raise ValueError('the data of a request has to be a NumPy '
+                        'array or a list of sequences, got %s' % type(batch).__name__)
+            if isinstance(batch, np.ndarray) and batch.ndim == len(var.shape) + 1:
+                # every sample is a sequence of length 1
+                batch = batch[:, np.newaxis]
+            if num_sequences is None:
+                num_sequences = len(batch)
+            elif len(batch) != num_sequences:
+                raise ValueError('all inputs of a request need to have the '
+                        'same number of sequences')
+            request[var] = batch
+
+        if not num_sequences:
+            raise ValueError('a request needs at least one sequence')
+
+        return _Request(request, num_sequences)
+
+    def submit(self, arguments):
+        '''
+        Queues a request for evaluation.
+
+        Args:
+            arguments: the input data of the request, either a dict mapping
+             the input variables or their names to the data, or the data
+             alone if the model has one input. The data is a NumPy array of
+             shape (number of samples, input shape) or (number of sequences,
+             sequence length, input shape), or a list of sequences.
+
+        Returns:
+            :class:`concurrent.futures.Future` of the result, which is a
+            dict mapping the outputs to their values if more than one output
+            is computed, otherwise the value of the single output
+        '''
+        request = self._sanitize_request(arguments)
+        with self._lock:
+            if self._closed:
+                raise ValueError('the evaluator has been closed')
+            self._queue.put(request)
+            self._num_requests += 1
+            self._max_queue_depth = max(self._max_queue_depth,
+                    self._queue.qsize())
+        return request.future
+
+    def evaluate(self, arguments, timeout=None):
+        '''
+        Evaluates a request and waits for its result, see :meth:`submit`.
+
+        Args:
+            arguments: the input data of the request
+            timeout (float, default None): seconds to wait for the result
+
+        Returns:
+            dict or NumPy array: the result of the request
+        '''
+        return self.submit(arguments).result(timeout)
+
+    def evaluate_async(self, arguments):
+        '''
+        Evaluates a request from an asyncio task, see :meth:`submit`.
+
+        Example:
+            >>> result = await evaluator.evaluate_async(sample) # doctest: +SKIP
+
+        Args:
+            arguments: the input data of the request
+
+        Returns:
+            :class:`asyncio.Future` of the result of the request
+        '''
+        import asyncio
+        return asyncio.wrap_future(self.submit(arguments))
+
+    def _next_batch(self, pending):
+        '''
+        Collects the requests of the next minibatch, starting with
+        ``pending`` or the oldest queued request. Returns the requests, the
+        request that did not fit anymore and whether the evaluator has been
+        closed.
+        '''
+        first = pending if pending is not None else self._queue.get()
+        if first is None:
+            return [], None, True
+
+        batch = [first]
+        num_sequences = first.num_sequences
+        deadline = first.time + self._max_latency
+        while num_sequences < self._max_batch_size:
+            try:
+                timeout = deadline - time.time()
+                if timeout > 0:
+                    request = self._queue.get(timeout=timeout)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if request is None:
+                return batch, None, True
+            if num_sequences + request.num_sequences > self._max_batch_size or \
+                    set(request.arguments) != set(first.arguments):
+                return batch, request, False
+
+            batch.append(request)
+            num_sequences += request.num_sequences
+
+        return batch, None, False
+
+    def _run(self):
+        pending = None
+        closed = False
+        while not closed:
+            batch, pending, closed = self._next_batch(pending)
+            if batch:
+                self._evaluate(batch)
+        if pending is not None:
+            self._evaluate([pending])
+
+    def _evaluate(self, batch):
+        batch = [request for request in batch
+                if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        start_time = time.time()
+        num_sequences = sum(request.num_sequences for request in batch)
+        with self._lock:
+            self._num_batches += 1
+            self._num_sequences += num_sequences
+            self._num_evaluated += len(batch)
+            self._wait_time += sum(start_time - request.time for request in batch)
+
+        try:
+            arguments = {}
+            for var in batch[0].arguments:
+                arguments[var] = _concatenate([request.arguments[var]
+                    for request in batch])
+            _, output_map = self._model.forward(arguments, self._outputs,
+                    device=self._device)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        start = 0
+        for request in batch:
+            end = start + request.num_sequences
+            result = dict((output, value[start:end])
+                    for output, value in output_map.items())
+            if len(result) == 1:
+                result = list(result.values())[0]
+            request.future.set_result(result)
+            start = end
+
+    def metrics(self):
+        '''
+        Returns statistics about the requests and minibatches so far.
+
+        Returns:
+            :class:`~cntk.utils.Record` with the members
+
+             * ``num_requests``: number of submitted requests
+             * ``num_batches``: number of evaluated minibatches
+             * ``queue_depth``: number of requests that are currently queued
+             * ``max_queue_depth``: maximum number of queued requests
+             * ``mean_batch_size``: mean number of sequences per minibatch
+             * ``mean_batch_fill``: mean fraction of ``max_batch_size`` that
+               the minibatches used
+             * ``mean_wait_time``: mean time in seconds that a request waited
+               before its minibatch was evaluated
+        '''
+        with self._lock:
+            num_batches = self._num_batches
+            mean_batch_size = self._num_sequences / float(num_batches) \
+                    if num_batches else 0.0
+            return Record(num_requests=self._num_requests,
+                    num_batches=num_batches,
+                    queue_depth=self._queue.qsize(),
+                    max_queue_depth=self._max_queue_depth,
+                    mean_batch_size=mean_batch_size,
+                    mean_batch_fill=mean_batch_size / self._max_batch_size,
+                    mean_wait_time=self._wait_time / self._num_evaluated
+                        if self._num_evaluated else 0.0)
+
+    def close(self):
+        '''
+        Evaluates the requests that are still queued and stops the
+        background thread. Afterwards, no requests can be submitted.
+        '''
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _Replica(object):
+    def __init__(self, function, arguments, outputs):
+        self.function = function
+        self.arguments = arguments
+        self.outputs = outputs
+
+
+class EvaluatorPool(object):
+    '''
+    Evaluates one model from many threads at the same time.
+
+    A :class:`~cntk.ops.functions.Function` must not be evaluated by several
+    threads at once, because the intermediate values of the computation are
+    stored in the function. The pool therefore hands every concurrent call
+    its own replica of the model, created with
+    ``clone(CloneMethod.share)``. The replicas share the parameters of the
+    model, so that the memory for the parameters is needed only once; every
+    replica only adds the memory of its intermediate values. Replicas are
+    created on demand, up to ``size``, and reused afterwards.
+
+    Example:
+        >>> x = C.input_variable(2)
+        >>> pool = EvaluatorPool(C.plus(x, 1), size=2)
+        >>> pool.eval({x: np.asarray([[1, 2]], dtype=np.float32)}).shape
+        (1, 1, 2)
+
+    Args:
+        model (:class:`~cntk.ops.functions.Function`): the model to
+         evaluate. It is used as the first replica, so it must not be
+         evaluated outside of the pool while the pool is in use.
+        size (int, default None): maximum number of replicas and thus of
+         concurrent evaluations, the number of CPUs if None
+        device (:class:`~cntk.device.DeviceDescriptor`, default None): the
+         device to evaluate on, the default device if None
+    '''
+    def __init__(self, model, size=None, device=None):
+        if size is None:
+            size = multiprocessing.cpu_count()
+        if size < 1:
+            raise ValueError('size has to be positive')
+
+        self._model = model
+        self._arguments = model.arguments
+        self._outputs = model.outputs
+        self._size = size
+        self._device = device
+
+        self._lock = threading.Lock()
+        # the most recently used replica is reused first
+        self._idle = queue.LifoQueue()
+        self._idle.put(_Replica(model,
+            dict(zip(self._arguments, self._arguments)),
+            dict(zip(self._outputs, self._outputs))))
+        self._num_replicas = 1
+
+    @property
+    def model(self):
+        '''
+        The model that is evaluated.
+        '''
+        return self._model
+
+    @property
+    def num_replicas(self):
+        '''
+        The number of replicas that have been created, including the model.
+        '''
+        return self._num_replicas
+
+    def _create_replica(self):
+        function = self._model.clone(CloneMethod.share)
+        # cloning keeps the order of the arguments and outputs
+        return _Replica(function,
+                dict(zip(self._arguments, function.arguments)),
+                dict(zip(self._outputs, function.outputs)))
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._num_replicas < self._size
+            if create:
+                self._num_replicas += 1
+        if not create:
+            return self._idle.get()
+
+        try:
+            return self._create_replica()
+        except Exception:
+            with self._lock:
+                self._num_replicas -= 1
+            raise
+
+    def _translate_arguments(self, replica, arguments):
+        if isinstance(arguments, tuple):
+            arguments, seq_starts = arguments
+            return (self._translate_arguments(replica, arguments), seq_starts)
+        if not isinstance(arguments, dict):
+            return arguments
+        return dict((var if isinstance(var, str) else replica.arguments[var], data)
+                for var, data in arguments.items())
+
+    def forward(self, arguments, outputs=None):
+        '''
+        Computes the outputs of the model on a free replica, see
+        :meth:`~cntk.ops.functions.Function.forward`. Blocks while all
+        ``size`` replicas are in use.
+
+        Args:
+            arguments: maps the arguments of the model or their names to the
+             input data, see :meth:`~cntk.ops.functions.Function.forward`
+            outputs (list, default None): outputs of the model to compute,
+             all outputs if None
+
+        Returns:
+            dict mapping the outputs of the model to NumPy arrays
+        '''
+        if outputs is None:
+            outputs = self._outputs
+
+        replica = self._acquire()
+        try:
+            _, output_map = replica.function.forward(
+                    self._translate_arguments(replica, arguments),
+                    [replica.outputs[output] for output in outputs],
+                    device=self._device)
+            return dict((output, output_map[replica.outputs[output]])
+                    for output in outputs)
+        finally:
+            self._idle.put(replica)
+
+    def eval(self, arguments):
+        '''
+        Evaluates the model on a free replica, see
+        :meth:`~cntk.ops.functions.Function.eval`.
+
+        Args:
+            arguments: maps the arguments of the model or their names to the
+             input data, or the data alone if the model has one argument
+
+        Returns:
+            dict mapping the outputs to NumPy arrays if the model has more
+            than one output, otherwise the NumPy array of the output
+        '''
+        output_map = self.forward(arguments)
+        if len(output_map) > 1:
+            return output_map
+        else:
+            return list(output_map.values())[0]
+
+
+def _concatenate(batches):
+    '''
+    Concatenates the data of several requests for one input along the batch
+    axis. Arrays of the same shape are concatenated into one array,
+    otherwise a list of sequences is returned.
+    '''
+    if len(batches) == 1:
+        return batches[0]
+
+    if all(isinstance(b, np.ndarray) for b in batches) and \
+            len(set(b.shape[1:] for b in batches)) == 1:
+        return np.concatenate(batches)
+
+    sequences = []
+    for b in batches:
+        sequences.extend(b)
+    return sequences
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return [np.asarray(seq).tolist() for seq in value]
+
+
+class EvaluationRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Handler for :class:`~http.server.HTTPServer` that evaluates JSON
+    requests with the :class:`BatchingEvaluator` of the server, see
+    :func:`http_server`.
+
+    A POST request contains a JSON object that maps the names of the model
+    inputs to nested lists of the shape (number of samples, input shape) or
+    (number of sequences, sequence length, input shape). The response maps
+    the names of the outputs (or their uids if they have no name) to the
+    nested lists of their values.
+    '''
+    def do_POST(self):
+        evaluator = self.server.evaluator
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('the request has to be a JSON object')
+
+            arguments = {}
+            for name, data in request.items():
+                var = evaluator._plan.resolve(name)
+                arguments[var] = np.asarray(data, dtype=var.dtype)
+            result = evaluator.evaluate(arguments)
+        except (ValueError, KeyError) as e:
+            self._respond(400, { 'error' : str(e) })
+            return
+        except Exception as e:
+            self._respond(500, { 'error' : str(e) })
+            return
+
+        if not isinstance(result, dict):
+            result = { evaluator.outputs[0] : result }
+        self._respond(200, dict((output.name or output.uid, _to_json(value))
+            for output, value in result.items()))
+
+    def _respond(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def http_server(evaluator, host='127.0.0.1', port=0):
+    '''
+    Creates an HTTP server that handles every request on its own thread and
+    evaluates it with ``evaluator``, see :class:`EvaluationRequestHandler`.
+    It is meant as a local stand-in for a production front-end.
+
+    Example:
+        >>> server = http_server(BatchingEvaluator(model), port=8000) # doctest: +SKIP
+        >>> server.serve_forever() # doctest: +SKIP
+
+    Args:
+        evaluator (:class:`BatchingEvaluator`): the evaluator for the requests
+        host (str, default '127.0.0.1'): the address to listen on
+        port (int, default 0): the port to listen on, a free port if 0
+
+    Returns:
+        :class:`~http.server.HTTPServer` that has not been started yet. Its
+        ``server_address`` has the actual port.
+    '''
+    server = _ThreadingHTTPServer((host, port), EvaluationRequestHandler)
+    server.evaluator = evaluator
+    return server
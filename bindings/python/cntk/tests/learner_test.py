@@ -110,3 +110,27 @@ def test_training_parameter_schedule():
         training_parameter_schedule(0.01, unit='not_supported')
     with pytest.raises(ValueError):
         training_parameter_schedule(0.01, unit=5)
+
+def test_dynamic_loss_scaler():
+    scaler = DynamicLossScaler(init_scale=8, growth_interval=2, min_scale=2)
+
+    # grows after growth_interval updates without overflow
+    assert scaler.update(True) == 8
+    assert scaler.update(True) == 16
+
+    # backs off after an overflow, but not below min_scale
+    assert scaler.update(False) == 8
+    assert scaler.update(True) == 8
+    assert scaler.update(False) == 4
+    assert scaler.update(False) == 2
+    assert scaler.update(False) == 2
+    assert scaler.num_skipped_updates == 4
+
+    restored = DynamicLossScaler()
+    restored.restore_from_checkpoint(scaler.get_checkpoint_state())
+    assert restored.get_checkpoint_state() == scaler.get_checkpoint_state()
+
+    with pytest.raises(ValueError):
+        DynamicLossScaler(backoff_factor=1)
+    with pytest.raises(ValueError):
+        DynamicLossScaler(init_scale=0)
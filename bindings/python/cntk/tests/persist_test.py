@@ -3,6 +3,7 @@
 # for full license information.
 # ==============================================================================
 
+import os
 import numpy as np
 
 from cntk.ops import *
@@ -105,3 +106,57 @@ def test_load_save_unique_input(tmpdir):
     loaded_node = load_model(filename)
     loaded_result = loaded_node.eval(input1)
     assert np.allclose(loaded_result, expected)
+
+def test_load_model_positional_argument(tmpdir):
+    i1 = input_variable((1,2), name='i1')
+    root_node = abs(i1) * 3
+    input1 = [[[-1,2]]]
+    expected = root_node.eval(input1)
+
+    filename = str(tmpdir / 'abs_times_3.mod')
+    root_node.save_model(filename)
+
+    # the loaded model has the uids of root_node, but its own arguments
+    loaded_node = load_model(filename)
+    assert loaded_node.uid == root_node.uid
+    assert np.allclose(loaded_node.eval(input1), expected)
+    assert np.allclose(root_node.eval(input1), expected)
+
+def test_load_model_cache(tmpdir):
+    i1 = input_variable((1,2), name='i1')
+    root_node = abs(i1) * 3
+    input1 = [[[-1,2]]]
+    expected = root_node.eval({i1: input1})
+
+    filename = str(tmpdir / 'abs_times_3.mod.legacy')
+    save_as_legacy_model(root_node, filename)
+    cache_dir = str(tmpdir / 'cache')
+
+    loaded_node = load_model(filename, cache_dir=cache_dir)
+    assert len(tmpdir.join('cache').listdir()) == 1
+    assert np.allclose(loaded_node.eval({loaded_node.arguments[0]: input1}),
+            expected)
+
+    # the second load reads the copy in the current format
+    cached_node = load_model(filename, cache_dir=cache_dir)
+    assert len(tmpdir.join('cache').listdir()) == 1
+    assert np.allclose(cached_node.eval({cached_node.arguments[0]: input1}),
+            expected)
+
+    # a changed model file gets a new copy, even if it keeps the
+    # modification time (e.g. cp -p)
+    mtime = os.stat(filename).st_mtime
+    save_as_legacy_model(abs(i1) * 4, filename)
+    os.utime(filename, (mtime, mtime))
+    changed_node = load_model(filename, cache_dir=cache_dir)
+    assert len(tmpdir.join('cache').listdir()) == 2
+    assert np.allclose(changed_node.eval({changed_node.arguments[0]: input1}),
+            [[[4, 8]]])
+
+    # models in the current format are not cached
+    filename = str(tmpdir / 'abs_times_3.mod')
+    root_node.save_model(filename)
+    loaded_node = load_model(filename, cache_dir=cache_dir)
+    assert len(tmpdir.join('cache').listdir()) == 2
+    assert np.allclose(loaded_node.eval({loaded_node.arguments[0]: input1}),
+            expected)
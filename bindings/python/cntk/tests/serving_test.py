@@ -0,0 +1,108 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+import json
+import threading
+import numpy as np
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from cntk import input_variable, times, constant, parameter, plus
+from cntk.serving import BatchingEvaluator, EvaluatorPool, http_server
+
+try:
+    from urllib.request import urlopen, Request
+except ImportError:
+    from urllib2 import urlopen, Request
+
+def _model():
+    x = input_variable(shape=(2,), name='x')
+    w = constant(value=np.asarray([[1, 2], [3, 4]], dtype=np.float32))
+    return times(x, w, name='y')
+
+def test_batching_evaluator():
+    model = _model()
+    w = np.asarray([[1, 2], [3, 4]], dtype=np.float32)
+    samples = [np.random.rand(1, 2).astype(np.float32) for _ in range(32)]
+    results = [None] * len(samples)
+
+    with BatchingEvaluator(model, max_batch_size=8, max_latency=0.05) as evaluator:
+        def request(i):
+            results[i] = evaluator.evaluate({'x': samples[i]})
+        threads = [threading.Thread(target=request, args=(i,))
+                for i in range(len(samples))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        metrics = evaluator.metrics()
+
+    for sample, result in zip(samples, results):
+        assert result.shape == (1, 1, 2)
+        assert np.allclose(result[0, 0], sample[0].dot(w))
+
+    assert metrics.num_requests == len(samples)
+    assert metrics.num_batches < len(samples)
+    assert metrics.mean_batch_size * metrics.num_batches == len(samples)
+    assert 0 < metrics.mean_batch_fill <= 1
+    assert metrics.queue_depth == 0
+
+    with pytest.raises(ValueError):
+        evaluator.submit(samples[0])
+
+def test_batching_evaluator_http_server():
+    evaluator = BatchingEvaluator(_model(), max_batch_size=4)
+    server = http_server(evaluator)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://%s:%i' % server.server_address
+
+    try:
+        body = json.dumps({ 'x' : [[1, 0], [0, 1]] }).encode('utf-8')
+        response = json.loads(urlopen(Request(url, data=body)).read().decode('utf-8'))
+        assert len(response) == 1
+        assert np.allclose(list(response.values())[0], [[[1, 2]], [[3, 4]]])
+
+        body = json.dumps({ 'z' : [[1, 0]] }).encode('utf-8')
+        with pytest.raises(Exception) as e:
+            urlopen(Request(url, data=body))
+        assert e.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+        evaluator.close()
+
+def test_evaluator_pool():
+    x = input_variable(shape=(3,), name='x')
+    w = parameter(init=np.random.rand(3, 4).astype(np.float32))
+    b = parameter(init=np.random.rand(4).astype(np.float32))
+    model = plus(times(x, w), b)
+
+    pool = EvaluatorPool(model, size=4)
+    batches = [np.random.rand(5, 3).astype(np.float32) for _ in range(64)]
+    expected = [model.eval({x: batch}) for batch in batches]
+
+    def evaluate(i):
+        if i % 2:
+            return pool.eval({x: batches[i]})
+        return pool.eval({'x': batches[i]})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(evaluate, range(len(batches))))
+
+    for result, exp in zip(results, expected):
+        assert np.allclose(result, exp)
+
+    assert 1 <= pool.num_replicas <= 4
+
+    # the replicas share the parameters of the model
+    replica = pool._create_replica()
+    assert set(p.uid for p in replica.function.parameters) == \
+            set(p.uid for p in model.parameters)
+    w.value = np.zeros((3, 4), dtype=np.float32)
+    assert np.allclose(pool.eval({x: batches[0]}), b.value)
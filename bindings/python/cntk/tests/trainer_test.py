@@ -192,3 +192,294 @@ def test_eval_one_hot_bad(one_hot_batch, dim, device_id):
     with pytest.raises(ValueError):
         batch = one_hot(one_hot_batch, num_classes=dim, device=cntk_device(device_id))
 
+
+def test_checkpoint_writer(tmpdir):
+    in1 = input_variable(shape=(1,))
+    labels = input_variable(shape=(1,))
+    p = parameter(shape=(2,), init=10)
+    z = plus(in1, reduce_sum(p), name='z')
+    ce = cross_entropy_with_softmax(z, labels)
+    errs = classification_error(z, labels)
+    lr_per_sample = learning_rate_schedule(0.007, UnitType.sample)
+    trainer = Trainer(z, ce, errs, [sgd(z.parameters, lr_per_sample)])
+    arguments = {in1: [[1],[2]], labels: [[0], [1]]}
+
+    filename = str(tmpdir / 'checkpoints' / 'model.dnn')
+    writer = CheckpointWriter(filename, keep=2)
+    assert writer.restore(trainer) is None
+
+    values = []
+    for i in range(3):
+        trainer.train_minibatch(arguments)
+        values.append(p.value.copy())
+        assert writer.save(trainer, {'step': i}) == '%s.%i' % (filename, i)
+    writer.wait()
+
+    assert writer.checkpoints() == [filename + '.1', filename + '.2']
+    assert not os.path.exists(filename + '.0')
+    assert os.path.exists(filename + '.2.ckp')
+
+    # an incomplete newest checkpoint is skipped
+    with open(filename + '.3', 'w') as f:
+        f.write('partial')
+    writer = CheckpointWriter(filename, keep=2)
+    assert writer.latest() == filename + '.2'
+
+    trainer.train_minibatch(arguments)
+    writer.restore(trainer)
+    assert np.allclose(p.value, values[2])
+
+    # a damaged checkpoint is not valid anymore
+    with open(filename + '.2', 'ab') as f:
+        f.write(b'garbage')
+    assert writer.latest() == filename + '.1'
+    writer.restore(trainer)
+    assert np.allclose(p.value, values[1])
+
+    # rotation also deletes incomplete checkpoints and leftovers of
+    # crashed writes
+    with open(filename + '.3.ckp.tmp', 'w') as f:
+        f.write('partial')
+    assert writer.save(trainer) == filename + '.4'
+    writer.wait()
+    assert writer.checkpoints() == [filename + '.1', filename + '.4']
+    assert sorted(os.listdir(str(tmpdir / 'checkpoints'))) == \
+            ['model.dnn.1', 'model.dnn.1.ckp', 'model.dnn.1.done',
+             'model.dnn.4', 'model.dnn.4.ckp', 'model.dnn.4.done']
+
+def _linear_classifier_trainer(loss_scaler=None):
+    '''
+    Returns a trainer of a 2x2 linear classifier with softmax cross entropy
+    loss and SGD, its feature and label inputs and its parameter.
+    '''
+    in1 = input_variable(shape=(2,))
+    labels = input_variable(shape=(2,))
+    p = parameter(shape=(2, 2), init=np.asarray([[1, 2], [3, 4]],
+        dtype=np.float32) * 0.1)
+    z = times(in1, p, name='z')
+    ce = cross_entropy_with_softmax(z, labels)
+    errs = classification_error(z, labels)
+    lr_per_sample = learning_rate_schedule(0.1, UnitType.sample)
+    trainer = Trainer(z, ce, errs, [sgd(z.parameters, lr_per_sample)],
+            loss_scaler=loss_scaler)
+    return trainer, in1, labels, p
+
+def _sparse_classifier_trainer(loss_scaler=None):
+    '''
+    Returns a trainer of a linear classifier of one-hot encoded inputs of
+    dimension 4, whose parameter has sparse gradients, its feature and label
+    inputs and its parameter.
+    '''
+    in1 = input_variable(shape=(4,), is_sparse=True)
+    labels = input_variable(shape=(2,))
+    p = parameter(shape=(4, 2), init=np.asarray([[1, 2], [3, 4], [5, 6],
+        [7, 8]], dtype=np.float32) * 0.1)
+    z = times(in1, p, name='z')
+    ce = cross_entropy_with_softmax(z, labels)
+    errs = classification_error(z, labels)
+    lr_per_sample = learning_rate_schedule(0.1, UnitType.sample)
+    trainer = Trainer(z, ce, errs, [sgd(z.parameters, lr_per_sample)],
+            loss_scaler=loss_scaler)
+    return trainer, in1, labels, p
+
+def test_checkpoint_writer_mismatched_trainer(tmpdir):
+    trainer, in1, labels, p = _linear_classifier_trainer()
+    trainer.train_minibatch({in1: [[1, 0]], labels: [[1, 0]]})
+    filename = str(tmpdir / 'checkpoints' / 'model.dnn')
+    writer = CheckpointWriter(filename, keep=1)
+    writer.save(trainer)
+    writer.wait()
+
+    in1 = input_variable(shape=(3,))
+    p = parameter(shape=(3, 2), init=0.5)
+    z = times(in1, p)
+    labels = input_variable(shape=(2,))
+    ce = cross_entropy_with_softmax(z, labels)
+    errs = classification_error(z, labels)
+    other = Trainer(z, ce, errs, [sgd(z.parameters,
+        learning_rate_schedule(0.1, UnitType.sample))])
+
+    # a checkpoint of another model is not restored quietly, nor deleted
+    with pytest.raises((ValueError, RuntimeError)):
+        writer.restore(other)
+    assert writer.checkpoints() == [filename + '.0']
+
+def test_gradient_accumulation():
+    features = np.asarray([[1, 0], [0, 1], [1, 1], [2, 0]], dtype=np.float32)
+    targets = np.asarray([[1, 0], [0, 1], [0, 1], [1, 0]], dtype=np.float32)
+
+    trainer, in1, labels, p = _linear_classifier_trainer()
+    trainer.train_minibatch({in1: features, labels: targets})
+    expected_value = p.value
+    expected_loss = trainer.previous_minibatch_loss_average
+    expected_error = trainer.previous_minibatch_evaluation_average
+
+    trainer, in1, labels, p = _linear_classifier_trainer()
+    initial_value = p.value
+    assert trainer.train_minibatch({in1: features[:1], labels: targets[:1]},
+            accumulate=True)
+    updated, outputs = trainer.train_minibatch(
+            {in1: features[1:3], labels: targets[1:3]},
+            outputs=[trainer.model.output], accumulate=True)
+    assert updated
+    assert list(outputs.values())[0].shape == (2, 1, 2)
+    # nothing is updated before the last micro-batch
+    assert np.allclose(p.value, initial_value)
+    assert trainer.previous_minibatch_sample_count == 2
+
+    assert trainer.train_minibatch({in1: features[3:], labels: targets[3:]})
+    assert np.allclose(p.value, expected_value)
+    # the previous minibatch is the one of the whole update
+    assert trainer.previous_minibatch_sample_count == 4
+    assert np.isclose(trainer.previous_minibatch_loss_average, expected_loss)
+    assert np.isclose(trainer.previous_minibatch_evaluation_average,
+            expected_error)
+
+    # the progress of the micro-batches adds up to the one of the full batch
+    summary = trainer.summarize_training_progress()
+    assert summary.samples == 4
+    assert summary.minibatches == 3
+    assert np.isclose(summary.loss_average, expected_loss)
+    assert np.isclose(summary.evaluation_average, expected_error)
+
+def test_gradient_accumulation_sparse_input():
+    indices = [[0], [1], [3], [1]]
+    targets = np.asarray([[1, 0], [0, 1], [0, 1], [1, 0]], dtype=np.float32)
+
+    trainer, in1, labels, p = _sparse_classifier_trainer()
+    trainer.train_minibatch({in1: one_hot(indices, 4), labels: targets})
+    expected_value = p.value
+
+    # the sparse gradients of the micro-batches are summed up densely
+    trainer, in1, labels, p = _sparse_classifier_trainer()
+    for begin, end in [(0, 1), (1, 3)]:
+        trainer.train_minibatch({in1: one_hot(indices[begin:end], 4),
+            labels: targets[begin:end]}, accumulate=True)
+    trainer.train_minibatch({in1: one_hot(indices[3:], 4),
+        labels: targets[3:]})
+    assert np.allclose(p.value, expected_value)
+    assert trainer.previous_minibatch_sample_count == 4
+
+def test_summarize_training_progress():
+    trainer, in1, labels, p = _linear_classifier_trainer()
+
+    features = np.asarray([[1, 0], [0, 1], [1, 1], [2, 0], [0, 2]],
+            dtype=np.float32)
+    targets = np.asarray([[1, 0], [0, 1], [0, 1], [1, 0], [1, 0]],
+            dtype=np.float32)
+
+    loss_sum = eval_sum = 0.0
+    for begin, end in [(0, 2), (2, 3), (3, 5)]:
+        trainer.train_minibatch({in1: features[begin:end],
+            labels: targets[begin:end]})
+        count = trainer.previous_minibatch_sample_count
+        loss_sum += trainer.previous_minibatch_loss_average * count
+        eval_sum += trainer.previous_minibatch_evaluation_average * count
+
+    summary = trainer.summarize_training_progress()
+    assert summary.samples == 5
+    assert summary.minibatches == 3
+    assert np.isclose(summary.loss_average, loss_sum / 5)
+    assert np.isclose(summary.evaluation_average, eval_sum / 5)
+
+    # the sums start afresh, and accumulated minibatches count on their own
+    summary = trainer.summarize_training_progress()
+    assert summary.samples == 0 and summary.loss_average == 0.0
+
+    # after an update, the previous minibatch covers all minibatches of the
+    # update
+    loss_sum = 0.0
+    for begin, end, accumulate in [(0, 2, True), (2, 5, False), (0, 1, False)]:
+        trainer.train_minibatch({in1: features[begin:end],
+            labels: targets[begin:end]}, accumulate=accumulate)
+        if not accumulate:
+            loss_sum += trainer.previous_minibatch_loss_average * \
+                    trainer.previous_minibatch_sample_count
+
+    summary = trainer.summarize_training_progress()
+    assert summary.samples == 6
+    assert summary.minibatches == 3
+    assert np.isclose(summary.loss_average, loss_sum / 6)
+
+def test_loss_scaling(tmpdir):
+    features = np.asarray([[1, 0], [0, 1], [1, 1], [2, 0]], dtype=np.float32)
+    targets = np.asarray([[1, 0], [0, 1], [0, 1], [1, 0]], dtype=np.float32)
+
+    trainer, in1, labels, p = _linear_classifier_trainer()
+    trainer.train_minibatch({in1: features, labels: targets})
+    trainer.train_minibatch({in1: features[:2], labels: targets[:2]})
+    expected_value = p.value
+    expected_loss = trainer.previous_minibatch_loss_average
+
+    # scaling the loss does not change the updates
+    scaler = DynamicLossScaler(init_scale=2**10, growth_interval=1)
+    trainer, in1, labels, p = _linear_classifier_trainer(scaler)
+    assert trainer.train_minibatch({in1: features, labels: targets})
+    assert scaler.scale == 2**11
+    trainer.train_minibatch({in1: features[:2], labels: targets[:2]})
+    assert np.allclose(p.value, expected_value)
+    assert np.isclose(trainer.previous_minibatch_loss_average, expected_loss)
+    assert trainer.previous_minibatch_sample_count == 2
+
+    # the scaled gradients of the misclassified samples overflow float32:
+    # the update is skipped and the scale reduced until they fit
+    scaler = DynamicLossScaler(init_scale=1e38, backoff_factor=1e-6)
+    trainer, in1, labels, p = _linear_classifier_trainer(scaler)
+    initial_value = p.value
+    assert trainer.train_minibatch({in1: features * 1000, labels: targets})
+    assert np.allclose(p.value, initial_value)
+    assert scaler.num_skipped_updates == 1
+    assert np.isclose(scaler.scale, 1e32)
+    assert trainer.previous_minibatch_sample_count == 4
+
+    trainer.train_minibatch({in1: features * 1000, labels: targets})
+    assert scaler.num_skipped_updates == 1
+    assert not np.allclose(p.value, initial_value)
+    assert np.all(np.isfinite(p.value))
+
+    # the state of the scaler is saved with the checkpoint
+    filename = str(tmpdir / 'checkpoint')
+    trainer.save_checkpoint(filename, {'epoch': 3})
+    with pytest.raises(ValueError):
+        trainer.save_checkpoint(filename, {'loss_scaler': 1})
+
+    restored_scaler = DynamicLossScaler(init_scale=1e38)
+    trainer, in1, labels, p = _linear_classifier_trainer(restored_scaler)
+    external_state = trainer.restore_from_checkpoint(filename)
+    assert external_state.get_value('epoch') == 3
+    assert np.isclose(restored_scaler.scale, 1e32)
+    assert restored_scaler.num_skipped_updates == 1
+
+def test_loss_scaling_sparse_input():
+    indices = [[0], [1], [3], [1]]
+    targets = np.asarray([[1, 0], [0, 1], [0, 1], [1, 0]], dtype=np.float32)
+
+    trainer, in1, labels, p = _sparse_classifier_trainer()
+    trainer.train_minibatch({in1: one_hot(indices, 4), labels: targets})
+    expected_value = p.value
+
+    # the sparse gradients are checked and unscaled as dense ones
+    scaler = DynamicLossScaler(init_scale=2**10)
+    trainer, in1, labels, p = _sparse_classifier_trainer(scaler)
+    assert trainer.train_minibatch({in1: one_hot(indices, 4),
+        labels: targets})
+    assert scaler.num_skipped_updates == 0
+    assert np.allclose(p.value, expected_value)
+
+def test_loss_scaling_overflow_at_min_scale():
+    # at a scale of 1 the gradients are not divided, but still checked
+    scaler = DynamicLossScaler(init_scale=1, min_scale=1)
+    trainer, in1, labels, p = _linear_classifier_trainer(scaler)
+    initial_value = p.value
+
+    # the gradients of the two samples add up to more than the float32 range
+    features = np.asarray([[3e38, 0], [3e38, 0]], dtype=np.float32)
+    targets = np.asarray([[1, 0], [1, 0]], dtype=np.float32)
+    assert trainer.train_minibatch({in1: features, labels: targets})
+    assert np.allclose(p.value, initial_value)
+    assert scaler.num_skipped_updates == 1
+    assert scaler.scale == 1
+
+    trainer.train_minibatch({in1: [[1, 0]], labels: [[1, 0]]})
+    assert scaler.num_skipped_updates == 1
+    assert not np.allclose(p.value, initial_value)
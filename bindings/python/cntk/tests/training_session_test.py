@@ -0,0 +1,96 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+import numpy as np
+import pytest
+
+from .. import input_variable, parameter, times, squared_error
+from ..io import NumpyMinibatchSource, FULL_DATA_SWEEP, INFINITELY_REPEAT
+from ..learner import sgd, learning_rate_schedule, UnitType
+from ..trainer import Trainer
+from ..training_session import TrainingSession, PHASES
+
+def _regression_setup(num_samples=200):
+    features = np.random.rand(num_samples, 2).astype(np.float32)
+    targets = features.dot(np.asarray([[2], [-1]], dtype=np.float32))
+
+    x = input_variable(shape=(2,))
+    y = input_variable(shape=(1,))
+    w = parameter(shape=(2, 1), init=0)
+    z = times(x, w)
+    loss = squared_error(z, y)
+    trainer = Trainer(z, loss, loss,
+            [sgd(z.parameters, learning_rate_schedule(0.1, UnitType.sample))])
+    return trainer, x, y, features, targets
+
+def test_training_session(tmpdir):
+    trainer, x, y, features, targets = _regression_setup()
+    source = NumpyMinibatchSource(dict(x=features, y=targets),
+            epoch_size=INFINITELY_REPEAT)
+    cv_source = NumpyMinibatchSource(dict(x=features, y=targets),
+            randomize=False, epoch_size=FULL_DATA_SWEEP)
+    checkpoint = str(tmpdir / 'model.dnn')
+
+    session = TrainingSession(trainer, source, 10,
+            { x : source.streams.x, y : source.streams.y },
+            max_samples=1000, checkpoint_filename=checkpoint,
+            checkpoint_frequency=300, cv_source=cv_source,
+            cv_input_map={ x : cv_source.streams.x, y : cv_source.streams.y },
+            cv_frequency=500)
+    result = session.train()
+
+    assert result.samples_seen == 1000
+    assert result.minibatches_seen == 100
+    assert session.checkpoint_writer.latest() is not None
+    assert len(session.checkpoint_writer.checkpoints()) == 3
+    assert set(result.timings) == set(PHASES)
+    assert result.timings['train'] > 0
+    assert [samples for samples, _ in result.cv_results] == [500, 1000]
+    # the model learns, and every evaluation sees the whole data
+    assert result.cv_results[1][1] < result.cv_results[0][1]
+
+    # a new session continues from the checkpoint
+    trainer, x, y, features, targets = _regression_setup()
+    source = NumpyMinibatchSource(dict(x=features, y=targets),
+            epoch_size=INFINITELY_REPEAT)
+    session = TrainingSession(trainer, source, 10,
+            { x : source.streams.x, y : source.streams.y },
+            max_samples=1200, checkpoint_filename=checkpoint)
+    result = session.train()
+    assert result.samples_seen == 1200
+    assert result.minibatches_seen == 120
+
+def test_training_session_ends_with_source():
+    trainer, x, y, features, targets = _regression_setup(95)
+    source = NumpyMinibatchSource(dict(x=features, y=targets),
+            epoch_size=FULL_DATA_SWEEP)
+    session = TrainingSession(trainer, source, 10,
+            { x : source.streams.x, y : source.streams.y })
+    result = session.train()
+    assert result.samples_seen == 95
+    assert result.minibatches_seen == 10
+
+    with pytest.raises(ValueError):
+        session.save_checkpoint()
+    with pytest.raises(ValueError):
+        TrainingSession(trainer, source, 10, {}, cv_frequency=10)
+
+def test_training_session_rewinds_source():
+    trainer, x, y, features, targets = _regression_setup()
+    source = NumpyMinibatchSource(dict(x=features, y=targets),
+            randomize=False)
+    session = TrainingSession(trainer, source, 10,
+            { x : source.streams.x, y : source.streams.y },
+            max_samples=50, prefetch=4)
+    result = session.train()
+    assert result.samples_seen == 50
+
+    # the source is no longer read ahead and continues after the last
+    # minibatch that was trained on
+    assert source.get_checkpoint_state() == { 'position' : 50 }
+    mb = source.next_minibatch(10)
+    assert np.allclose(mb[source.streams.x].value.reshape(10, 2),
+            features[50:60])
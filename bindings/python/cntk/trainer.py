@@ -4,9 +4,19 @@
 # for full license information.
 # ==============================================================================
 
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+
 from . import cntk_py
 from .device import use_default_device
-from .utils import sanitize_var_map, sanitize_function, typemap, value_to_seq
+from .ops.functions import _replace_file
+from .utils import sanitize_var_map, sanitize_function, typemap, \
+        value_to_seq, Record
 from .io import _py_dict_to_cntk_dict
 
 __doc__= '''\
@@ -15,6 +25,9 @@ A trainer encapsulates the overall training process and employs one or more
 using gradients of parameters w.r.t. a training objective.
 '''
 
+# key of the state of the loss scaler in the external state of checkpoints
+_LOSS_SCALER_STATE_KEY = 'loss_scaler'
+
 class Trainer(cntk_py.Trainer):
     '''
     Trainer to train the specified ``model`` with the specified ``training_loss``
@@ -28,8 +41,14 @@ class Trainer(cntk_py.Trainer):
        loss_function (:class:`~cntk.ops.functions.Function`): loss function
        eval_function (:class:`~cntk.ops.functions.Function`): evaluation function
        parameter_learners (list): list of learners from :mod:`cntk.learner`
+       loss_scaler (:class:`~cntk.learner.DynamicLossScaler`, default None):
+        if given, the gradients are computed for the loss scaled by its
+        ``scale`` and unscaled on the device before the parameters are
+        updated; updates whose gradients overflow are skipped. Not supported
+        with distributed learners.
     '''
-    def __init__(self, model, loss_function, eval_function, parameter_learners):
+    def __init__(self, model, loss_function, eval_function, parameter_learners,
+            loss_scaler=None):
         # TODO sanitizing should be removed once Swig's typemaps are in place
         model = sanitize_function(model)
         loss_function = sanitize_function(loss_function)
@@ -38,11 +57,31 @@ class Trainer(cntk_py.Trainer):
             parameter_learners = [parameter_learners]
 
         super(Trainer, self).__init__(model, loss_function, eval_function, parameter_learners)
-
-    def train_minibatch(self, arguments, outputs=None, device=None):
+        # the model property returns a new instance on every call, this one
+        # keeps the argument binding plan between minibatches
+        self._model = model
+        self._loss_scaler = loss_scaler
+        if loss_scaler is not None:
+            super(Trainer, self).set_loss_scale(loss_scaler.scale)
+        # whether gradients have been accumulated since the last update
+        self._accumulated = False
+
+    def train_minibatch(self, arguments, outputs=None, device=None,
+            buffer_pool=None, accumulate=False):
         '''
         Optimize model parameters using the specified 'arguments' minibatch of training samples.
 
+        With ``accumulate=True``, the gradients of the minibatch are only
+        summed up on the device. The next call without ``accumulate`` adds
+        its gradients and updates the parameters once with the sum, as if all
+        minibatches since the last update had been one minibatch. This
+        trains with a large effective minibatch size while only one of the
+        smaller minibatches has to fit into memory.
+
+        Example:
+            >>> for i, mb in enumerate(micro_batches): # doctest: +SKIP
+            ...     trainer.train_minibatch(mb, accumulate=(i + 1) % 4 != 0)
+
         Args:
             arguments: maps variables to their
              input data. Empty map signifies end of local training data.
@@ -63,11 +102,20 @@ class Trainer(cntk_py.Trainer):
             device (:class:`~cntk.device.DeviceDescriptor`): the device descriptor that
              contains the type and id of the device on which the computation is
              to be performed.
+            buffer_pool (:class:`~cntk.utils.ValueBufferPool`, default `None`):
+             pool whose memory is reused for the input data
+            accumulate (bool, default `False`): only accumulate the gradients
+             of this minibatch instead of updating the parameters. The loss
+             and evaluation averages and the sample count of the previous
+             minibatch refer to this minibatch alone. After the next call
+             without ``accumulate``, they refer to all minibatches of the
+             update together. Not supported with distributed learners.
 
         Returns:
             `bool` or `tuple`:
             If ``outputs`` have not been provided, the returned value is `True`
-            if updates have been performed, `False` if all parameter learners
+            if updates have been performed (or gradients have been
+            accumulated), `False` if all parameter learners
             indicate end of learning (through their update). Otherwise, the
             return value is a tuple of the that `bool` and a dictionary that
             maps the variables in `outputs` to their respective NumPy arrays.
@@ -76,23 +124,73 @@ class Trainer(cntk_py.Trainer):
             device = use_default_device()
 
         if arguments:
-            arguments = sanitize_var_map(self.model.arguments, arguments)
+            arguments = sanitize_var_map(self._model, arguments, device=device,
+                    buffer_pool=buffer_pool)
+
+        if self._loss_scaler is not None:
+            super(Trainer, self).set_loss_scale(self._loss_scaler.scale)
 
+        if accumulate:
+            train = super(Trainer, self).accumulate_minibatch
+        else:
+            train = super(Trainer, self).train_minibatch
         if outputs:
             output_map = {v: None for v in outputs}
-            updated = super(Trainer, self).train_minibatch(arguments,
-                    output_map, device)
+            updated = train(arguments, output_map, device)
             for k,v in output_map.items():
                 output_map[k] = value_to_seq(v)
+        else:
+            updated = train(arguments, device)
 
-            return updated, output_map
+        if accumulate:
+            updated = True
+            self._accumulated = self._accumulated or bool(arguments)
         else:
-            updated = super(Trainer, self).train_minibatch(arguments, device)
+            # the parameters have been updated (or the update was skipped)
+            # if there were gradients
+            if self._loss_scaler is not None and \
+                    (arguments or self._accumulated):
+                self._loss_scaler.update(not super(Trainer,
+                    self).previous_minibatch_update_skipped())
+            self._accumulated = False
 
+        if outputs:
+            return updated, output_map
         return updated
 
+    def summarize_training_progress(self):
+        '''
+        Returns the average training loss and evaluation criterion per sample
+        over all minibatches trained since the last call, and starts the
+        next summary.
 
-    def test_minibatch(self, arguments, device=None):
+        Unlike :attr:`previous_minibatch_loss_average`, which waits for the
+        minibatch to be computed and copies its loss from the device every
+        time it is read, the sums are accumulated on the device while
+        training, and only copied when the summary is requested. Reporting
+        the progress every few hundred minibatches thus does not stall
+        training after every minibatch.
+
+        Minibatches whose gradients are accumulated (see
+        :meth:`train_minibatch`) count as minibatches of their own.
+
+        Returns:
+            :class:`~cntk.utils.Record` with the average loss
+            (``loss_average``), the average evaluation criterion
+            (``evaluation_average``), and the number of samples (``samples``)
+            and minibatches (``minibatches``) trained since the last call.
+            The averages are 0 if no samples have been trained.
+        '''
+        summary = super(Trainer, self).summarize_training_progress()
+        loss_sum = summary.get_value('loss')
+        eval_sum = summary.get_value('evaluation')
+        samples = summary.get_value('samples')
+        minibatches = summary.get_value('minibatches')
+        return Record(loss_average=loss_sum / samples if samples else 0.0,
+                evaluation_average=eval_sum / samples if samples else 0.0,
+                samples=samples, minibatches=minibatches)
+
+    def test_minibatch(self, arguments, device=None, buffer_pool=None):
         '''
         Test the model on the specified batch of samples using the evaluation
         Function specified during construction of the Trainer.
@@ -116,13 +214,16 @@ class Trainer(cntk_py.Trainer):
             device (:class:`~cntk.device.DeviceDescriptor`): the device descriptor that
              contains the type and id of the device on which the computation is
              to be performed.
+            buffer_pool (:class:`~cntk.utils.ValueBufferPool`, default `None`):
+             pool whose memory is reused for the input data
         Returns:
             `float`: the average evaluation criterion value per sample for the
               tested minibatch.
         '''
         if not device:
             device = use_default_device()
-        arguments = sanitize_var_map(self.model.arguments, arguments)
+        arguments = sanitize_var_map(self._model, arguments, device=device,
+                buffer_pool=buffer_pool)
 
         return super(Trainer, self).test_minibatch(arguments, device)
 
@@ -131,22 +232,45 @@ class Trainer(cntk_py.Trainer):
         Saves a checkpoint of the model and other Trainer state at the
         specified file location.
 
+        The state of the ``loss_scaler`` is saved in ``external_state``
+        under the key ``loss_scaler``, which is reserved if the trainer has
+        one.
+
         Args:
             filename (str): filename to store the checkpoint.
+            external_state (dict, default {}): state of the caller to save
+             with the checkpoint
         '''
+        if self._loss_scaler is not None:
+            if _LOSS_SCALER_STATE_KEY in external_state:
+                raise ValueError('the external state key "%s" is reserved '
+                        'for the loss scaler' % _LOSS_SCALER_STATE_KEY)
+            external_state = dict(external_state)
+            external_state[_LOSS_SCALER_STATE_KEY] = json.dumps(
+                    self._loss_scaler.get_checkpoint_state())
 
         super(Trainer, self).save_checkpoint(filename, _py_dict_to_cntk_dict(external_state))
 
     def restore_from_checkpoint(self, filename):
         '''
-        Saves a checkpoint of the model and other Trainer state at the
-        specified file location.
+        Restores the model and other Trainer state from the checkpoint at the
+        specified file location, including the state of the ``loss_scaler``
+        if the checkpoint has one.
 
         Args:
             filename (str): filename to restore the checkpoint from
+
+        Returns:
+            :class:`~cntk_py.Dictionary`: the ``external_state`` that was
+            passed to :meth:`save_checkpoint`
         '''
 
-        super(Trainer, self).restore_from_checkpoint(filename)
+        external_state = super(Trainer, self).restore_from_checkpoint(filename)
+        if self._loss_scaler is not None and \
+                external_state.contains(_LOSS_SCALER_STATE_KEY):
+            self._loss_scaler.restore_from_checkpoint(json.loads(
+                external_state.get_value(_LOSS_SCALER_STATE_KEY)))
+        return external_state
 
     @property
     @typemap
@@ -180,24 +304,38 @@ class Trainer(cntk_py.Trainer):
         '''
         return super(Trainer, self).parameter_learners()
 
+    @property
+    def loss_scaler(self):
+        '''
+        The :class:`~cntk.learner.DynamicLossScaler` of the trainer, or
+        None if the loss is not scaled.
+        '''
+        return self._loss_scaler
+
     @property
     def previous_minibatch_loss_average(self):
         '''
-        The average training loss per sample for the last minibatch trained
+        The average training loss per sample for the last minibatch trained.
+        After gradients have been accumulated, this refers to all minibatches
+        of the update.
         '''
         return super(Trainer, self).previous_minibatch_loss_average()
 
     @property
     def previous_minibatch_evaluation_average(self):
         '''
-        The average evaluation criterion value per sample for the last minibatch trained
+        The average evaluation criterion value per sample for the last minibatch trained.
+        After gradients have been accumulated, this refers to all minibatches
+        of the update.
         '''
         return super(Trainer, self).previous_minibatch_evaluation_average()
 
     @property
     def previous_minibatch_sample_count(self):
         '''
-        The number of samples in the last minibatch trained with
+        The number of samples in the last minibatch trained with. After
+        gradients have been accumulated, this refers to all minibatches of
+        the update.
         '''
         return super(Trainer, self).previous_minibatch_sample_count()
 
@@ -207,3 +345,232 @@ class Trainer(cntk_py.Trainer):
         The number of samples seen globally between all workers from the beginning of training.
         '''
         return super(Trainer, self).total_number_of_samples_seen()
+
+class CheckpointWriter(object):
+    '''
+    Writes checkpoints of a :class:`Trainer` without blocking training for
+    the write to the final location, and keeps the last ``keep`` of them.
+
+    :meth:`save` first writes the checkpoint with
+    :meth:`Trainer.save_checkpoint` into a local staging directory, which is
+    the snapshot of the parameters and learner state that training has to
+    wait for. A background thread then copies the snapshot to
+    ``'<filename>.<n>'`` (and the trainer state to ``'<filename>.<n>.ckp'``)
+    by writing temporary files that are renamed when complete. A checkpoint
+    is valid once its marker file ``'<filename>.<n>.done'`` exists, so a
+    crash while writing never leaves a checkpoint that looks valid.
+
+    Example:
+        >>> writer = CheckpointWriter('/mnt/share/model.dnn', keep=3) # doctest: +SKIP
+        >>> writer.restore(trainer) # doctest: +SKIP
+        >>> for i in range(num_minibatches): # doctest: +SKIP
+        ...     trainer.train_minibatch(...)
+        ...     if i % 1000 == 0:
+        ...         writer.save(trainer)
+        >>> writer.wait() # doctest: +SKIP
+
+    Args:
+        filename (str): base name of the checkpoint files
+        keep (int, default 3): number of checkpoints to keep, older ones
+         are deleted
+        staging_dir (str, default None): local directory for the snapshots,
+         such as a RAM disk. If None, the directory for temporary files is
+         used.
+    '''
+    def __init__(self, filename, keep=3, staging_dir=None):
+        if keep < 1:
+            raise ValueError('keep has to be positive')
+
+        self.filename = os.path.abspath(filename)
+        self.keep = keep
+        self.staging_dir = staging_dir
+        self._thread = None
+        self._error = None
+        self.persist_time = 0.0
+
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        indices = self._indices(valid_only=False)
+        self._next_index = indices[-1] + 1 if indices else 0
+
+    def _path(self, index):
+        return '%s.%i' % (self.filename, index)
+
+    def _indices(self, valid_only=True):
+        '''
+        Returns the sorted indices of the checkpoints in the directory, only
+        of the complete ones if ``valid_only``.
+        '''
+        directory, base = os.path.split(self.filename)
+        indices = set()
+        for name in os.listdir(directory):
+            if not name.startswith(base + '.'):
+                continue
+            index = name[len(base) + 1:].split('.', 1)[0]
+            if index.isdigit():
+                indices.add(int(index))
+        if valid_only:
+            indices = [i for i in indices if self._is_valid(i)]
+        return sorted(indices)
+
+    def _is_valid(self, index):
+        path = self._path(index)
+        try:
+            with open(path + '.done') as f:
+                sizes = json.load(f)
+            return all(os.path.getsize(path + suffix) == size
+                    for suffix, size in sizes.items())
+        except (IOError, OSError, ValueError):
+            return False
+
+    def checkpoints(self):
+        '''
+        Returns the file names of the valid checkpoints, the newest last.
+        '''
+        return [self._path(i) for i in self._indices()]
+
+    def latest(self):
+        '''
+        Returns the file name of the newest valid checkpoint, or None.
+        '''
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, trainer, external_state={}):
+        '''
+        Snapshots the state of ``trainer`` and writes it in the background.
+        Waits for the previous checkpoint to be written first.
+
+        Args:
+            trainer (:class:`Trainer`): the trainer to checkpoint
+            external_state (dict): state to store with the checkpoint, see
+             :meth:`Trainer.save_checkpoint`
+
+        Returns:
+            `str`: the file name that the checkpoint will have
+        '''
+        self.wait()
+
+        staging_dir = tempfile.mkdtemp(dir=self.staging_dir)
+        staged = os.path.join(staging_dir, 'checkpoint')
+        try:
+            trainer.save_checkpoint(staged, external_state)
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        index = self._next_index
+        self._next_index += 1
+        self._thread = threading.Thread(target=self._persist,
+                args=(staging_dir, staged, index))
+        self._thread.daemon = True
+        self._thread.start()
+        return self._path(index)
+
+    def _persist(self, staging_dir, staged, index):
+        start = time.time()
+        path = self._path(index)
+        try:
+            # in distributed training only the main worker writes files
+            if os.path.exists(staged):
+                sizes = {}
+                for suffix in ('', '.ckp'):
+                    _copy_atomically(staged + suffix, path + suffix)
+                    sizes[suffix] = os.path.getsize(path + suffix)
+                _write_atomically(path + '.done', json.dumps(sizes))
+                self._rotate(index)
+        except Exception as e:
+            self._error = e
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self.persist_time += time.time() - start
+
+    def _rotate(self, written_index):
+        '''
+        Deletes the valid checkpoints but the last ``keep``, and the files
+        of incomplete checkpoints older than ``written_index``, such as the
+        leftovers of a crashed write.
+        '''
+        valid = self._indices()
+        obsolete = set(valid[:-self.keep])
+        obsolete.update(i for i in self._indices(valid_only=False)
+                if i < written_index and i not in valid)
+        for index in sorted(obsolete):
+            self._remove(index)
+
+    def _remove(self, index):
+        path = self._path(index)
+        # the marker goes first, so that a partly deleted checkpoint is not
+        # valid
+        if os.path.exists(path + '.done'):
+            os.remove(path + '.done')
+        directory, name = os.path.split(path)
+        for other in os.listdir(directory):
+            if other == name or other.startswith(name + '.'):
+                os.remove(os.path.join(directory, other))
+
+    def wait(self):
+        '''
+        Waits until the last checkpoint is written. Raises the error that
+        occurred while writing it, if any.
+        '''
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def restore(self, trainer):
+        '''
+        Restores ``trainer`` from the newest valid checkpoint. If that fails,
+        older checkpoints are tried, and a warning names the ones that could
+        not be restored.
+
+        Args:
+            trainer (:class:`Trainer`): the trainer to restore
+
+        Returns:
+            :class:`~cntk_py.Dictionary`: the external state of the restored
+            checkpoint, or None if there is no valid checkpoint
+
+        Raises:
+            the error of restoring the newest checkpoint if none of the valid
+            checkpoints could be restored, for instance because they do not
+            match the model or learners of ``trainer``
+        '''
+        self.wait()
+        errors = []
+        for path in reversed(self.checkpoints()):
+            try:
+                external_state = trainer.restore_from_checkpoint(path)
+            except Exception as e:
+                errors.append((path, e))
+                continue
+            if errors:
+                warnings.warn('restored the checkpoint %s because newer '
+                        'ones could not be restored: %s' % (path, '; '.join(
+                            '%s: %s' % error for error in errors)))
+            return external_state
+
+        if errors:
+            raise errors[0][1]
+        return None
+
+def _copy_atomically(source, destination):
+    temp = destination + '.tmp'
+    with open(source, 'rb') as src, open(temp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+        dst.flush()
+        os.fsync(dst.fileno())
+    _replace_file(temp, destination)
+
+def _write_atomically(filename, content):
+    temp = filename + '.tmp'
+    with open(temp, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    _replace_file(temp, filename)
@@ -0,0 +1,332 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+A training session runs the training loop that is otherwise written by hand
+around :meth:`~cntk.trainer.Trainer.train_minibatch`: reading minibatches,
+training on them, reporting the progress, writing checkpoints and
+evaluating on cross-validation data, while measuring how long every phase
+takes.
+'''
+
+import json
+import time
+
+from . import cntk_py
+from .device import use_default_device
+from .io import PrefetchingMinibatchSource
+from .trainer import CheckpointWriter
+from .utils import Record
+
+#: the phases of a training session whose time is measured
+PHASES = ('read', 'train', 'progress', 'checkpoint', 'checkpoint_wait',
+        'cross_validation')
+
+
+class TrainingSession(object):
+    '''
+    Trains with a :class:`~cntk.trainer.Trainer` on the minibatches of a
+    minibatch source.
+
+    The minibatches are read on a background thread by a
+    :class:`~cntk.io.PrefetchingMinibatchSource`, so that reading overlaps
+    with training. Checkpoints are written by a
+    :class:`~cntk.trainer.CheckpointWriter`: training only waits for the
+    local snapshot, the checkpoint is written to ``checkpoint_filename`` on
+    a background thread. The checkpoints contain the checkpoint state of
+    the minibatch source, so that a restored session continues with the
+    data that followed the checkpoint.
+
+    Example:
+        >>> session = TrainingSession(trainer, source, 64,
+        ...     input_map={features: source.streams.features,
+        ...                labels: source.streams.labels},
+        ...     max_samples=50000, checkpoint_filename='model.dnn',
+        ...     checkpoint_frequency=10000) # doctest: +SKIP
+        >>> result = session.train() # doctest: +SKIP
+        >>> result.timings['read'] # doctest: +SKIP
+
+    Args:
+        trainer (:class:`~cntk.trainer.Trainer`): the trainer to train with
+        train_source: minibatch source of the training data, such as
+         :class:`~cntk.io.MinibatchSource`
+        minibatch_size (int): number of samples per minibatch
+        input_map (dict): maps the arguments of the model to the streams of
+         ``train_source``
+        max_samples (int, default None): number of samples to train on. If
+         None, training ends when ``train_source`` returns an empty
+         minibatch.
+        progress_printer (:class:`~cntk.utils.ProgressPrinter`, default
+         None): is updated after every minibatch
+        checkpoint_filename (str, default None): base name of the
+         checkpoint files, see :class:`~cntk.trainer.CheckpointWriter`. If
+         None, no checkpoints are written.
+        checkpoint_frequency (int, default None): number of samples between
+         checkpoints. If None, a checkpoint is only written at the end.
+        keep_checkpoints (int, default 3): number of checkpoints to keep
+        restore (bool, default True): whether :meth:`train` continues from
+         the newest valid checkpoint if there is one
+        cv_source (default None): minibatch source of the cross-validation
+         data. It has to end after one pass over the data (e.g. with
+         ``epoch_size=FULL_DATA_SWEEP``); every evaluation starts from its
+         initial state.
+        cv_input_map (dict, default None): maps the arguments of the model
+         to the streams of ``cv_source``, ``input_map`` if None
+        cv_frequency (int, default None): number of samples between
+         evaluations on ``cv_source``. If None, it is only evaluated at the
+         end.
+        cv_minibatch_size (int, default None): number of samples per
+         cross-validation minibatch, ``minibatch_size`` if None
+        prefetch (int, default 2): number of minibatches that are read
+         ahead. If 0, minibatches are read when they are needed.
+        device (:class:`~cntk.device.DeviceDescriptor`, default None): the
+         device to train on, the default device if None
+    '''
+    def __init__(self, trainer, train_source, minibatch_size, input_map,
+            max_samples=None, progress_printer=None,
+            checkpoint_filename=None, checkpoint_frequency=None,
+            keep_checkpoints=3, restore=True,
+            cv_source=None, cv_input_map=None, cv_frequency=None,
+            cv_minibatch_size=None, prefetch=2, device=None):
+        if minibatch_size < 1:
+            raise ValueError('minibatch_size has to be positive')
+        if checkpoint_frequency is not None and checkpoint_frequency < 1:
+            raise ValueError('checkpoint_frequency has to be positive')
+        if cv_frequency is not None and cv_frequency < 1:
+            raise ValueError('cv_frequency has to be positive')
+        if cv_frequency is not None and cv_source is None:
+            raise ValueError('cv_frequency requires a cv_source')
+
+        # whether train_source is wrapped by the session, which then closes
+        # the wrapper after training
+        self._prefetcher = bool(prefetch) and \
+                not isinstance(train_source, PrefetchingMinibatchSource)
+        if self._prefetcher:
+            train_source = PrefetchingMinibatchSource(train_source, prefetch)
+
+        self.trainer = trainer
+        self.train_source = train_source
+        self.minibatch_size = minibatch_size
+        self.input_map = input_map
+        self.max_samples = max_samples
+        self.progress_printer = progress_printer
+        self.checkpoint_filename = checkpoint_filename
+        self.checkpoint_frequency = checkpoint_frequency
+        self.checkpoint_writer = CheckpointWriter(checkpoint_filename,
+                keep_checkpoints) if checkpoint_filename is not None else None
+        self.restore = restore
+        self.cv_source = cv_source
+        self.cv_input_map = cv_input_map if cv_input_map is not None else input_map
+        self.cv_frequency = cv_frequency
+        self.cv_minibatch_size = cv_minibatch_size or minibatch_size
+        self.device = device or use_default_device()
+
+        self.samples_seen = 0
+        self.minibatches_seen = 0
+        self.cv_results = []
+        self._timings = dict((phase, 0.0) for phase in PHASES)
+        self._cv_initial_state = None
+
+    @property
+    def timings(self):
+        '''
+        `dict` mapping the phases in :data:`PHASES` to the seconds spent in
+        them. ``checkpoint`` is the time of the background thread that
+        writes the checkpoints, ``checkpoint_wait`` the time that training
+        waited for the snapshots and the previous checkpoint.
+        '''
+        timings = dict(self._timings)
+        if self.checkpoint_writer is not None:
+            timings['checkpoint'] = self.checkpoint_writer.persist_time
+        return timings
+
+    def _measure(self, phase, start):
+        now = time.time()
+        self._timings[phase] += now - start
+        return now
+
+    def _external_state(self):
+        state = self.train_source.get_checkpoint_state()
+        session = { 'samples_seen' : self.samples_seen,
+                'minibatches_seen' : self.minibatches_seen }
+        external_state = {}
+        if isinstance(state, cntk_py.Dictionary):
+            external_state['source'] = state
+        else:
+            session['source'] = state
+        external_state['session'] = json.dumps(session)
+        return external_state
+
+    def _wait_for_checkpoint(self):
+        if self.checkpoint_writer is not None:
+            start = time.time()
+            self.checkpoint_writer.wait()
+            self._measure('checkpoint_wait', start)
+
+    def save_checkpoint(self, wait=True):
+        '''
+        Writes a checkpoint of the trainer, the training source and the
+        progress of the session, see :class:`~cntk.trainer.CheckpointWriter`.
+
+        Args:
+            wait (bool, default True): whether to wait until the checkpoint
+             is written, otherwise only the snapshot is waited for
+        '''
+        if self.checkpoint_writer is None:
+            raise ValueError('the session has no checkpoint_filename')
+
+        start = time.time()
+        self.checkpoint_writer.save(self.trainer, self._external_state())
+        self._measure('checkpoint_wait', start)
+        if wait:
+            self._wait_for_checkpoint()
+
+    def restore_from_checkpoint(self):
+        '''
+        Restores the trainer, the training source and the progress of the
+        session from the newest valid checkpoint.
+
+        Returns:
+            `bool`: whether a checkpoint was restored
+        '''
+        if self.checkpoint_writer is None:
+            raise ValueError('the session has no checkpoint_filename')
+
+        external_state = self.checkpoint_writer.restore(self.trainer)
+        if external_state is None:
+            return False
+
+        session = json.loads(external_state.get_value('session'))
+        if external_state.contains('source'):
+            self.train_source.restore_from_checkpoint(
+                    external_state.get_dictionary('source'))
+        else:
+            self.train_source.restore_from_checkpoint(session['source'])
+        self.samples_seen = session['samples_seen']
+        self.minibatches_seen = session['minibatches_seen']
+        return True
+
+    def cross_validate(self):
+        '''
+        Evaluates the model on all minibatches of ``cv_source``.
+
+        Returns:
+            `float`: the average evaluation criterion per sample, which is
+            also appended as ``(samples seen, average)`` to ``cv_results``
+        '''
+        if self.cv_source is None:
+            raise ValueError('the session has no cv_source')
+
+        start = time.time()
+        if self._cv_initial_state is None:
+            self._cv_initial_state = self.cv_source.get_checkpoint_state()
+        else:
+            self.cv_source.restore_from_checkpoint(self._cv_initial_state)
+
+        total = 0.0
+        num_samples = 0
+        while True:
+            mb = self.cv_source.next_minibatch(self.cv_minibatch_size,
+                    input_map=self.cv_input_map, device=self.device)
+            if not mb:
+                break
+            mb_samples = max(data.num_samples for data in mb.values())
+            total += self.trainer.test_minibatch(mb, device=self.device) * \
+                    mb_samples
+            num_samples += mb_samples
+
+        average = total / num_samples if num_samples else 0.0
+        self.cv_results.append((self.samples_seen, average))
+        self._measure('cross_validation', start)
+        return average
+
+    def train(self):
+        '''
+        Runs the training loop until ``max_samples`` samples have been
+        trained on or the training source is exhausted. A checkpoint is
+        written and the model is evaluated on ``cv_source`` at the end.
+
+        If the session reads ahead from ``train_source``, it stops reading
+        ahead when training ends and rewinds the source to the state after
+        the last minibatch that was trained on, so that the source can be
+        used directly again.
+
+        Returns:
+            :class:`~cntk.utils.Record` with the number of samples and
+            minibatches trained on (``samples_seen``, ``minibatches_seen``),
+            the ``timings`` and the ``cv_results``
+        '''
+        if self.restore and self.checkpoint_writer is not None:
+            self.restore_from_checkpoint()
+
+        def next_due(frequency):
+            if frequency is None:
+                return None
+            return (self.samples_seen // frequency + 1) * frequency
+
+        next_checkpoint = next_due(self.checkpoint_frequency)
+        next_cv = next_due(self.cv_frequency)
+        try:
+            while self.max_samples is None or self.samples_seen < self.max_samples:
+                mb_size = self.minibatch_size
+                if self.max_samples is not None:
+                    mb_size = min(mb_size, self.max_samples - self.samples_seen)
+
+                start = time.time()
+                mb = self.train_source.next_minibatch(mb_size,
+                        input_map=self.input_map, device=self.device)
+                start = self._measure('read', start)
+                if not mb:
+                    break
+
+                self.trainer.train_minibatch(mb, device=self.device)
+                start = self._measure('train', start)
+                self.samples_seen += self.trainer.previous_minibatch_sample_count
+                self.minibatches_seen += 1
+
+                if self.progress_printer is not None:
+                    self.progress_printer.update_with_trainer(self.trainer,
+                            with_metric=True)
+                    self._measure('progress', start)
+
+                if next_checkpoint is not None and self.checkpoint_writer \
+                        is not None and self.samples_seen >= next_checkpoint:
+                    self.save_checkpoint(wait=False)
+                    next_checkpoint = next_due(self.checkpoint_frequency)
+
+                if next_cv is not None and self.samples_seen >= next_cv:
+                    self.cross_validate()
+                    next_cv = next_due(self.cv_frequency)
+
+            if self.checkpoint_writer is not None:
+                self.save_checkpoint()
+            if self.cv_source is not None and (not self.cv_results or
+                    self.cv_results[-1][0] != self.samples_seen):
+                self.cross_validate()
+        finally:
+            if self._prefetcher:
+                self.train_source.close()
+            self._wait_for_checkpoint()
+
+        return Record(samples_seen=self.samples_seen,
+                minibatches_seen=self.minibatches_seen,
+                timings=self.timings, cv_results=list(self.cv_results))
+
+    def timing_summary(self):
+        '''
+        Returns the timings as text with one line per phase.
+        '''
+        timings = self.timings
+        total = sum(timings[phase] for phase in PHASES
+                if phase != 'checkpoint')
+        lines = []
+        for phase in PHASES:
+            seconds = timings[phase]
+            share = 100.0 * seconds / total if total > 0 else 0.0
+            note = ' (background)' if phase == 'checkpoint' else \
+                    ' (%5.1f%%)' % share
+            lines.append('%-16s %10.3fs%s' % (phase, seconds, note))
+        return '\n'.join(lines)
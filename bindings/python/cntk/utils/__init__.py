@@ -7,13 +7,14 @@ import sys
 import numbers
 import collections
 import copy
+import threading
 import numpy as np
 from numbers import Number
 from scipy import sparse
 
 from .. import cntk_py
 from cntk.device import use_default_device, cpu
-from .swig_helper import typemap
+from .swig_helper import typemap, map_if_possible
 from ..axis import Axis
 from .progress_print import *
 
@@ -38,13 +39,22 @@ def sanitize_precision(precision):
 
 
 @typemap
-def one_hot(batch, num_classes, dtype=None, device=None):
+def one_hot(batch, num_classes, dtype=None, device=None,
+        sequence_lengths=None, sequence_offsets=None):
     '''
     Converts ``batch`` into a :class:`Value` object of ``dtype``
     such that the integer data in ``batch`` is interpreted as the indices
     representing one-hot vectors. Additionally, a SciPy CSR matrix can be obtained
     by calling :meth:`~cntk.utils.Value.to_csr`.
 
+    Integer NumPy arrays are converted without going through Python lists if
+    they are either
+
+     * 2-dimensional: every row is a sequence of the same length, or
+     * 1-dimensional, containing the indices of all sequences one after the
+       other, with the sequence boundaries given by ``sequence_lengths`` or
+       ``sequence_offsets``.
+
     Example:
         >>> num_classes = 6
         >>> sparse_indices = [[1,5],[4]]
@@ -55,12 +65,22 @@ def one_hot(batch, num_classes, dtype=None, device=None):
         [array([[ 0.,  1.,  0.,  0.,  0.,  0.],
                [ 0.,  0.,  0.,  0.,  0.,  1.]], dtype=float32), array([[ 0.,  0.,  0.,  0.,  1.,  0.]], dtype=float32)]
 
+        The same batch from a flat index array:
+
+        >>> value = C.one_hot(np.asarray([1, 5, 4], dtype=np.int32), num_classes,
+        ...                   sequence_lengths=[2, 1])
+
     Args:
         batch (NumPy array or list (of lists, if sequence) of index data): batch input data
         num_classes (int): number of classes
         dtype (`np.float32`, `np.float64`, default None): data type
         device (:class:`~cntk.device.DeviceDescriptor`, default None): device
          this value should be put on
+        sequence_lengths (list or NumPy array, default None): the length of
+         every sequence if ``batch`` is a 1-dimensional NumPy array
+        sequence_offsets (list or NumPy array, default None): alternatively
+         to ``sequence_lengths``, the offset of every sequence in ``batch``
+         followed by the length of ``batch``
 
     Returns:
         ``batch`` converted into a :class:`~Value` object that can be passed to
@@ -69,6 +89,19 @@ def one_hot(batch, num_classes, dtype=None, device=None):
     if device is None:
         device = use_default_device()
 
+    has_boundaries = sequence_lengths is not None or sequence_offsets is not None
+    if isinstance(batch, np.ndarray) and np.issubdtype(batch.dtype, np.integer) \
+            and (batch.ndim == 2 and not has_boundaries or
+                 batch.ndim == 1 and has_boundaries):
+        if batch.ndim == 2:
+            sequence_lengths = np.full(batch.shape[0], batch.shape[1], dtype=np.int64)
+        offsets = _sequence_offsets(batch.size, sequence_lengths, sequence_offsets)
+        return _one_hot_from_indices(batch.ravel(), offsets, num_classes,
+                dtype, device)
+    elif has_boundaries:
+        raise ValueError('sequence_lengths and sequence_offsets require a '
+                '1-dimensional integer NumPy array')
+
     if isinstance(batch, np.ndarray):
         batch = batch.tolist()
 
@@ -79,6 +112,123 @@ def one_hot(batch, num_classes, dtype=None, device=None):
     return value
 
 
+def _sequence_offsets(num_samples, sequence_lengths=None, sequence_offsets=None):
+    '''
+    Returns the offsets of the sequences in a batch of ``num_samples``
+    concatenated samples, followed by ``num_samples``, from either the
+    sequence lengths or the offsets.
+    '''
+    if sequence_offsets is not None:
+        if sequence_lengths is not None:
+            raise ValueError('specify either sequence_lengths or '
+                    'sequence_offsets, not both')
+        offsets = np.asarray(sequence_offsets, dtype=np.int64)
+    else:
+        lengths = np.asarray(sequence_lengths, dtype=np.int64)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+    if offsets.ndim != 1 or len(offsets) < 2:
+        raise ValueError('the batch has to contain at least one sequence')
+    if offsets[0] != 0 or offsets[-1] != num_samples:
+        raise ValueError('the sequences cover %i samples, but the batch has '
+                '%i' % (offsets[-1] - offsets[0], num_samples))
+    if np.any(np.diff(offsets) <= 0):
+        raise ValueError('sequences must not be empty')
+
+    return offsets
+
+
+def _sequence_mask(lengths, seq_starts=None):
+    '''
+    Creates the mask for sequences of the given lengths as
+    ``Value::Create`` does, or returns None if no mask is needed.
+    '''
+    max_length = int(lengths.max())
+    if seq_starts is None:
+        starts = np.ones(len(lengths), dtype=bool)
+    else:
+        starts = np.asarray(seq_starts, dtype=bool)
+        if len(starts) != len(lengths):
+            raise ValueError('you have %i sequences, but %i sequence begin '
+                    'markers' % (len(lengths), len(starts)))
+
+    if starts.all() and np.all(lengths == max_length):
+        return None
+
+    mask = cntk_py.NDMask((len(lengths), max_length), cpu())
+    for i in np.flatnonzero(starts):
+        mask.mark_sequence_begin([0, int(i)])
+    for i in np.flatnonzero(lengths < max_length):
+        mask.invalidate_section([int(lengths[i]), int(i)],
+                (1, cntk_py.InferredDimension))
+    return mask
+
+
+def _create_sparse_batch_value(dim, data, indices, indptr, offsets,
+        seq_starts=None, device=None, read_only=False):
+    '''
+    Creates a sparse :class:`Value` from one CSR matrix of shape (number of
+    samples, ``dim``), in which the samples of all sequences are
+    concatenated. ``offsets`` are the sequence offsets as returned by
+    :func:`_sequence_offsets`. The padded batch is laid out in NumPy and
+    transferred to the device at once.
+    '''
+    if device is None:
+        device = use_default_device()
+
+    lengths = np.diff(offsets)
+    num_sequences = len(lengths)
+    max_length = int(lengths.max())
+
+    indptr = np.asarray(indptr)
+    # a CSR matrix can have spare capacity behind its nonzeros, while the
+    # NDArrayView takes the number of nonzeros from the size of the arrays
+    nnz = int(indptr[-1])
+    data = data[:nnz]
+    indices = indices[:nnz]
+    if np.any(lengths != max_length):
+        # move the samples to their slots in the padded batch, the padding
+        # samples get no entries
+        nnz_per_sample = np.diff(indptr)
+        sequence_of_sample = np.repeat(np.arange(num_sequences), lengths)
+        slots = np.arange(len(nnz_per_sample)) + \
+                sequence_of_sample * max_length - offsets[sequence_of_sample]
+        nnz_per_slot = np.zeros(num_sequences * max_length, dtype=np.int64)
+        nnz_per_slot[slots] = nnz_per_sample
+        indptr = np.zeros(len(nnz_per_slot) + 1, dtype=np.int64)
+        np.cumsum(nnz_per_slot, out=indptr[1:])
+
+    ndav = cntk_py.NDArrayView((num_sequences, max_length, dim),
+            np.ascontiguousarray(data),
+            np.ascontiguousarray(indptr, dtype=np.int32),
+            np.ascontiguousarray(indices, dtype=np.int32),
+            device, read_only)
+
+    mask = _sequence_mask(lengths, seq_starts)
+    if mask is None:
+        value = cntk_py.Value(ndav)
+    else:
+        value = cntk_py.Value(ndav, mask)
+    if read_only:
+        value = value.alias(True)
+    return value
+
+
+def _one_hot_from_indices(indices, offsets, num_classes, dtype, device):
+    '''
+    Creates the one-hot :class:`Value` for a flat array of class indices.
+    '''
+    if len(indices) and (indices.min() < 0 or indices.max() >= num_classes):
+        raise ValueError('one-hot data exceeds the number of classes (%i)'
+                % num_classes)
+
+    dtype = np.float32 if dtype is None else sanitize_dtype_numpy(dtype)
+    return _create_sparse_batch_value(num_classes,
+            np.ones(len(indices), dtype=dtype), indices,
+            np.arange(len(indices) + 1), offsets, device=device)
+
+
 def sanitize_shape(shape):
     """
     If shape is scalar, it creates a tuple out of it.
@@ -136,12 +286,47 @@ def sanitize_input(arg, fallback_dtype=np.float32, reshape=None):
     return constant(value=arg)
 
 
+_CNTK_TO_NUMPY_TYPE = {
+        cntk_py.DataType_Float: np.float32,
+        cntk_py.DataType_Double: np.float64
+        }
+
+def _memoized_data_type(arg):
+    '''
+    Returns the NumPy type of a CNTK Variable, Value, NDArrayView or
+    Function, or None if it is not known yet. Known types do not change
+    anymore, so they are stored in the instance and not queried from the
+    core again when the same object is passed in again.
+    '''
+    instance_dict = getattr(arg, '__dict__', None)
+    if instance_dict is not None:
+        dtype = instance_dict.get('_data_type')
+        if dtype is not None:
+            return dtype
+
+    if isinstance(arg, cntk_py.Function):
+        var_outputs = arg.outputs
+        if len(var_outputs) > 1:
+            raise ValueError(
+                'expected single output, but got %i' % len(var_outputs))
+        dtype = _CNTK_TO_NUMPY_TYPE.get(var_outputs[0].get_data_type())
+    else:
+        dtype = _CNTK_TO_NUMPY_TYPE.get(arg.get_data_type())
+
+    if dtype is not None and instance_dict is not None:
+        instance_dict['_data_type'] = dtype
+    return dtype
+
 def get_data_type(*args):
     """
     Calculates the highest precision numpy data type of the provided parameters.
     If the parameter is a Function instance, it calculates it based on its
     inputs. Placeholders are ignored in the type determination.
 
+    Numbers and lists are not converted to learn their type, they count as
+    `np.float32`; converting them is left to :func:`sanitize_input`, so that
+    they are converted only once.
+
     Args:
         args (number, list, NumPy array, :class:`~cntk.ops.variables.Variable`, or :class:`~cntk.ops.functions.Function`): input
 
@@ -160,31 +345,18 @@ def get_data_type(*args):
             continue
         if isinstance(arg,
                       (cntk_py.Variable, cntk_py.Value, cntk_py.NDArrayView)):
-            if cntk_py.DataType_Double == arg.get_data_type():
-                cntk_dtypes.add(np.float64)
-            elif cntk_py.DataType_Float == arg.get_data_type():
-                cntk_dtypes.add(np.float32)
+            dtype = _memoized_data_type(arg)
+            if dtype is not None:
+                cntk_dtypes.add(dtype)
         elif isinstance(arg, np.ndarray):
             if arg.dtype not in (np.float32, np.float64):
                 raise ValueError(
                     'NumPy type "%s" is not supported' % arg.dtype)
             numpy_dtypes.add(arg.dtype.type)
         elif isinstance(arg, cntk_py.Function):
-            var_outputs = arg.outputs
-            if len(var_outputs) > 1:
-                raise ValueError(
-                    'expected single output, but got %i' % len(var_outputs))
-
-            var_type = var_outputs[0].get_data_type()
-            if cntk_py.DataType_Double == var_type:
-                cntk_dtypes.add(np.float64)
-            else:
-                cntk_dtypes.add(np.float32)
+            # outputs of unknown type count as float32
+            cntk_dtypes.add(_memoized_data_type(arg) or np.float32)
         else:
-            # We don't know anything so we convert everything to float32. If it
-            # works, we know the type.
-            # TODO figure out a better/faster way.
-            np.asarray(arg, dtype=np.float32)
             numpy_dtypes.add(np.float32)
 
     if cntk_dtypes:
@@ -221,7 +393,7 @@ def _is_c_contiguous(data):
     return data.flags.c_contiguous
 
 @typemap
-def sanitize_batch(var, batch, seq_starts=None, device=None):
+def sanitize_batch(var, batch, seq_starts=None, device=None, buffer_pool=None):
     '''
     Convert to :class:`Value`.
 
@@ -239,6 +411,8 @@ def sanitize_batch(var, batch, seq_starts=None, device=None):
          in the same slot of the previous minibatch (`False`)
         device (:class:`~cntk.device.DeviceDescriptor`, default None): device
          this value should be put on
+        buffer_pool (:class:`ValueBufferPool`, default None): pool whose
+         memory is reused for dense batches
 
     Returns:
         :class:`Value`: converted batch that can be passed to the core API
@@ -256,6 +430,11 @@ def sanitize_batch(var, batch, seq_starts=None, device=None):
     if device is None:
         device = use_default_device()
 
+    if buffer_pool is not None:
+        value = buffer_pool.value(var, batch, seq_starts, device)
+        if value is not None:
+            return value
+
     return Value.create(var, batch, seq_starts, device)
 
 
@@ -309,8 +488,71 @@ def sanitize_function(arg):
     return arg
 
 
+class _ArgumentBindingPlan(object):
+    '''
+    The resolution of argument names to the variables of a function, which
+    :func:`sanitize_var_map` would otherwise recompute on every call.
+
+    Args:
+        op_arguments (list): the variables that can be bound
+    '''
+    def __init__(self, op_arguments):
+        self.arguments = list(op_arguments)
+        self.var_name_map = dict((var.name, var) for var in self.arguments)
+        name_counter = collections.Counter(var.name for var in self.arguments)
+        self.ambiguous_names = frozenset(name for name, count in
+                name_counter.items() if count > 1)
+
+    def __len__(self):
+        return len(self.arguments)
+
+    def resolve(self, name):
+        '''
+        Returns the variable with the given name.
+        '''
+        try:
+            var = self.var_name_map[name]
+        except KeyError:
+            raise ValueError('variable with name "%s" does not exist in the network. Available variable names: %s' % (
+                name, ", ".join(self.var_name_map)))
+        if name in self.ambiguous_names:
+            raise ValueError('node name "%s" is not unique' % name)
+        return var
+
+# attribute of a function instance that holds its argument binding plan
+_BINDING_PLAN_ATTRIBUTE = '_argument_binding_plan'
+
+def _binding_plan(op_arguments):
+    '''
+    Returns the :class:`_ArgumentBindingPlan` for a list of variables or for
+    the arguments of a function. The plan of a function is cached on the
+    function instance until its graph changes, see
+    :func:`_clear_binding_plan`. It is not shared by uid, as loaded and
+    rebuilt graphs reuse the uids of other graphs.
+    '''
+    if not isinstance(op_arguments, cntk_py.Function):
+        return _ArgumentBindingPlan(op_arguments)
+
+    # __dict__ is used directly, as Function.__getattr__ relays unknown
+    # attributes to the output of the function
+    plan = op_arguments.__dict__.get(_BINDING_PLAN_ATTRIBUTE)
+    if plan is None:
+        arguments = cntk_py.Function.arguments(op_arguments)
+        map_if_possible(arguments)
+        plan = _ArgumentBindingPlan(arguments)
+        op_arguments.__dict__[_BINDING_PLAN_ATTRIBUTE] = plan
+    return plan
+
+def _clear_binding_plan(function):
+    '''
+    Discards the cached argument binding plan of ``function``. This has to
+    be called whenever its graph is changed in place, as its arguments may
+    change.
+    '''
+    function.__dict__.pop(_BINDING_PLAN_ATTRIBUTE, None)
+
 def sanitize_var_map(op_arguments, arguments, precision=None,
-                     device=None):
+                     device=None, buffer_pool=None):
     '''
     Sanitizes a dictionary of `Variable` s to input data such that it can be
     handed off to the evaluation methods
@@ -319,10 +561,11 @@ def sanitize_var_map(op_arguments, arguments, precision=None,
     :meth:`~cntk.Trainer.test_minibatch`).
 
     Args:
-        op_arguments (:class:`~cntk.ops.functions.Function`): arguments of the root function. In
-         :meth:`~cntk.ops.functions.Function.forward` pass it is typically
-         `op.arguments`, in :meth:`~cntk.ops.functions.Function.backward` pass it is
-         `op.outputs`
+        op_arguments (:class:`~cntk.ops.functions.Function` or list): the
+         function whose arguments are bound, or the list of variables to bind.
+         In :meth:`~cntk.ops.functions.Function.forward` pass it is typically
+         `op`, in :meth:`~cntk.ops.functions.Function.backward` pass it is
+         `op.outputs`. The name resolution for functions is cached.
         arguments: maps variables to their input data. The interpretation depends on
          the input type:
 
@@ -356,6 +599,8 @@ def sanitize_var_map(op_arguments, arguments, precision=None,
          one of 'float' 'float32, 'double', 'float64', or None
         device (:class:`~cntk.device.DeviceDescriptor`, default None): device
          this value should be put on
+        buffer_pool (:class:`ValueBufferPool`, default None): pool whose
+         memory is reused for dense batches
 
     Returns:
         `dict` that maps variables to sanitized batches
@@ -367,26 +612,21 @@ def sanitize_var_map(op_arguments, arguments, precision=None,
     else:
         seq_starts = None
 
+    plan = _binding_plan(op_arguments)
+
     if arguments is None or isinstance(arguments, (dict, list)) and len(arguments) == 0:
-        if len(op_arguments) > 0:
+        if len(plan) > 0:
             raise ValueError('function expects %i arguments' %
-                             len(op_arguments))
+                             len(plan))
         return {}
 
-    if len(arguments) < len(op_arguments):
+    if len(arguments) < len(plan):
         raise ValueError('your graph has %i inputs, but you specified %i' %
-                        (len(op_arguments), len(arguments)))
+                        (len(plan), len(arguments)))
 
-    if isinstance(arguments, dict):
-        arg_names = [var.name for var in op_arguments]
-        name_counter = collections.Counter(arg_names)
-
-        var_name_map = dict((var.name, var) for var in op_arguments)
-    else:
-        if len(op_arguments) == 1:
-            name_counter = collections.Counter([op_arguments[0].name])
-            var_name_map = dict([(op_arguments[0].name, op_arguments[0])])
-            arguments = dict([(op_arguments[0], arguments)])
+    if not isinstance(arguments, dict):
+        if len(plan) == 1:
+            arguments = dict([(plan.arguments[0], arguments)])
         else:
             raise ValueError('non-dict argument (%s) is not supported for nodes with more than one input' % type(arguments).__name__)
 
@@ -396,17 +636,7 @@ def sanitize_var_map(op_arguments, arguments, precision=None,
     var_map = {}
     for var, batch in arguments.items():
         if isinstance(var, str):
-            if name_counter[var] == 0:
-                raise ValueError('variable with name "%s" does not exist in the network. Available variable names: %s' % (
-                    var, ", ".join(var_name_map)))
-            elif name_counter[var] > 1:
-                raise ValueError('node name "%s" is not unique' % var)
-
-            try:
-                var = var_name_map[var]
-            except KeyError:
-                raise KeyError("no input with the name '%s' was found.  Available: %s" % (
-                    var, ", ".join(var_name_map.keys())))
+            var = plan.resolve(var)
 
         if isinstance(batch, tuple):
             if seq_starts is not None:
@@ -431,7 +661,7 @@ def sanitize_var_map(op_arguments, arguments, precision=None,
         if isinstance(batch, MinibatchData):
             batch = batch.m_data
         elif not isinstance(batch, cntk_py.Value):
-            batch = sanitize_batch(var, batch, seq_starts, device)
+            batch = sanitize_batch(var, batch, seq_starts, device, buffer_pool)
 
         var_map[var] = batch
 
@@ -518,6 +748,9 @@ class Value(cntk_py.Value):
             batch: batch input. 
              It can be:
               * a single NumPy array denoting the full minibatch
+              * a single SciPy sparse CSR matrix, in which every row is a
+                sequence of one sample (see :meth:`create_from_csr` for
+                longer sequences)
               * a list of NumPy arrays or SciPy sparse CSR matrices
             seq_starts (list of `bool`s or None): if None, every sequence is
              treated as a new sequence. Otherwise, it is interpreted as a list of
@@ -531,6 +764,10 @@ class Value(cntk_py.Value):
         Returns:
             :class:`Value` object.
         '''
+        if sparse.issparse(batch):
+            return Value.create_from_csr(var, batch,
+                    np.arange(batch.shape[0] + 1), seq_starts, device, read_only)
+
         if isinstance(batch, np.ndarray):
             # The outermost axis has to be Python list. If the user passes a
             # full minibatch as one NumPy array, we have to convert it.
@@ -539,7 +776,10 @@ class Value(cntk_py.Value):
                         'of sequences, you need to pass them as a pure-Python list '
                         'of NumPy arrays')
 
-            # FIXME if not seq_starts: directly pass it to Value constructor
+            value = Value._create_from_dense_batch(var, batch, seq_starts,
+                    device, read_only)
+            if value is not None:
+                return value
 
             batch = list(batch)
 
@@ -548,14 +788,15 @@ class Value(cntk_py.Value):
                     'SciPy CSR matrices')
 
         list_of_ndavs = []
+        dtype = var.dtype
 
         # NDArrayViews are all created on CPU. The Value object later then will
         # move it to the requested device.
         cpu_dev = cpu()
         for sample in batch:
             if isinstance(sample, list):
-                sample = np.asarray(sample, dtype=var.dtype)
-                if sample.dtype != var.dtype:
+                sample = np.asarray(sample, dtype=dtype)
+                if sample.dtype != dtype:
                     raise ValueError('could not convert sample data to '
                             'NumPy array')
 
@@ -565,12 +806,12 @@ class Value(cntk_py.Value):
                         'or Scipy CSR matrices.'%type(sample))
 
             if np.issubdtype(sample.dtype, int):
-                sample = sample.astype(var.dtype)
+                sample = sample.astype(dtype)
             elif sample.dtype not in (np.float32, np.float64):
                 raise ValueError('only integer, float32 and float64 are supported, '
                         'you gave %s'%sample.dtype)
             else:
-                sample = sample.astype(var.dtype)
+                sample = sample.astype(dtype)
 
             if isinstance(sample, np.ndarray):
                 if not _is_c_contiguous(sample):
@@ -595,6 +836,118 @@ class Value(cntk_py.Value):
                 read_only)
 
 
+    @staticmethod
+    @typemap
+    def create_from_csr(var, batch, sequence_offsets, seq_starts=None,
+            device=None, read_only=False):
+        '''
+        Creates a sparse :class:`Value` object from one SciPy CSR matrix that
+        holds the samples of all sequences one after the other. In contrast
+        to passing a list of CSR matrices to :meth:`create`, the sequences
+        are not sliced, and the whole batch is transferred to the device at
+        once.
+
+        Example:
+            >>> from scipy.sparse import csr_matrix
+            >>> x = C.input_variable(4, is_sparse=True)
+            >>> data = csr_matrix(np.eye(4, dtype=np.float32)[[0, 2, 3]])
+            >>> value = Value.create_from_csr(x, data, sequence_offsets=[0, 2, 3])
+
+        Args:
+            var (:class:`~cntk.ops.variables.Variable`): input variable into
+             which ``batch`` is passed; its shape has to be 1-dimensional
+            batch (`scipy.sparse.csr_matrix`): the samples of all sequences,
+             one per row
+            sequence_offsets (list or NumPy array): the row at which every
+             sequence starts, followed by the number of rows of ``batch``
+            seq_starts (list of `bool`s or None): if None, every sequence is
+             treated as a new sequence. Otherwise, it is interpreted as a list of
+             Booleans that tell whether a sequence is a new sequence (`True`) or a
+             continuation of the sequence in the same slot of the previous
+             minibatch (`False`)
+            device (:class:`~cntk.device.DeviceDescriptor`, default None): device
+             this value should be put on
+            read_only (bool, default False): whether the data is read only
+
+        Returns:
+            :class:`Value` object.
+        '''
+        if not sparse.isspmatrix_csr(batch):
+            raise ValueError("only CSR is supported as of now. Please "
+                    "convert your data using 'tocsr()'")
+
+        shape = _as_tuple(var.shape)
+        if len(shape) != 1 or batch.shape[1] != shape[0]:
+            raise ValueError('a CSR matrix with %i columns does not match '
+                    'the shape %s of the variable' % (batch.shape[1], shape))
+
+        dtype = var.dtype
+        if np.issubdtype(batch.dtype, np.integer):
+            batch = batch.astype(dtype)
+        elif batch.dtype not in (np.float32, np.float64):
+            raise ValueError('only integer, float32 and float64 are supported, '
+                    'you gave %s' % batch.dtype)
+        elif batch.dtype != dtype:
+            batch = batch.astype(dtype)
+
+        if not batch.has_sorted_indices:
+            batch = batch.sorted_indices()
+
+        offsets = _sequence_offsets(batch.shape[0],
+                sequence_offsets=sequence_offsets)
+        return _create_sparse_batch_value(shape[0], batch.data, batch.indices,
+                batch.indptr, offsets, seq_starts, device, read_only)
+
+    @staticmethod
+    def _dense_batch(var, batch, seq_starts):
+        '''
+        Brings a full minibatch in one NumPy array of shape (batch size,
+        sample shape) or (batch size, sequence length, sample shape) into the
+        C-contiguous layout (batch size, sequence length, sample shape) with
+        the type of ``var``. Returns None if the batch needs the general
+        path: for sparse inputs, for sequences that continue previous ones,
+        or if the data is not C contiguous.
+        '''
+        if var.is_sparse or len(batch) == 0 or \
+                (seq_starts and not all(seq_starts)):
+            return None
+
+        shape = _as_tuple(var.shape)
+        if batch.shape[1:] == shape:
+            # every sample is a sequence of length 1
+            batch = batch.reshape((batch.shape[0], 1) + shape)
+        elif batch.ndim < 2 or batch.shape[2:] != shape:
+            return None
+
+        dtype = var.dtype
+        if batch.dtype != dtype:
+            if not (np.issubdtype(batch.dtype, np.integer) or
+                    batch.dtype in (np.float32, np.float64)):
+                return None
+            batch = batch.astype(dtype)
+
+        if not batch.flags.c_contiguous:
+            return None
+
+        return batch
+
+    @staticmethod
+    def _create_from_dense_batch(var, batch, seq_starts, device, read_only):
+        '''
+        Creates the value for a full minibatch in one NumPy array (see
+        :meth:`_dense_batch`) as a single NDArrayView, which is copied to the
+        device at once. Returns None if the batch needs the general path.
+        '''
+        batch = Value._dense_batch(var, batch, seq_starts)
+        if batch is None:
+            return None
+
+        ndav = cntk_py.NDArrayView(batch, device or use_default_device(), False)
+        value = cntk_py.Value(ndav)
+        if read_only:
+            value = value.alias(True)
+        return value
+
     @property
     def shape(self):
         '''
@@ -623,6 +976,15 @@ class Value(cntk_py.Value):
         '''
         return np.asarray(super(Value, self).mask())
 
+    def as_padded_array(self):
+        '''
+        The data of this value as one padded NumPy array together with its
+        mask and sequence lengths, see :func:`value_to_padded_array`.
+
+        Returns:
+            :class:`PaddedArray`
+        '''
+        return value_to_padded_array(self)
 
     def __len__(self):
         '''
@@ -630,6 +992,113 @@ class Value(cntk_py.Value):
         '''
         return self.shape[0]
 
+class ValueBufferPool(object):
+    '''
+    Keeps the device memory of dense input values alive across minibatches.
+    When a minibatch has the same variable, shape and type as a previous one,
+    its data is copied into the memory allocated for that one instead of
+    allocating new memory. This avoids the allocations in training and
+    evaluation loops with fixed minibatch shapes.
+
+    Pass the pool to :meth:`~cntk.trainer.Trainer.train_minibatch`,
+    :meth:`~cntk.trainer.Trainer.test_minibatch` or
+    :meth:`~cntk.ops.functions.Function.forward` as ``buffer_pool``. Only
+    full minibatches in one NumPy array that do not continue sequences of
+    previous minibatches are pooled, all other data is converted as usual.
+
+    A value handed out by the pool is overwritten when the next minibatch of
+    the same kind is converted. Hence, state returned by
+    :meth:`~cntk.ops.functions.Function.forward` for a later
+    :meth:`~cntk.ops.functions.Function.backward` is only valid until the
+    next ``forward`` call that uses the same pool. For the same reason, a
+    pool can only be used by one thread, the one that uses it first; other
+    threads need pools of their own.
+
+    Example:
+        >>> pool = ValueBufferPool()
+        >>> x = C.input_variable(2)
+        >>> f = C.plus(x, 1)
+        >>> for i in range(3):
+        ...     _, out = f.forward({x: np.full((4, 2), i, np.float32)},
+        ...                        f.outputs, buffer_pool=pool)
+        >>> len(pool)
+        1
+
+    Args:
+        max_size (int, default 16): maximum number of buffers kept; the least
+         recently used ones are released first
+    '''
+    def __init__(self, max_size=16):
+        self.max_size = max_size
+        self._buffers = collections.OrderedDict()
+        self._owner = None
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def _check_owner(self):
+        owner = threading.current_thread()
+        if self._owner is None:
+            self._owner = owner
+        elif self._owner is not owner:
+            raise RuntimeError('a ValueBufferPool can only be used by one '
+                    'thread, it is used by %s' % self._owner.name)
+
+    def value(self, var, batch, seq_starts=None, device=None, read_only=False):
+        '''
+        Returns a :class:`Value` with the data of ``batch``, reusing the
+        memory of an earlier value with the same variable, shape and type.
+
+        Args:
+            var (:class:`~cntk.ops.variables.Variable`): input variable into
+             which ``batch`` is passed
+            batch (NumPy array): the full minibatch
+            seq_starts (list of `bool`s or None): sequence start markers, see
+             :meth:`Value.create`
+            device (:class:`~cntk.device.DeviceDescriptor`, default None):
+             device the value should be put on
+            read_only (bool, default False): whether to return a read-only
+             alias of the pooled value
+
+        Returns:
+            :class:`Value`, or None if ``batch`` cannot be pooled
+        '''
+        if not isinstance(batch, np.ndarray):
+            return None
+        batch = Value._dense_batch(var, batch, seq_starts)
+        if batch is None:
+            return None
+
+        self._check_owner()
+        if device is None:
+            device = use_default_device()
+        # keyed by the variable itself, as uids are not unique across graphs
+        key = (var, batch.shape, batch.dtype.str, device.type(), device.id())
+
+        entry = self._buffers.pop(key, None)
+        if entry is None:
+            ndav = cntk_py.NDArrayView(batch, device, False)
+            entry = (ndav, cntk_py.Value(ndav))
+            self._buffers[key] = entry
+            while len(self._buffers) > self.max_size:
+                self._buffers.popitem(last=False)
+        else:
+            # mark as most recently used
+            self._buffers[key] = entry
+            entry[0].copy_from_ndarray(batch)
+
+        value = entry[1].alias(True) if read_only else entry[1]
+        map_if_possible(value)
+        return value
+
+    def clear(self):
+        '''
+        Releases all buffers.
+        '''
+        self._check_owner()
+        self._buffers.clear()
+
+
 def sanitize_dtype_numpy(dtype):
     is_type = isinstance(dtype, type) or isinstance(dtype, np.dtype)
     is_str = isinstance(dtype, str)
@@ -719,26 +1188,114 @@ def get_train_eval_criterion(trainer):
     return copy.copy(trainer.previous_minibatch_evaluation_average)
 
 
-def value_to_seq(value):
+class PaddedArray(collections.namedtuple('PaddedArray', ['data', 'mask', 'lengths'])):
     '''
-    Convert a Value to a sequence of NumPy arrays that have their masked
-    entries removed.
+    The data of a :class:`Value` as one padded NumPy array together with its
+    mask and the lengths of its sequences. In contrast to
+    :func:`value_to_seq`, the masked entries are not removed up front, so
+    that code that can work on the padded layout does not pay for splitting
+    the batch. The sequences are views into ``data`` and are only created
+    when requested.
+
+    Attributes:
+        data (NumPy array): the data of shape (number of sequences, maximum
+         sequence length, ...)
+        mask (NumPy array or None): the mask of shape (number of sequences,
+         maximum sequence length) as described in :attr:`Value.mask`, or None
+         if all sequences have the maximum length
+        lengths (NumPy array): the number of valid elements in every sequence
+    '''
+    # no __slots__, so that the result of _is_padded_at_end() can be kept
+
+    def _is_padded_at_end(self):
+        try:
+            return self._padded_at_end
+        except AttributeError:
+            valid = self.mask != cntk_py.MaskKind_Invalid
+            self._padded_at_end = np.array_equal(valid,
+                    np.arange(valid.shape[1]) < self.lengths[:, np.newaxis])
+            return self._padded_at_end
+
+    def sequence(self, index):
+        '''
+        Returns the valid elements of sequence ``index``.
+
+        Args:
+            index (int): index of the sequence
+
+        Returns:
+            NumPy array, which is a view into :attr:`data` unless the mask
+            has invalid elements in between valid ones
+        '''
+        if self.mask is None:
+            return self.data[index]
+        if self._is_padded_at_end():
+            return self.data[index, :self.lengths[index]]
+        return self.data[index][self.mask[index] != cntk_py.MaskKind_Invalid]
+
+    def sequences(self):
+        '''
+        Returns the sequences with their masked entries removed, as
+        :func:`value_to_seq` does.
+
+        Returns:
+            a list of NumPy arrays, or :attr:`data` itself if nothing is
+            masked
+        '''
+        if self.mask is None:
+            return self.data
+        if self._is_padded_at_end():
+            return [seq[:length] for seq, length in zip(self.data, self.lengths)]
+        return [seq[mask != cntk_py.MaskKind_Invalid]
+                for seq, mask in zip(self.data, self.mask)]
+
+    def copy(self):
+        '''
+        Returns a :class:`PaddedArray` with copies of the arrays.
+        '''
+        return PaddedArray(self.data.copy(),
+                None if self.mask is None else self.mask.copy(),
+                self.lengths.copy())
+
+
+def value_to_padded_array(value):
+    '''
+    Converts a Value to one padded NumPy array plus its mask and sequence
+    lengths. The data is copied to the CPU exactly once, the masked entries
+    are not removed.
 
     Args:
         value (:class:`Value`): Value as it is returned by Swig
 
     Returns:
-        a list of NumPy arrays
+        :class:`PaddedArray`
     '''
-
     np_data = np.asarray(value)
-    mask = value.mask()
+    # Value overrides mask as a property, so call the Swig method directly
+    mask = cntk_py.Value.mask(value)
     if mask:
         mask = np.asarray(mask)
-        np_data = [seq[mask[idx] != cntk_py.MaskKind_Invalid]
-                   for idx, seq in enumerate(np_data)]
+        lengths = np.count_nonzero(mask != cntk_py.MaskKind_Invalid, axis=1)
+    else:
+        mask = None
+        max_length = np_data.shape[1] if np_data.ndim > 1 else 1
+        lengths = np.full(len(np_data), max_length, dtype=np.intp)
+
+    return PaddedArray(np_data, mask, lengths)
+
+
+def value_to_seq(value):
+    '''
+    Convert a Value to a sequence of NumPy arrays that have their masked
+    entries removed.
+
+    Args:
+        value (:class:`Value`): Value as it is returned by Swig
 
-    return np_data
+    Returns:
+        a list of NumPy arrays
+    '''
+    return value_to_padded_array(value).sequences()
 
 
 def eval(op, arguments=None, precision=None, device=None, backward_pass=False, expected_backward=None):
@@ -6,6 +6,7 @@
 from __future__ import print_function
 import time
 import sys
+import weakref
 
 # TODO: Let's switch to import logging in the future instead of print. [ebarsoum]
 class ProgressPrinter(object):
@@ -16,6 +17,17 @@ class ProgressPrinter(object):
     It provides the number of samples, average loss and average metric
     since the last print or since the start of accumulation.
 
+    With :meth:`update_with_trainer`, the loss and metric are not read after
+    every minibatch, which would wait for the minibatch to be computed.
+    They are summed up on the device by the trainer and only read when a
+    line is printed or the accumulators are read. Reading them resets the
+    sums of the trainer, so only one printer can read them: a printer that
+    is updated with a trainer that another printer reads from reads the
+    loss and metric of every minibatch instead. Other calls of
+    :meth:`~cntk.trainer.Trainer.summarize_training_progress` while the
+    trainer is used with a printer take their minibatches away from the
+    printer.
+
     Args:
         freq (int or None, default None):  determines how often
          printing will occur. The value of 0 means an geometric
@@ -52,6 +64,11 @@ class ProgressPrinter(object):
         self.gen_heartbeat = gen_heartbeat
         self.num_epochs =  num_epochs
 
+        # minibatches of update_with_trainer() not yet read from the trainer
+        self._trainer = None
+        self._pending_updates = 0
+        self._pending_with_metric = False
+
         self.logfilename = None
         if self.log_to_file != None:
             self.logfilename = self.log_to_file
@@ -83,24 +100,28 @@ class ProgressPrinter(object):
         '''
         Returns: the average loss since the start of accumulation
         '''
+        self._read_trainer_progress()
         return self.loss_since_start/self.samples_since_start
 
     def avg_metric_since_start(self):
         '''
         Returns: the average metric since the start of accumulation
         '''
+        self._read_trainer_progress()
         return self.metric_since_start/self.samples_since_start
 
     def avg_loss_since_last(self):
         '''
         Returns: the average loss since the last print
         '''
+        self._read_trainer_progress()
         return self.loss_since_last/self.samples_since_last
 
     def avg_metric_since_last(self):
         '''
         Returns: the average metric since the last print
         '''
+        self._read_trainer_progress()
         return self.metric_since_last/self.samples_since_last
 
     def reset_start(self):
@@ -109,6 +130,7 @@ class ProgressPrinter(object):
 
         Returns: tuple of (average loss since start, average metric since start, samples since start)
         '''
+        self._read_trainer_progress()
         ret = self.avg_loss_since_start(), self.avg_metric_since_start(), self.samples_since_start
         self.loss_since_start    = 0
         self.metric_since_start  = 0
@@ -121,6 +143,7 @@ class ProgressPrinter(object):
 
         Returns: tuple of (average loss since last, average metric since last, samples since last)
         '''
+        self._read_trainer_progress()
         ret = self.avg_loss_since_last(), self.avg_metric_since_last(), self.samples_since_last
         self.loss_since_last    = 0
         self.metric_since_last  = 0
@@ -144,6 +167,7 @@ class ProgressPrinter(object):
         Args:
             with_metric (`bool`): if `False` it only prints the loss, otherwise it prints both the loss and the metric
         '''
+        self._read_trainer_progress()
         self.epochs += 1
         if self.freq > 0:
             self.updates = 0
@@ -179,6 +203,7 @@ class ProgressPrinter(object):
             metric (`float` or `None`): if `None` do not update the metric
              accumulators, otherwise update with the given value
         '''
+        self._read_trainer_progress()
         self.updates             += 1
         self.samples_since_start += minibatch_size
         self.samples_since_last  += minibatch_size
@@ -225,17 +250,83 @@ class ProgressPrinter(object):
         Updates the accumulators using the loss, the minibatch_size and optionally the metric
         using the information from the ``trainer``.
 
+        Call it after every minibatch trained with the ``trainer``. The loss
+        and metric are read from the trainer with
+        :meth:`~cntk.trainer.Trainer.summarize_training_progress` only when
+        a line is due to be printed, for all minibatches since the last
+        read at once.
+
         Args:
             trainer (:class:`cntk.trainer.Trainer`): trainer from which information is gathered
             with_metric (`bool`): whether to update the metric accumulators
         '''
         if trainer.previous_minibatch_sample_count == 0:
             return
+
+        if trainer is not self._trainer:
+            self._read_trainer_progress()
+            if not hasattr(trainer, 'summarize_training_progress') or \
+                    not self._claim(trainer):
+                self._update_from_previous_minibatch(trainer, with_metric)
+                return
+
+            # the sums of the trainer may include minibatches from before
+            # this printer was used: take this minibatch from the trainer
+            # and start the sums afresh
+            self._update_from_previous_minibatch(trainer, with_metric)
+            trainer.summarize_training_progress()
+            self._trainer = trainer
+            return
+
+        self._pending_updates += 1
+        self._pending_with_metric = with_metric
+        if self.epoch_start_time == 0:
+            self.epoch_start_time = time.time()
+        self.___gererate_progress_heartbeat()
+
+        if self._is_print_due(self.updates + self._pending_updates):
+            self._read_trainer_progress()
+
+    def _claim(self, trainer):
+        '''
+        Makes this printer the one that reads the progress sums of
+        ``trainer``, unless another printer does. Returns whether it does.
+        '''
+        reader = getattr(trainer, '_progress_reader', None)
+        if reader is not None and reader() not in (None, self):
+            return False
+
+        if self._trainer is not None:
+            self._trainer._progress_reader = None
+        trainer._progress_reader = weakref.ref(self)
+        return True
+
+    def _update_from_previous_minibatch(self, trainer, with_metric):
         self.update(
             trainer.previous_minibatch_loss_average,
-            trainer.previous_minibatch_sample_count, 
+            trainer.previous_minibatch_sample_count,
             trainer.previous_minibatch_evaluation_average if with_metric else None)
 
+    def _is_print_due(self, updates):
+        if self.freq == 0:
+            return (updates+1) & updates == 0
+        return self.freq > 0 and (updates % self.freq == 0 or updates <= self.first)
+
+    def _read_trainer_progress(self):
+        '''
+        Updates the accumulators with the minibatches of
+        :meth:`update_with_trainer` that have not been read from the trainer
+        yet, as if they had been one minibatch.
+        '''
+        if self._pending_updates == 0:
+            return
+
+        progress = self._trainer.summarize_training_progress()
+        self.updates += self._pending_updates - 1
+        self._pending_updates = 0
+        self.update(progress.loss_average, progress.samples,
+                progress.evaluation_average if self._pending_with_metric else None)
+
         
 # print the total number of parameters to log
 def log_number_of_parameters(model, trace_level=0):
@@ -0,0 +1,86 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+import re
+import numpy as np
+import pytest
+
+from cntk import input_variable, parameter, times, \
+        cross_entropy_with_softmax, classification_error
+from cntk.learner import sgd, learning_rate_schedule, UnitType
+from cntk.trainer import Trainer
+from cntk.utils import ProgressPrinter
+
+_NUMBER = re.compile(r'[-+]?\d+\.?\d*(?:[eE][-+]?\d+)?')
+
+def _classifier_trainer():
+    in1 = input_variable(shape=(2,))
+    labels = input_variable(shape=(2,))
+    p = parameter(shape=(2, 2), init=np.asarray([[1, 2], [3, 4]],
+        dtype=np.float32) * 0.1)
+    z = times(in1, p)
+    ce = cross_entropy_with_softmax(z, labels)
+    errs = classification_error(z, labels)
+    trainer = Trainer(z, ce, errs,
+            [sgd(z.parameters, learning_rate_schedule(0.1, UnitType.sample))])
+    return trainer, in1, labels
+
+_TIMING = re.compile(r' [\d.]+s \(.*samples per second\)$')
+
+def _read_log(filename):
+    '''
+    Returns the lines of a log without the first one, which is the file
+    name, and without the timings of the epoch summaries.
+    '''
+    with open(filename) as f:
+        return [_TIMING.sub('', line) for line in f.read().splitlines()[1:]]
+
+def _assert_same_log(lines, expected):
+    '''
+    Compares log lines, allowing for the rounding differences of the sums
+    of the trainer.
+    '''
+    assert len(lines) == len(expected)
+    for line, expected_line in zip(lines, expected):
+        assert _NUMBER.sub('#', line) == _NUMBER.sub('#', expected_line)
+        assert np.allclose([float(n) for n in _NUMBER.findall(line)],
+                [float(n) for n in _NUMBER.findall(expected_line)],
+                rtol=1e-4, atol=1e-5)
+
+@pytest.mark.parametrize("freq, first", [(0, 0), (3, 4)])
+def test_update_with_trainer(tmpdir, freq, first):
+    np.random.seed(0)
+    features = np.random.rand(40, 2).astype(np.float32)
+    targets = np.eye(2, dtype=np.float32)[np.random.randint(0, 2, 40)]
+    trainer, in1, labels = _classifier_trainer()
+
+    printers = {}
+    for name in ('trainer', 'per_minibatch', 'second'):
+        printers[name] = ProgressPrinter(freq=freq, first=first,
+                log_to_file=str(tmpdir / name))
+
+    for epoch in range(2):
+        for begin in range(0, 40, 3):
+            end = min(begin + 3, 40)
+            trainer.train_minibatch({in1: features[begin:end],
+                labels: targets[begin:end]})
+
+            printers['trainer'].update_with_trainer(trainer, with_metric=True)
+            # how the printer used to read every minibatch
+            printers['per_minibatch'].update(
+                    trainer.previous_minibatch_loss_average,
+                    trainer.previous_minibatch_sample_count,
+                    trainer.previous_minibatch_evaluation_average)
+            # a second printer of the trainer reads every minibatch too
+            printers['second'].update_with_trainer(trainer, with_metric=True)
+
+        for printer in printers.values():
+            printer.epoch_summary(with_metric=True)
+
+    logs = dict((name, _read_log(str(tmpdir / name))) for name in printers)
+    assert len(logs['trainer']) > 5
+    _assert_same_log(logs['trainer'], logs['per_minibatch'])
+    _assert_same_log(logs['second'], logs['per_minibatch'])
@@ -69,6 +69,17 @@ def test_get_data_type():
     assert get_data_type(pa32, pl, n64) == np.float32
     assert get_data_type(pa64, pl, n64) == np.float64
 
+    # lists and numbers count as float32
+    assert get_data_type([[1, 2], [3, 4]]) == np.float32
+    assert get_data_type(1.5, n64) == np.float64
+    assert get_data_type(pa64, [1, 2]) == np.float64
+
+    # the type of CNTK objects is remembered
+    assert pa64.__dict__['_data_type'] == np.float64
+    f = plus(pa64, c)
+    assert get_data_type(f) == np.float64
+    assert get_data_type(f, n32) == np.float64
+
 def test_sanitize_batch_sparse():
     batch = [csr([[1,0,2],[2,3,0]]),
              csr([5,0,1])]
@@ -119,3 +130,207 @@ def test_sanitize_batch_contiguity():
     b = sanitize_batch(var, batch)
     assert b.shape == (2,1,2,2)
 
+
+def test_as_padded_array():
+    var = input_variable(())
+    value = sanitize_batch(var, [AA([5, 6, 7]), AA([8])], [True, False])
+
+    padded = value.as_padded_array()
+    assert padded.data.shape[:2] == (2, 3)
+    assert np.allclose(padded.mask, [[2, 1, 1], [1, 0, 0]])
+    assert list(padded.lengths) == [3, 1]
+
+    sequences = padded.sequences()
+    assert np.allclose(sequences[0], [5, 6, 7])
+    assert np.allclose(sequences[1], [8])
+    # the sequences share the memory of the padded array
+    assert np.may_share_memory(sequences[1], padded.data)
+    assert np.allclose(padded.sequence(1), [8])
+
+    for res, exp in zip(value_to_seq(value), sequences):
+        assert np.allclose(res, exp)
+
+def test_padded_array_unmasking():
+    data = np.arange(6, dtype=np.float32).reshape(2, 3)
+    mask = AA([[2, 0, 1], [2, 1, 1]], dtype=np.int8)
+    padded = PaddedArray(data, mask, AA([2, 3]))
+    assert np.allclose(padded.sequence(0), [0, 2])
+    assert np.allclose(padded.sequences()[1], [3, 4, 5])
+
+    unmasked = PaddedArray(data, None, AA([3, 3]))
+    assert unmasked.sequences() is data
+    copied = unmasked.copy()
+    assert not np.may_share_memory(copied.data, data)
+
+@pytest.mark.parametrize("shape, batch_shape", [
+    ((), (4,)),
+    ((2,), (4, 2)),
+    ((2,), (4, 3, 2)),
+    ((2, 3), (1, 2, 3)),
+])
+def test_value_create_dense_batch(shape, batch_shape):
+    var = input_variable(shape)
+    batch = np.arange(np.prod(batch_shape), dtype=np.float32).reshape(batch_shape)
+
+    value = Value.create(var, batch)
+    expected = Value.create(var, list(batch))
+    assert value.shape == expected.shape
+    assert np.allclose(np.asarray(value), np.asarray(expected))
+
+    # integer data is converted to the type of the variable
+    value = Value.create(var, batch.astype(int))
+    assert np.allclose(np.asarray(value), np.asarray(expected))
+
+def test_value_create_dense_batch_falls_back():
+    var = input_variable((2,))
+    batch = np.arange(12, dtype=np.float32).reshape(2, 3, 2)
+
+    # continued sequences need a mask, which the per-sequence path creates
+    value = Value.create(var, batch, seq_starts=[True, False])
+    assert np.allclose(value.mask, [[2, 1, 1], [1, 1, 1]])
+
+    transposed = np.arange(12, dtype=np.float32).reshape(2, 2, 3).transpose(0, 2, 1)
+    with pytest.raises(ValueError):
+        Value.create(var, transposed)
+
+def test_sanitize_var_map_binding_plan():
+    from cntk.utils import _BINDING_PLAN_ATTRIBUTE
+
+    x = input_variable(1, name='x')
+    y = input_variable(1, name='y')
+    p = placeholder_variable(shape=(1,))
+    f = plus(plus(x, y), p)
+
+    data = AA([[1]], dtype=np.float32)
+    var_map = sanitize_var_map(f, {'x': data, 'y': data})
+    assert set(v.name for v in var_map) == {'x', 'y'}
+    assert _BINDING_PLAN_ATTRIBUTE in f.__dict__
+
+    with pytest.raises(ValueError):
+        sanitize_var_map(f, {'x': data, 'z': data})
+
+    # replacing the placeholder adds an argument to the graph
+    z = input_variable(1, name='z')
+    f.replace_placeholders({p: z})
+    var_map = sanitize_var_map(f, {'x': data, 'y': data, 'z': data})
+    assert set(v.name for v in var_map) == {'x', 'y', 'z'}
+
+    # names that occur more than once cannot be used
+    g = plus(x, input_variable(1, name='x'))
+    with pytest.raises(ValueError):
+        sanitize_var_map(g, {'x': data, 'y': data})
+
+def test_value_buffer_pool():
+    x = input_variable(2)
+    pool = ValueBufferPool(max_size=2)
+    data = np.arange(8, dtype=np.float32).reshape(4, 2)
+
+    first = pool.value(x, data)
+    assert np.allclose(np.asarray(first)[:, 0, :], data)
+    second = pool.value(x, data + 1)
+    assert len(pool) == 1
+    # the memory is reused, so both values refer to the same data
+    assert np.allclose(np.asarray(first)[:, 0, :], data + 1)
+    assert np.allclose(np.asarray(second)[:, 0, :], data + 1)
+
+    # lists and continued sequences are not pooled
+    assert pool.value(x, list(data)) is None
+    assert pool.value(x, data, seq_starts=[True, False, True, True]) is None
+
+    pool.value(x, data[:2])
+    pool.value(x, data[:3])
+    assert len(pool) == 2
+
+    f = plus(x, 1)
+    for i in range(3):
+        _, out = f.forward({x: data * i}, f.outputs, buffer_pool=pool)
+        assert np.allclose(list(out.values())[0][:, 0, :], data * i + 1)
+    assert len(pool) == 2
+
+    pool.clear()
+    assert len(pool) == 0
+
+def test_value_buffer_pool_variables_and_threads():
+    import threading
+
+    # variables of different graphs get their own buffers, even if their
+    # uids are the same
+    x = input_variable(2)
+    pool = ValueBufferPool()
+    data = np.arange(8, dtype=np.float32).reshape(4, 2)
+    pool.value(x, data)
+    pool.value(input_variable(2), data)
+    assert len(pool) == 2
+
+    # the pool belongs to the thread that used it first
+    errors = []
+    def use_pool():
+        try:
+            pool.value(x, data)
+        except RuntimeError as e:
+            errors.append(e)
+    thread = threading.Thread(target=use_pool)
+    thread.start()
+    thread.join()
+    assert len(errors) == 1
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_one_hot_from_flat_indices(dtype):
+    num_classes = 6
+    i0 = input_variable(shape=num_classes, is_sparse=True, dtype=dtype)
+    z = times(i0, np.eye(num_classes, dtype=dtype))
+
+    expected = z.eval({i0: one_hot([[1, 5], [4], [2, 3, 0]], num_classes,
+        dtype=dtype)})
+
+    indices = AA([1, 5, 4, 2, 3, 0], dtype=np.int32)
+    for kw in [dict(sequence_lengths=[2, 1, 3]),
+               dict(sequence_offsets=[0, 2, 3, 6])]:
+        result = z.eval({i0: one_hot(indices, num_classes, dtype=dtype, **kw)})
+        assert len(result) == len(expected)
+        for res, exp in zip(result, expected):
+            assert res.dtype == dtype
+            assert np.allclose(res, exp)
+
+    # every row of a 2-dimensional array is a sequence
+    result = z.eval({i0: one_hot(AA([[1, 5], [4, 2]]), num_classes, dtype=dtype)})
+    assert np.allclose(result, [[np.eye(6)[1], np.eye(6)[5]],
+                                [np.eye(6)[4], np.eye(6)[2]]])
+
+    with pytest.raises(ValueError):
+        one_hot(indices, num_classes, sequence_lengths=[2, 2])
+    with pytest.raises(ValueError):
+        one_hot(indices, 5, sequence_lengths=[6])
+
+def test_value_create_from_csr():
+    dim = 4
+    in1 = input_variable(shape=(dim,), is_sparse=True)
+    z = times(in1, 2 * np.eye(dim, dtype=np.float32))
+
+    data = csr(AA([[0, 2, 0, 7], [10, 20, 0, 0], [0, 0, 0, 3],
+                   [1, 0, 0, 0], [0, 0, 5, 0]], dtype=np.float32))
+    offsets = [0, 2, 3, 5]
+    expected = z.eval({in1: [data[0:2], data[2:3], data[3:5]]})
+
+    value = Value.create_from_csr(in1, data, offsets)
+    result = z.eval({in1: value})
+    assert len(result) == len(expected)
+    for res, exp in zip(result, expected):
+        assert np.allclose(res, exp)
+
+    # a single CSR matrix is a batch of sequences of length 1
+    result = z.eval({in1: data})
+    assert np.allclose(result, 2 * data.toarray()[:, np.newaxis, :])
+
+    # spare capacity behind the nonzeros, as left by SciPy before prune()
+    spare = data.copy()
+    spare.data = np.append(spare.data, [99, 99]).astype(np.float32)
+    spare.indices = np.append(spare.indices, [1, 2]).astype(spare.indices.dtype)
+    result = z.eval({in1: Value.create_from_csr(in1, spare, offsets)})
+    for res, exp in zip(result, expected):
+        assert np.allclose(res, exp)
+
+    with pytest.raises(ValueError):
+        Value.create_from_csr(in1, data, [0, 2, 4])
+    with pytest.raises(ValueError):
+        Value.create_from_csr(in1, data.tocsc(), offsets)
@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Compares the time of :meth:`~cntk.utils.Value.create` for a full minibatch
+passed as one NumPy array, which creates a single NDArrayView, with the
+same minibatch passed as a list of samples, which creates one NDArrayView
+per sample. Run it with::
+
+    python -m cntk.utils.tests.value_create_benchmark
+'''
+
+import timeit
+import numpy as np
+
+BATCH_SIZES = [1, 4, 16, 64, 256, 1024, 4096]
+
+def benchmark_value_create(sample_shape=(784,), batch_sizes=BATCH_SIZES,
+        repeat=5):
+    '''
+    Returns a list of ``(batch size, seconds per call for one array,
+    seconds per call for a list of samples)``.
+    '''
+    from cntk.ops import input_variable
+    from cntk.utils import Value
+
+    var = input_variable(sample_shape)
+    results = []
+    for batch_size in batch_sizes:
+        batch = np.random.rand(batch_size, *sample_shape).astype(np.float32)
+        samples = list(batch)
+        number = max(1, 4096 // batch_size)
+
+        bulk = min(timeit.repeat(lambda: Value.create(var, batch),
+            repeat=repeat, number=number)) / number
+        per_sample = min(timeit.repeat(lambda: Value.create(var, samples),
+            repeat=repeat, number=number)) / number
+        results.append((batch_size, bulk, per_sample))
+
+    return results
+
+if __name__ == '__main__':
+    print('%10s %14s %14s %8s' % ('batch size', 'array [ms]', 'list [ms]',
+        'speedup'))
+    for batch_size, bulk, per_sample in benchmark_value_create():
+        print('%10i %14.3f %14.3f %7.1fx' % (batch_size, bulk * 1e3,
+            per_sample * 1e3, per_sample / bulk))